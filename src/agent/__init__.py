@@ -1,10 +1,15 @@
-from .model_loader import (
-    load_local_model,
-    generate_local
-    )
+# model_loader is resolved lazily so importing the package does not pull in
+# torch and transformers
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import model_loader
+        return getattr(model_loader, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 __all__ = [
     "load_local_model",
     "generate_local"
-]
\ No newline at end of file
+]
@@ -1,8 +1,27 @@
+import json
 import time
-from typing import Dict, Any, List
-from src.infra.vector_store import query_context, add_context
-from src.agent.model_loader import load_local_model, generate_local
-from src.agent.remote_qwen_tool import qwen3_infer, should_use_remote
+from typing import Dict, Any, Iterator, List
+from src.infra.vector_store import (
+    query_diverse,
+    lexical_query,
+    is_confident_lexical,
+    strong_lexical_hits,
+    fuse_results
+)
+from src.infra.write_queue import save_memory
+from src.agent.model_loader import generate_local, stream_local
+from src.agent.model_pool import model_pool
+from src.agent.remote_qwen_tool import (
+    qwen3_infer,
+    qwen3_infer_stream,
+    should_use_remote
+)
+from src.agent.context_packer import (
+    LOCAL_CONTEXT_TOKEN_BUDGET,
+    REMOTE_CONTEXT_TOKEN_BUDGET,
+    get_remote_tokenizer,
+    pack_context
+)
 
 
 class AgentState:
@@ -11,46 +30,63 @@ class AgentState:
         self.user_input = ""
         self.user_id = ""
         self.retrieved_context = []
+        self.retrieved_items = []
+        self.context_tokens = 0
         self.use_remote = False
         self.final_response = ""
         self.memory_items = []
 
 
-# Global model loading (lazy initialization)
-_local_tokenizer = None
-_local_model = None
+_EMPTY_RESPONSE = ("I'd be happy to help you with that. Could you provide a "
+                   "bit more context or rephrase your question?")
 
 
-def get_local_model():
-    """Lazy load local model"""
-    global _local_tokenizer, _local_model
-    if _local_tokenizer is None or _local_model is None:
-        print("Loading local model...")
-        _local_tokenizer, _local_model = load_local_model()
-    return _local_tokenizer, _local_model
+def get_local_model(model_id=None):
+    """Tokenizer and model from the model pool (LOCAL_MODEL_ID by default)"""
+    return model_pool.get(model_id)
 
 
 def retrieve_context_node(state: AgentState) -> AgentState:
-    """Retrieve relevant context from vector store"""
+    """Retrieve relevant context with hybrid BM25 + vector search
+
+    A confident keyword hit is used directly, skipping the embedding
+    forward pass; otherwise dense and lexical rankings are merged with
+    reciprocal-rank fusion. The dense side drops far-away memories and
+    diversifies with MMR, and only lexical hits above
+    LEXICAL_FUSION_MIN_SCORE are fused, so there may be fewer than 5 items.
+    """
     try:
-        results = query_context(state.user_input, top_k=5)
+        lexical = lexical_query(state.user_input, top_k=5, user_id=state.user_id)
+        if is_confident_lexical(lexical):
+            print("Confident keyword match, skipping vector search")
+            results = lexical
+        else:
+            dense = query_diverse(state.user_input, top_k=5, user_id=state.user_id)
+            results = fuse_results([dense, strong_lexical_hits(lexical)], top_k=5)
         
-        # Format retrieved context for prompt
+        # Format retrieved context for prompt, keeping each item's score
         context_texts = []
+        items = []
         if results.get("documents") and results["documents"][0]:
+            scores = (results.get("scores") or [[]])[0]
             for i, doc in enumerate(results["documents"][0]):
                 metadatas = results.get("metadatas", [{}])
-                metadata = metadatas[0][i] if metadatas else {}
+                metadata = (metadatas[0][i] if metadatas else {}) or {}
                 source = metadata.get("source", f"memory_{i}")
-                context_texts.append(f"[{source}]: {doc}")
+                text = f"[{source}]: {doc}"
+                context_texts.append(text)
+                score = scores[i] if i < len(scores) else 1.0 / (i + 1)
+                items.append({"text": text, "score": score})
         
         state.retrieved_context = context_texts
+        state.retrieved_items = items
         print(f"Retrieved {len(context_texts)} context items")
         return state
         
     except Exception as e:
         print(f"Context retrieval error: {e}")
         state.retrieved_context = []
+        state.retrieved_items = []
         return state
 
 
@@ -64,47 +100,56 @@ def decide_model_node(state: AgentState) -> AgentState:
     return state
 
 
+def _remote_messages(state: AgentState) -> List[Dict[str, str]]:
+    """Chat messages for the remote model, with packed context"""
+    # Pack the best context into the remote prompt budget
+    packed = pack_context(state.retrieved_items, REMOTE_CONTEXT_TOKEN_BUDGET,
+                          get_remote_tokenizer())
+    state.context_tokens = packed["tokens"]
+    context_str = packed["text"] or "No relevant context found."
+
+    # Use remote Qwen3-30B for complex tasks
+    system_content = ("You are a helpful AI assistant. Use the "
+                      "provided context to answer accurately. If "
+                      "context is not relevant, answer based on "
+                      "your knowledge.")
+    user_content = (f"Context:\n{context_str}\n\n"
+                   f"Question: {state.user_input}")
+    
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": user_content}
+    ]
+
+
+def _local_prompt(state: AgentState, tokenizer) -> str:
+    """Prompt for the local model, with packed context"""
+    packed = pack_context(state.retrieved_items, LOCAL_CONTEXT_TOKEN_BUDGET,
+                          tokenizer)
+    state.context_tokens = packed["tokens"]
+    
+    # For DialoGPT, create a more informative conversation format
+    if packed["text"]:
+        # Build a conversation with the packed context
+        return f"Based on this information: {packed['text']}\n\nUser: {state.user_input}\nAssistant:"
+    # Simple conversation format with helpful starter
+    return f"User: {state.user_input}\nAssistant:"
+
+
 def generate_response_node(state: AgentState) -> AgentState:
     """Generate response using appropriate model"""
     try:
-        # Build prompt with context
-        if state.retrieved_context:
-            context_str = "\n".join(state.retrieved_context)
-        else:
-            context_str = "No relevant context found."
-        
         if state.use_remote:
-            # Use remote Qwen3-30B for complex tasks
-            system_content = ("You are a helpful AI assistant. Use the "
-                              "provided context to answer accurately. If "
-                              "context is not relevant, answer based on "
-                              "your knowledge.")
-            user_content = (f"Context:\n{context_str}\n\n"
-                           f"Question: {state.user_input}")
-            
-            messages = [
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": user_content}
-            ]
-            
-            response = qwen3_infer(messages, max_tokens=512)
+            response = qwen3_infer(_remote_messages(state), max_tokens=512)
             
         else:
-            # Use local model for quick responses
-            tokenizer, model = get_local_model()
-            
-            # For DialoGPT, create a more informative conversation format
-            if context_str and "No relevant context found" not in context_str:
-                # Build a conversation with relevant context
-                context_summary = context_str[:300] + "..." if len(context_str) > 300 else context_str
-                prompt = f"Based on this information: {context_summary}\n\nUser: {state.user_input}\nAssistant:"
-            else:
-                # Simple conversation format with helpful starter
-                prompt = f"User: {state.user_input}\nAssistant:"
-            
-            response = generate_local(
-                tokenizer, model, prompt, max_new_tokens=128
-            )
+            # Use local model for quick responses; holding it keeps the
+            # pool from unloading it mid-request
+            with model_pool.use() as (tokenizer, model):
+                response = generate_local(
+                    tokenizer, model, _local_prompt(state, tokenizer), max_new_tokens=128,
+                    user_id=state.user_id
+                )
             
             # Post-process response to make it more helpful
             if response and len(response.strip()) > 0:
@@ -112,7 +157,7 @@ def generate_response_node(state: AgentState) -> AgentState:
                 if len(response.strip()) < 10 or response.strip().lower() in ["yes", "no", "ok", "sure"]:
                     response = f"I understand your question about '{state.user_input}'. {response} Could you provide more details so I can give you a better answer?"
             else:
-                response = "I'd be happy to help you with that. Could you provide a bit more context or rephrase your question?"
+                response = _EMPTY_RESPONSE
         
         state.final_response = response
         return state
@@ -123,8 +168,41 @@ def generate_response_node(state: AgentState) -> AgentState:
         return state
 
 
+def generate_response_stream(state: AgentState) -> Iterator[str]:
+    """Stream the response token by token, then set state.final_response
+
+    Pieces that were already sent cannot be rewritten, so unlike
+    generate_response_node only an empty local reply is replaced.
+    """
+    pieces = []
+    try:
+        if state.use_remote:
+            for piece in qwen3_infer_stream(_remote_messages(state), max_tokens=512):
+                pieces.append(piece)
+                yield piece
+        else:
+            with model_pool.use() as (tokenizer, model):
+                for piece in stream_local(
+                    tokenizer, model, _local_prompt(state, tokenizer), max_new_tokens=128
+                ):
+                    pieces.append(piece)
+                    yield piece
+        if not "".join(pieces).strip():
+            pieces = [_EMPTY_RESPONSE]
+            yield _EMPTY_RESPONSE
+    except Exception as e:
+        print(f"Response generation error: {e}")
+        pieces.append(f"Sorry, I encountered an error: {str(e)}")
+        yield pieces[-1]
+    state.final_response = "".join(pieces).strip()
+
+
 def save_memory_node(state: AgentState) -> AgentState:
-    """Save important information to memory"""
+    """Save important information to memory
+
+    Writes go through the write-behind queue, so the response is not held
+    up by embedding and storing the memories.
+    """
     try:
         # Check if user wants to save something specific
         user_text = state.user_input.lower()
@@ -141,7 +219,7 @@ def save_memory_node(state: AgentState) -> AgentState:
                         "timestamp": time.time(),
                         "user_id": state.user_id
                     }
-                    add_context(memory_text, metadata)
+                    save_memory(memory_text, metadata)
                     state.memory_items.append(memory_text)
                     print(f"Saved to memory: {memory_text}")
         
@@ -154,7 +232,7 @@ def save_memory_node(state: AgentState) -> AgentState:
             "user_id": state.user_id,
             "type": "qa_pair"
         }
-        add_context(conversation_text, metadata)
+        save_memory(conversation_text, metadata)
         
         return state
         
@@ -197,12 +275,69 @@ def run_agent(
     # Step 4: Save memory
     state = save_memory_node(state)
     
+    return _agent_result(state, start_time)
+
+
+def run_agent_stream(
+    user_input: str,
+    user_id: str = "default_user"
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streaming agent pipeline: same steps as run_agent, yielding events
+
+    Yields ``{"event": "start", ...}`` once the model is chosen, one
+    ``{"event": "token", "text": ...}`` per generated piece, and finally
+    ``{"event": "done", ...}`` with run_agent's result. Memory is saved
+    after the stream completes.
+    """
+    state = AgentState()
+    state.user_input = user_input
+    state.user_id = user_id
+    start_time = time.time()
+
+    state = retrieve_context_node(state)
+    state = decide_model_node(state)
+    yield {
+        "event": "start",
+        "model_used": "remote" if state.use_remote else "local",
+        "context_items": len(state.retrieved_context)
+    }
+
+    for piece in generate_response_stream(state):
+        yield {"event": "token", "text": piece}
+
+    state = save_memory_node(state)
+    yield {"event": "done", **_agent_result(state, start_time)}
+
+
+def run_agent_sse(
+    user_input: str,
+    user_id: str = "default_user"
+) -> Iterator[str]:
+    """run_agent_stream encoded as Server-Sent Events
+
+    The ``done`` event's reply is under ``reply``, as in /ask. An exception
+    mid-stream ends it with an ``error`` event, since the status code has
+    already been sent.
+    """
+    try:
+        for event in run_agent_stream(user_input, user_id):
+            name = event.pop("event")
+            if name == "done":
+                event["reply"] = event.pop("response")
+            yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': f'Agent error: {e}'})}\n\n"
+
+
+def _agent_result(state: AgentState, start_time: float) -> Dict[str, Any]:
     end_time = time.time()
     
     return {
         "response": state.final_response,
         "model_used": "remote" if state.use_remote else "local",
         "context_items": len(state.retrieved_context),
+        "context_tokens": state.context_tokens,
         "memory_saved": state.memory_items,
         "processing_time": round(end_time - start_time, 2)
     }
@@ -0,0 +1,219 @@
+"""Memory compaction: TTL eviction, per-user quotas and qa_pair consolidation
+
+Only automatically saved memories are compacted: conversation memories
+(``type: qa_pair``) are merged into ``type: summary`` memories, and both
+are subject to the TTL and the per-user quota. Explicit ``remember:``
+memories (``source: user_request``) are excluded by every filter used
+here and are never evicted or merged.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.infra.vector_store import (
+    add_context,
+    delete_ids,
+    delete_where,
+    get_store,
+    partition_for,
+    scan_memory
+)
+
+# Age after which qa_pair and summary memories are evicted (0 disables)
+MEMORY_TTL_SECONDS = float(os.getenv("MEMORY_TTL_SECONDS", str(30 * 24 * 3600)))
+# Maximum qa_pair and summary memories kept per user (0 disables)
+MEMORY_USER_QUOTA = int(os.getenv("MEMORY_USER_QUOTA", "1000"))
+# qa_pairs older than this are merged into summary memories
+CONSOLIDATE_AFTER_SECONDS = float(os.getenv("CONSOLIDATE_AFTER_SECONDS", str(24 * 3600)))
+CONSOLIDATE_GROUP_SIZE = int(os.getenv("CONSOLIDATE_GROUP_SIZE", "10"))
+# Seconds between background compaction passes (0 disables the worker)
+MEMORY_COMPACTION_INTERVAL = float(os.getenv("MEMORY_COMPACTION_INTERVAL", "0"))
+
+# Conversation memories eligible for consolidation
+CONVERSATION_WHERE = {"$and": [
+    {"type": "qa_pair"},
+    {"source": {"$ne": "user_request"}}
+]}
+# Memories subject to the TTL and the quota: conversations and the
+# summaries they were consolidated into
+RETAINED_WHERE = {"$and": [
+    {"type": {"$in": ["qa_pair", "summary"]}},
+    {"source": {"$ne": "user_request"}}
+]}
+
+
+def _conversation_where(extra: Optional[dict] = None,
+                        base: dict = CONVERSATION_WHERE) -> dict:
+    if extra is None:
+        return base
+    return {"$and": base["$and"] + [extra]}
+
+
+def evict_expired(max_age: float = MEMORY_TTL_SECONDS,
+                  user_id: Optional[str] = None) -> int:
+    """Delete qa_pair and summary memories older than max_age seconds"""
+    if max_age <= 0:
+        return 0
+    cutoff = time.time() - max_age
+    return delete_where(
+        _conversation_where({"timestamp": {"$lt": cutoff}}, RETAINED_WHERE),
+        user_id=user_id
+    )
+
+
+def _conversation_items(user_id: str, where: dict,
+                        include: List[str]) -> List[Dict[str, Any]]:
+    """(id, timestamp, document) records for a user's matching qa_pairs"""
+    items = []
+    for page in scan_memory(where=where, include=include, user_id=user_id):
+        documents = page.get("documents") or [None] * len(page["ids"])
+        for doc_id, metadata, document in zip(page["ids"], page["metadatas"], documents):
+            if (metadata or {}).get("user_id") != user_id:
+                continue
+            items.append({
+                "id": doc_id,
+                "timestamp": (metadata or {}).get("timestamp", 0),
+                "document": document
+            })
+    items.sort(key=lambda item: item["timestamp"])
+    return items
+
+
+def enforce_user_quota(user_id: str, max_items: int = MEMORY_USER_QUOTA) -> int:
+    """Delete a user's oldest qa_pair and summary memories beyond max_items"""
+    if max_items <= 0:
+        return 0
+    where = _conversation_where({"user_id": user_id}, RETAINED_WHERE)
+    items = _conversation_items(user_id, where, include=["metadatas"])
+    excess = [item["id"] for item in items[:max(0, len(items) - max_items)]]
+    if excess:
+        delete_ids(excess, get_store(partition_for(user_id)))
+    return len(excess)
+
+
+def summarize_with_local_model(texts: List[str]) -> str:
+    """Summarize conversation memories with the local model
+
+    Falls back to an extractive summary (the user's questions) when the
+    model is unavailable or returns nothing useful.
+    """
+    questions = []
+    for text in texts:
+        first_line = text.split("\n", 1)[0]
+        questions.append(first_line.replace("User asked:", "").strip())
+    extractive = "Earlier conversations covered: " + "; ".join(q for q in questions if q)
+
+    try:
+        from src.agent.model_loader import MockModel, generate_local
+        from src.agent.model_pool import model_pool
+        with model_pool.use() as (tokenizer, model):
+            if isinstance(model, MockModel):
+                return extractive
+            prompt = ("Summarize the key facts from these conversations:\n"
+                      + "\n".join(texts)[:2000] + "\nSummary:")
+            summary = generate_local(tokenizer, model, prompt, max_new_tokens=96,
+                                     background=True)
+        if summary and len(summary.split()) >= 5:
+            return f"Summary of earlier conversations: {summary}"
+    except Exception as e:
+        print(f"Consolidation summary error: {e}")
+    return extractive
+
+
+def consolidate_user(
+    user_id: str,
+    older_than: float = CONSOLIDATE_AFTER_SECONDS,
+    group_size: int = CONSOLIDATE_GROUP_SIZE,
+    summarize: Optional[Callable[[List[str]], str]] = None
+) -> int:
+    """Merge a user's old qa_pairs into summary memories
+
+    Returns the number of summaries written. Each group of up to
+    group_size qa_pairs is replaced by one ``type: summary`` memory.
+    """
+    summarize = summarize or summarize_with_local_model
+    cutoff = time.time() - older_than
+    where = _conversation_where({"timestamp": {"$lt": cutoff}})
+    items = _conversation_items(user_id, where, include=["metadatas", "documents"])
+    partition_store = get_store(partition_for(user_id))
+
+    written = 0
+    for start in range(0, len(items), group_size):
+        group = items[start:start + group_size]
+        if len(group) < 2:
+            break
+        summary = summarize([item["document"] for item in group])
+        add_context(summary, {
+            "source": "consolidation",
+            "type": "summary",
+            "user_id": user_id,
+            "timestamp": group[-1]["timestamp"],
+            "merged_items": len(group)
+        })
+        delete_ids([item["id"] for item in group], partition_store)
+        written += 1
+    return written
+
+
+def list_memory_users() -> List[str]:
+    """User ids that own conversation or summary memories"""
+    users = set()
+    for page in scan_memory(where=RETAINED_WHERE, include=["metadatas"]):
+        for metadata in page["metadatas"]:
+            user_id = (metadata or {}).get("user_id")
+            if user_id:
+                users.add(user_id)
+    return sorted(users)
+
+
+def run_compaction(summarize: Optional[Callable[[List[str]], str]] = None) -> Dict[str, int]:
+    """Run one full compaction pass and report what was done"""
+    report = {"expired": evict_expired(), "over_quota": 0, "summaries": 0}
+    for user_id in list_memory_users():
+        report["summaries"] += consolidate_user(user_id, summarize=summarize)
+        report["over_quota"] += enforce_user_quota(user_id)
+    return report
+
+
+class CompactionWorker:
+    """Background thread that runs run_compaction at a fixed interval
+
+    The thread lowers its own scheduling priority (where the OS allows
+    per-thread niceness) so summarization does not compete with requests.
+    """
+
+    def __init__(self, interval: float = MEMORY_COMPACTION_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="memory-compaction", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_report = run_compaction()
+                print(f"Memory compaction: {self.last_report}")
+            except Exception as e:
+                print(f"Memory compaction error: {e}")
+
+
+compaction_worker = CompactionWorker()
@@ -0,0 +1,145 @@
+"""Token-budgeted packing of retrieved context into the prompt
+
+Retrieved items are ranked by retrieval score, near-duplicates (high word
+overlap with an item already kept) are dropped, and the rest are packed
+greedily into the backend's token budget, counted with the backend's own
+tokenizer.
+"""
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from src.agent.model_loader import tokenizer_lock
+from src.infra.lexical_index import tokenize
+from src.infra.single_flight import SingleFlight
+
+# Prompt tokens available for retrieved context on each backend
+LOCAL_CONTEXT_TOKEN_BUDGET = int(os.getenv("LOCAL_CONTEXT_TOKEN_BUDGET", "384"))
+REMOTE_CONTEXT_TOKEN_BUDGET = int(os.getenv("REMOTE_CONTEXT_TOKEN_BUDGET", "2048"))
+# Word-set Jaccard overlap above which an item counts as a near-duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Seconds to estimate tokens after the remote tokenizer failed to load
+# before trying to load it again
+REMOTE_TOKENIZER_RETRY_SECONDS = float(os.getenv("REMOTE_TOKENIZER_RETRY_SECONDS", "300"))
+
+# Tokens per whitespace word, used when no real tokenizer is available
+_WORDS_TO_TOKENS = 4 / 3
+
+
+def count_tokens(text: str, tokenizer: Any = None) -> int:
+    """Number of tokens the tokenizer produces for text (no special tokens)"""
+    if tokenizer is not None and hasattr(tokenizer, "encode"):
+        try:
+            with tokenizer_lock(tokenizer):
+                return len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception:
+            pass
+    return int(len(text.split()) * _WORDS_TO_TOKENS + 0.5)
+
+
+def _truncate(text: str, max_tokens: int, tokenizer: Any = None) -> str:
+    if tokenizer is not None and hasattr(tokenizer, "encode"):
+        try:
+            with tokenizer_lock(tokenizer):
+                ids = tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+                return tokenizer.decode(ids, skip_special_tokens=True)
+        except Exception:
+            pass
+    return " ".join(text.split()[:int(max_tokens / _WORDS_TO_TOKENS)])
+
+
+def _is_near_duplicate(terms: set, kept: List[set], threshold: float) -> bool:
+    for other in kept:
+        union = len(terms | other)
+        if union and len(terms & other) / union >= threshold:
+            return True
+    return False
+
+
+def pack_context(
+    items: List[Dict[str, Any]],
+    budget: int,
+    tokenizer: Any = None,
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+    separator: str = "\n"
+) -> Dict[str, Any]:
+    """Pack ``{"text", "score"}`` items into at most ``budget`` tokens
+
+    Items are taken best score first; an item that does not fit is skipped
+    so smaller lower-ranked items can still use the space. If not even the
+    best item fits, it is truncated to the budget rather than dropping all
+    context. Kept items stay in rank order.
+
+    Returns ``{"text", "tokens", "items", "duplicates", "skipped"}``.
+    """
+    ranked = sorted(items, key=lambda item: item.get("score") or 0.0, reverse=True)
+    sep_tokens = count_tokens(separator, tokenizer) if separator.strip() else 1
+    packed, kept_terms = [], []
+    used = duplicates = skipped = 0
+
+    for item in ranked:
+        text = item["text"]
+        terms = set(tokenize(text))
+        if _is_near_duplicate(terms, kept_terms, dedup_threshold):
+            duplicates += 1
+            continue
+        cost = count_tokens(text, tokenizer) + (sep_tokens if packed else 0)
+        if used + cost > budget:
+            if packed or budget <= 0:
+                skipped += 1
+                continue
+            text = _truncate(text, budget, tokenizer)
+            cost = count_tokens(text, tokenizer)
+        packed.append(text)
+        kept_terms.append(terms)
+        used += cost
+
+    return {
+        "text": separator.join(packed),
+        "tokens": used,
+        "items": len(packed),
+        "duplicates": duplicates,
+        "skipped": skipped
+    }
+
+
+# model id -> loaded remote tokenizer, and model id -> time of its last
+# failed load (retried after REMOTE_TOKENIZER_RETRY_SECONDS)
+_remote_tokenizers = {}
+_remote_tokenizer_failures = {}
+_remote_tokenizer_flight = SingleFlight()
+
+
+def get_remote_tokenizer(model_id: Optional[str] = None):
+    """Tokenizer of the remote model (downloaded once), or None if unavailable
+
+    Concurrent first calls share one download. After a failure tokens are
+    estimated until REMOTE_TOKENIZER_RETRY_SECONDS pass, then the load is
+    tried again.
+    """
+    if model_id is None:
+        from src.agent.remote_qwen_tool import REMOTE_MODEL_ID
+        model_id = REMOTE_MODEL_ID
+    tokenizer = _remote_tokenizers.get(model_id)
+    if tokenizer is not None:
+        return tokenizer
+    failed_at = _remote_tokenizer_failures.get(model_id)
+    if failed_at is not None and time.monotonic() - failed_at < REMOTE_TOKENIZER_RETRY_SECONDS:
+        return None
+    return _remote_tokenizer_flight.do(model_id, lambda: _load_remote_tokenizer(model_id))
+
+
+def _load_remote_tokenizer(model_id: str):
+    if model_id in _remote_tokenizers:
+        # Loaded by a flight that finished after our check
+        return _remote_tokenizers[model_id]
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_id, cache_dir="./models")
+    except Exception as e:
+        print(f"Remote tokenizer unavailable, estimating tokens: {e}")
+        _remote_tokenizer_failures[model_id] = time.monotonic()
+        return None
+    _remote_tokenizer_failures.pop(model_id, None)
+    _remote_tokenizers[model_id] = tokenizer
+    return tokenizer
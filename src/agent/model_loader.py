@@ -1,22 +1,89 @@
-"""import and manage local model loading and inference"""
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
+"""import and manage local model loading and inference
+
+torch and transformers are imported inside the functions that need them so
+importing this module (and everything that depends on it) stays cheap.
+"""
+import copy
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+
+from src.infra.cache import LRUCache
 
 # Local model options - now that we have HF auth, we can use better models
 # Good conversational model, manageable size
-LOCAL_MODEL_ID = "microsoft/DialoGPT-medium"
+LOCAL_MODEL_ID = os.getenv("LOCAL_MODEL_ID", "microsoft/DialoGPT-medium")
 # Alternative production options:
 # "mistralai/Mistral-7B-Instruct-v0.1"  # Better but larger
 # "Qwen/Qwen2.5-7B-Instruct"           # Even better but requires more VRAM
 # "distilgpt2"                          # Fallback for testing
 
+# Dynamic batching of concurrent generate_local calls: set LOCAL_BATCHING=0
+# to generate one prompt at a time
+LOCAL_BATCHING = os.getenv("LOCAL_BATCHING", "1") == "1"
+LOCAL_BATCH_MAX_SIZE = int(os.getenv("LOCAL_BATCH_MAX_SIZE", "8"))
+LOCAL_BATCH_WAIT_MS = float(os.getenv("LOCAL_BATCH_WAIT_MS", "10"))
+# Seconds a stream waits for the next token before giving up
+LOCAL_STREAM_TIMEOUT = float(os.getenv("LOCAL_STREAM_TIMEOUT", "60"))
+
+# Per-user prefix KV-cache: past_key_values of the prompt before the last
+# KV_PREFIX_MARKER (the context block) are kept under an LRU byte budget so
+# a follow-up only prefills what differs from the longest cached prefix
+LOCAL_KV_CACHE = os.getenv("LOCAL_KV_CACHE", "1") == "1"
+LOCAL_KV_CACHE_MAX_BYTES = int(os.getenv("LOCAL_KV_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+LOCAL_KV_CACHE_MAX_ENTRIES = int(os.getenv("LOCAL_KV_CACHE_MAX_ENTRIES", "256"))
+# Shortest shared prefix worth reusing: below this, prefilling the tokens
+# is cheaper than copying the cached entry
+LOCAL_KV_CACHE_MIN_MATCH = int(os.getenv("LOCAL_KV_CACHE_MIN_MATCH", "16"))
+KV_PREFIX_MARKER = "User:"
+
+# Local model device: "auto" (GPU when available), "cuda" or "cpu"
+LOCAL_DEVICE = os.getenv("LOCAL_DEVICE", "auto")
+# CPU mode precision: "auto" (bf16 if the CPU supports it, else int8
+# dynamic quantization), "bf16", "int8" or "fp32"
+LOCAL_CPU_DTYPE = os.getenv("LOCAL_CPU_DTYPE", "auto")
+# torch intra-op / inter-op threads in CPU mode (0 keeps torch's default)
+LOCAL_CPU_THREADS = int(os.getenv("LOCAL_CPU_THREADS", "0"))
+LOCAL_CPU_INTEROP_THREADS = int(os.getenv("LOCAL_CPU_INTEROP_THREADS", "0"))
+# Tokens/sec self-benchmark after loading: "cpu" (CPU mode only), "1" or "0"
+LOCAL_SELF_BENCHMARK = os.getenv("LOCAL_SELF_BENCHMARK", "cpu")
+
+# Speculative (assisted) decoding: a small draft model sharing the main
+# model's tokenizer proposes tokens that the main model verifies in one
+# forward pass. Configured per model as "model_id=draft_id" pairs, e.g.
+# LOCAL_DRAFT_MODELS="microsoft/DialoGPT-medium=microsoft/DialoGPT-small"
+LOCAL_DRAFT_MODELS = dict(
+    pair.split("=", 1) for pair in os.getenv("LOCAL_DRAFT_MODELS", "").split(",") if "=" in pair
+)
+# Tokens the draft proposes per step (adjusted by transformers as it goes)
+LOCAL_DRAFT_TOKENS = int(os.getenv("LOCAL_DRAFT_TOKENS", "5"))
+
+# model id -> how it was loaded (device, dtype, threads, load time, tokens/sec)
+load_reports = {}
+
+_STOP = object()
+# Serializes background generations so they take at most one model pass
+_background_lock = threading.Lock()
+
 
 def load_local_model(model_id=None, cache_dir="./models"):
-    """Load local quantized model for RTX 3050"""
+    """Load the local model: 4-bit on GPU, or the CPU mode
+
+    LOCAL_DEVICE=auto uses the GPU (bitsandbytes 4-bit, tuned for an RTX
+    3050) when CUDA is available and the CPU mode otherwise.
+    """
     model_id = model_id or LOCAL_MODEL_ID
     print(f"Attempting to load local model: {model_id}")
 
     try:
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
         tokenizer = AutoTokenizer.from_pretrained(
             model_id,
             cache_dir=cache_dir,
@@ -27,25 +94,44 @@ def load_local_model(model_id=None, cache_dir="./models"):
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
 
-        # Configure quantization for RTX 3050
-        from transformers import BitsAndBytesConfig
-        quantization_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_compute_dtype=torch.float16,
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_quant_type="nf4"
+        use_cpu = LOCAL_DEVICE == "cpu" or (
+            LOCAL_DEVICE == "auto" and not torch.cuda.is_available()
         )
+        start = time.perf_counter()
+        if use_cpu:
+            model, report = _load_cpu_model(model_id, cache_dir)
+        else:
+            # Configure quantization for RTX 3050
+            from transformers import BitsAndBytesConfig
+            quantization_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_compute_dtype=torch.float16,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4"
+            )
 
-        model = AutoModelForCausalLM.from_pretrained(
-            model_id,
-            cache_dir=cache_dir,
-            device_map="auto",
-            dtype=torch.float16,  # Updated parameter name
-            quantization_config=quantization_config,
-            trust_remote_code=True
-        )
+            model = AutoModelForCausalLM.from_pretrained(
+                model_id,
+                cache_dir=cache_dir,
+                device_map="auto",
+                dtype=torch.float16,  # Updated parameter name
+                quantization_config=quantization_config,
+                trust_remote_code=True
+            )
+            report = {"device": "cuda", "dtype": "nf4"}
+        report["load_seconds"] = round(time.perf_counter() - start, 2)
 
-        print(f"✅ Successfully loaded {model_id}")
+        draft_id = LOCAL_DRAFT_MODELS.get(model_id)
+        if draft_id:
+            report["draft_model"] = _load_draft_model(
+                model_id, draft_id, tokenizer, model, cache_dir, use_cpu
+            )
+
+        if LOCAL_SELF_BENCHMARK == "1" or (LOCAL_SELF_BENCHMARK == "cpu" and use_cpu):
+            report["tokens_per_second"] = benchmark_local_model(tokenizer, model)
+        load_reports[model_id] = report
+
+        print(f"✅ Successfully loaded {model_id}: {report}")
         return tokenizer, model
 
     except Exception as e:
@@ -54,47 +140,227 @@ def load_local_model(model_id=None, cache_dir="./models"):
         return MockTokenizer(), MockModel()
 
 
-def generate_local(tokenizer, model, prompt, max_new_tokens=256):
-    """Generate response using local model"""
-    if isinstance(model, MockModel):
-        return model.generate(prompt, max_new_tokens)
+CPU_DTYPES = ("bf16", "int8", "fp32")
 
-    # For DialoGPT, we need to format the conversation properly
-    # DialoGPT expects: conversation history + eos_token + user_input + eos_token
-    conversation_text = prompt + tokenizer.eos_token
-    
-    # Use tokenizer with proper attention mask handling
-    inputs = tokenizer(
-        conversation_text,
-        return_tensors="pt",
-        padding=True,
-        truncation=True,
-        max_length=1024,
-        return_attention_mask=True
+
+def cpu_supports_bf16(cpuinfo: str = "/proc/cpuinfo") -> bool:
+    """Whether the CPU has native bf16 matmul (AVX512-BF16 or AMX)"""
+    try:
+        with open(cpuinfo) as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def cpu_dtype_mode(requested=None, bf16_supported=None) -> str:
+    """Resolve LOCAL_CPU_DTYPE: "auto" is bf16 with native support, else int8"""
+    requested = requested or LOCAL_CPU_DTYPE
+    if requested == "auto":
+        if bf16_supported is None:
+            bf16_supported = cpu_supports_bf16()
+        return "bf16" if bf16_supported else "int8"
+    if requested not in CPU_DTYPES:
+        raise ValueError(f"Unknown LOCAL_CPU_DTYPE: {requested}")
+    return requested
+
+
+def _configure_cpu_threads() -> dict:
+    import torch
+
+    if LOCAL_CPU_THREADS:
+        torch.set_num_threads(LOCAL_CPU_THREADS)
+    if LOCAL_CPU_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(LOCAL_CPU_INTEROP_THREADS)
+        except RuntimeError:
+            # Only allowed before torch starts any inter-op work
+            pass
+    return {"threads": torch.get_num_threads(),
+            "interop_threads": torch.get_num_interop_threads()}
+
+
+def _conv1d_to_linear(model) -> int:
+    """Replace GPT-2 style Conv1D layers with equivalent nn.Linear layers
+
+    Dynamic quantization only rewrites nn.Linear; Conv1D is the same
+    affine map with a transposed weight.
+    """
+    import torch
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+                replaced += 1
+    return replaced
+
+
+def _load_cpu_model(model_id, cache_dir):
+    """Load for CPU inference: bf16 where supported, else int8 linears
+
+    LOCAL_CPU_DTYPE=auto picks bf16 on CPUs with native bf16 support and
+    dynamic int8 quantization of the linear layers (fp32 activations)
+    everywhere else; "bf16", "int8" and "fp32" force a mode.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    report = {"device": "cpu", **_configure_cpu_threads()}
+    mode = cpu_dtype_mode()
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        cache_dir=cache_dir,
+        dtype=torch.bfloat16 if mode == "bf16" else torch.float32,
+        trust_remote_code=True
     )
-    
-    input_ids = inputs['input_ids']
-    attention_mask = inputs['attention_mask']
+    model.eval()
+
+    if mode == "int8":
+        converted = _conv1d_to_linear(model)
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        report["converted_conv1d"] = converted
+    report["dtype"] = mode
+    return model, report
+
+
+# tokenizer -> RLock serializing every call into it. HF fast tokenizers
+# wrap a Rust object that each encode reconfigures (truncation, padding),
+# so concurrent calls from the scheduler, stream and request threads fail
+# with "Already borrowed"
+_tokenizer_locks = weakref.WeakKeyDictionary()
+_tokenizer_locks_guard = threading.Lock()
+_fallback_tokenizer_lock = threading.RLock()
+
+
+def tokenizer_lock(tokenizer):
+    """The lock to hold around any call into ``tokenizer``"""
+    with _tokenizer_locks_guard:
+        try:
+            lock = _tokenizer_locks.get(tokenizer)
+            if lock is None:
+                lock = _tokenizer_locks[tokenizer] = threading.RLock()
+        except TypeError:
+            lock = _fallback_tokenizer_lock
+    return lock
 
-    # Move to GPU if available
-    if torch.cuda.is_available():
-        input_ids = input_ids.to("cuda")
-        attention_mask = attention_mask.to("cuda")
 
+class _LockedTokenizer:
+    """Tokenizer proxy whose decode holds the tokenizer lock (for streamers)"""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+        self._lock = tokenizer_lock(tokenizer)
+
+    def decode(self, *args, **kwargs):
+        with self._lock:
+            return self._tokenizer.decode(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+
+def _decode(tokenizer, ids) -> str:
+    with tokenizer_lock(tokenizer):
+        return tokenizer.decode(ids, skip_special_tokens=True)
+
+
+def _load_draft_model(model_id, draft_id, tokenizer, model, cache_dir, use_cpu):
+    """Load and register the draft model for ``model``; returns its id or None
+
+    The draft must share the main model's vocabulary, since assisted
+    generation passes token ids between the two. It is loaded like the main
+    model on CPU, and in fp16 (not 4-bit; it is small) next to it on GPU.
+    """
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    try:
+        draft_tokenizer = AutoTokenizer.from_pretrained(draft_id, cache_dir=cache_dir)
+        if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+            print(f"⚠️ Draft model {draft_id} has a different vocabulary, speculative decoding off")
+            return None
+        if use_cpu:
+            draft, _ = _load_cpu_model(draft_id, cache_dir)
+        else:
+            draft = AutoModelForCausalLM.from_pretrained(
+                draft_id, cache_dir=cache_dir, dtype=torch.float16
+            ).to(model.device)
+            draft.eval()
+        draft.generation_config.num_assistant_tokens = LOCAL_DRAFT_TOKENS
+    except Exception as e:
+        print(f"⚠️ Failed to load draft model {draft_id}, speculative decoding off: {e}")
+        return None
+
+    with _drafts_lock:
+        _drafts[id(model)] = DraftModel(model_id, draft_id, draft)
+    print(f"✅ Speculative decoding for {model_id} with draft {draft_id}")
+    return draft_id
+
+
+def benchmark_local_model(tokenizer, model, new_tokens=32, prompt="User: Hello, how are you?\nAssistant:"):
+    """Greedy-decode a fixed number of tokens and return tokens/sec"""
+    import torch
+
+    with tokenizer_lock(tokenizer):
+        inputs = tokenizer(prompt, return_tensors="pt")
+    device = getattr(model, "device", "cpu")
+    input_ids = inputs["input_ids"].to(device)
     with torch.no_grad():
+        # Warm-up pass so one-time allocation is not measured
+        model.generate(input_ids=input_ids, max_new_tokens=2, do_sample=False,
+                       pad_token_id=tokenizer.eos_token_id)
+        start = time.perf_counter()
         outputs = model.generate(
             input_ids=input_ids,
-            attention_mask=attention_mask,
-            max_new_tokens=max_new_tokens,
-            do_sample=True,
-            temperature=0.7,
-            pad_token_id=tokenizer.eos_token_id,
-            eos_token_id=tokenizer.eos_token_id
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.eos_token_id
         )
+        elapsed = time.perf_counter() - start
+    generated = outputs.shape[-1] - input_ids.shape[-1]
+    return round(generated / elapsed, 1) if elapsed > 0 else 0.0
+
+
+def generate_local(tokenizer, model, prompt, max_new_tokens=256, user_id=None,
+                   background=False):
+    """Generate response using local model
+
+    With LOCAL_BATCHING on, the call is queued on the model's
+    GenerationScheduler and batched with concurrent callers. Calls that
+    run alone and carry a user_id reuse that user's cached prompt prefix.
+
+    ``background`` work (memory consolidation) never enters the scheduler,
+    where it would hold up the live requests batched with it; it decodes
+    on the caller's thread (the compaction worker runs at lowered
+    priority), one background call at a time.
+    """
+    if isinstance(model, MockModel):
+        return model.generate(prompt, max_new_tokens)
+
+    scheduler = get_scheduler(tokenizer, model) if LOCAL_BATCHING and not background else None
+    if background:
+        with _background_lock:
+            response = generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+    elif scheduler is not None:
+        response = scheduler.generate(prompt, max_new_tokens, user_id)
+    elif get_draft_model(model) is not None:
+        response = generate_speculative(tokenizer, model, prompt, max_new_tokens)
+    elif LOCAL_KV_CACHE and user_id:
+        response = generate_with_prefix_cache(tokenizer, model, prompt, max_new_tokens, user_id)
+    else:
+        response = generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
 
-    # Decode only the new tokens (skip the input)
-    response = tokenizer.decode(outputs[0][input_ids.shape[-1]:], skip_special_tokens=True)
-    
     # Clean up the response
     response = response.strip()
     
@@ -105,6 +371,598 @@ def generate_local(tokenizer, model, prompt, max_new_tokens=256):
     return response
 
 
+def generate_batch(tokenizer, model, prompts, max_new_tokens):
+    """Run one left-padded generate call for several prompts
+
+    ``max_new_tokens`` holds one limit per prompt; the batch decodes up to
+    the largest and each continuation is cut to its own limit.
+    """
+    import torch
+
+    input_ids, attention_mask = _encode_prompts(tokenizer, prompts, getattr(model, "device", None))
+    with torch.no_grad():
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(max_new_tokens),
+            **_sampling_kwargs(tokenizer)
+        )
+
+    # Decode only the new tokens (skip the input)
+    new_tokens = outputs[:, input_ids.shape[-1]:]
+    return [_decode(tokenizer, row[:limit])
+            for row, limit in zip(new_tokens, max_new_tokens)]
+
+
+class DraftModel:
+    """A main model's draft model with its acceptance counters
+
+    Acceptance is counted from forward passes: every verification pass of
+    the main model yields the accepted draft tokens plus one token of its
+    own, so accepted = new tokens - main passes, and every draft forward
+    pass proposes one token. Exact except at the final, cut-off step.
+    """
+
+    def __init__(self, target_id, model_id, model):
+        self.target_id = target_id
+        self.model_id = model_id
+        self.model = model
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.new_tokens = 0
+        self.target_passes = 0
+        self.proposed = 0
+        self.accepted = 0
+
+    def record(self, new_tokens, target_passes, proposed) -> None:
+        with self._lock:
+            self.calls += 1
+            self.new_tokens += new_tokens
+            self.target_passes += target_passes
+            self.proposed += proposed
+            self.accepted += min(proposed, max(0, new_tokens - target_passes))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "draft_model": self.model_id,
+                "calls": self.calls,
+                "proposed_tokens": self.proposed,
+                "accepted_tokens": self.accepted,
+                "acceptance_rate": round(self.accepted / self.proposed, 3) if self.proposed else 0.0,
+                # 1.0 means no gain over plain decoding
+                "tokens_per_pass": round(self.new_tokens / self.target_passes, 2)
+                if self.target_passes else 0.0
+            }
+
+
+# id(model) -> DraftModel used for speculative decoding of that model
+_drafts = {}
+_drafts_lock = threading.Lock()
+
+
+def get_draft_model(model):
+    """The model's DraftModel, or None when speculative decoding is off"""
+    with _drafts_lock:
+        return _drafts.get(id(model))
+
+
+def release_draft_model(model) -> None:
+    """Forget the draft of a model that is being unloaded"""
+    with _drafts_lock:
+        _drafts.pop(id(model), None)
+
+
+class _ForwardCounter:
+    """Count a module's forward calls made from the current thread"""
+
+    def __init__(self, module):
+        self.module = module
+        self.count = 0
+
+    def __enter__(self):
+        thread = threading.get_ident()
+
+        def hook(module, args, output):
+            if threading.get_ident() == thread:
+                self.count += 1
+
+        self._handle = self.module.register_forward_hook(hook)
+        return self
+
+    def __exit__(self, *exc):
+        self._handle.remove()
+
+
+def _assisted_generate(tokenizer, model, draft, input_ids, attention_mask,
+                       max_new_tokens, streamer=None):
+    import torch
+
+    with _ForwardCounter(model) as target, _ForwardCounter(draft.model) as proposed:
+        with torch.no_grad():
+            outputs = model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                assistant_model=draft.model,
+                streamer=streamer,
+                **_sampling_kwargs(tokenizer)
+            )
+    draft.record(outputs.shape[-1] - input_ids.shape[-1], target.count, proposed.count)
+    return outputs
+
+
+def generate_speculative(tokenizer, model, prompt, max_new_tokens=256):
+    """Generate one prompt with the model's draft proposing tokens
+
+    With sampling on, transformers uses speculative sampling, so the
+    output follows the main model's distribution. Assisted generation
+    handles a single sequence, so batches never take this path.
+    """
+    draft = get_draft_model(model)
+    if draft is None:
+        return generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+
+    input_ids, attention_mask = _encode_prompts(tokenizer, [prompt], getattr(model, "device", None))
+    try:
+        outputs = _assisted_generate(tokenizer, model, draft, input_ids,
+                                     attention_mask, max_new_tokens)
+    except Exception as e:
+        print(f"Speculative decoding failed, decoding normally: {e}")
+        return generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+    return _decode(tokenizer, outputs[0][input_ids.shape[-1]:])
+
+
+def _kv_nbytes(value, _depth=0) -> int:
+    """Bytes held by the tensors inside a past_key_values structure"""
+    if hasattr(value, "element_size") and hasattr(value, "nelement"):
+        return value.element_size() * value.nelement()
+    if _depth > 4:
+        return 0
+    if isinstance(value, dict):
+        value = value.values()
+    elif hasattr(value, "__dict__") and not isinstance(value, (list, tuple)):
+        value = vars(value).values()
+    if isinstance(value, (list, tuple, type({}.values()))):
+        return sum(_kv_nbytes(item, _depth + 1) for item in value)
+    return 0
+
+
+def _common_prefix_len(a, b) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def _crop_past(past, length):
+    """Cut past_key_values down to their first ``length`` positions"""
+    if hasattr(past, "crop"):
+        past.crop(length)
+        return past
+    # Legacy tuple layout: (batch, heads, positions, head_dim) per tensor
+    return tuple(tuple(t[:, :, :length, :] for t in layer) for layer in past)
+
+
+class PrefixKVCache:
+    """LRU store of past_key_values keyed by model, user and prefix tokens
+
+    ``match`` picks the cached prefix sharing the most leading tokens with
+    a prompt, so a follow-up whose context only differs towards its end
+    still reuses the common part. It returns a deep copy cropped to the
+    shared length because generate extends the cache it is given in place.
+    """
+
+    def __init__(self, max_bytes=LOCAL_KV_CACHE_MAX_BYTES,
+                 max_entries=LOCAL_KV_CACHE_MAX_ENTRIES,
+                 min_match=LOCAL_KV_CACHE_MIN_MATCH):
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes,
+                               sizeof=_kv_nbytes)
+        self.min_match = min_match
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+
+    @staticmethod
+    def key(model, user_id, prefix_ids):
+        model_key = getattr(getattr(model, "config", None), "_name_or_path", None) or id(model)
+        digest = hashlib.blake2b(
+            ",".join(map(str, prefix_ids)).encode("ascii"), digest_size=16
+        ).hexdigest()
+        return (model_key, str(user_id), len(prefix_ids), digest)
+
+    def match(self, model, user_id, prefix_ids):
+        """(past, length): a private copy of the longest cached prefix of
+        prefix_ids and the number of tokens it covers, or (None, 0)"""
+        model_key, user_key = self.key(model, user_id, [])[:2]
+        best_key, best_len = None, 0
+        for key, (ids, _) in self._cache.items():
+            if key[0] == model_key and key[1] == user_key:
+                length = _common_prefix_len(ids, prefix_ids)
+                if length > best_len:
+                    best_key, best_len = key, length
+        entry = self._cache.get(best_key) if best_len >= max(1, self.min_match) else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, 0
+            if best_len == len(prefix_ids):
+                self.hits += 1
+            else:
+                self.partial_hits += 1
+            self.reused_tokens += best_len
+        ids, past = entry
+        past = copy.deepcopy(past)
+        return (past if best_len == len(ids) else _crop_past(past, best_len)), best_len
+
+    def put(self, model, user_id, prefix_ids, past) -> None:
+        """Cache past, which must cover exactly prefix_ids and is kept as is"""
+        self._cache.put(self.key(model, user_id, prefix_ids), (tuple(prefix_ids), past))
+
+    def discard_model(self, model) -> None:
+        """Drop every entry of a model that is being unloaded"""
+        model_key = self.key(model, None, [])[0]
+        for key, _ in self._cache.items():
+            if key[0] == model_key:
+                self._cache.pop(key)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.partial_hits + self.misses
+            return {
+                **self._cache.stats(),
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.partial_hits) / lookups, 4) if lookups else 0.0,
+                "reused_tokens": self.reused_tokens
+            }
+
+
+kv_cache = PrefixKVCache()
+
+
+def generate_with_prefix_cache(tokenizer, model, prompt, max_new_tokens, user_id):
+    """Generate for one prompt, prefilling only what the user's cache lacks
+
+    The prompt is split before its last KV_PREFIX_MARKER. generate starts
+    from the longest cached prefix of the part before the split and
+    prefills the rest; the cache it builds is then cropped to the prefix
+    and stored, so a miss costs no extra forward pass or copy.
+    """
+    import torch
+
+    split = prompt.rfind(KV_PREFIX_MARKER)
+    if split <= 0:
+        return generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+
+    with tokenizer_lock(tokenizer):
+        prefix_ids = tokenizer(prompt[:split], return_tensors="pt")["input_ids"]
+        suffix_ids = tokenizer(prompt[split:] + tokenizer.eos_token, return_tensors="pt")["input_ids"]
+    input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+    if input_ids.shape[-1] > 1024:
+        # Too long to keep whole; fall back to left truncation
+        return generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+
+    device = getattr(model, "device", "cpu")
+    prefix_key = prefix_ids[0].tolist()
+    try:
+        past, reused = kv_cache.match(model, user_id, prefix_key)
+        input_ids = input_ids.to(device)
+        with torch.no_grad():
+            outputs = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past,
+                max_new_tokens=max_new_tokens,
+                return_dict_in_generate=True,
+                **_sampling_kwargs(tokenizer)
+            )
+        if reused < len(prefix_key) and outputs.past_key_values is not None:
+            # generate is done with its cache; keep the prefix part of it
+            kv_cache.put(model, user_id, prefix_key,
+                         _crop_past(outputs.past_key_values, len(prefix_key)))
+    except Exception as e:
+        print(f"Prefix KV-cache generation failed, prefilling in full: {e}")
+        return generate_batch(tokenizer, model, [prompt], [max_new_tokens])[0]
+    return _decode(tokenizer, outputs.sequences[0][input_ids.shape[-1]:])
+
+
+def stream_local(tokenizer, model, prompt, max_new_tokens=256):
+    """Yield the local model's continuation piece by piece as it decodes
+
+    generate runs in a helper thread feeding a TextIteratorStreamer.
+    Streams bypass the batching scheduler but use the draft model when
+    the model has one.
+    """
+    if isinstance(model, MockModel):
+        for piece in re.findall(r"\S+\s*", model.generate(prompt, max_new_tokens)):
+            yield piece
+        return
+
+    import torch
+    from transformers import TextIteratorStreamer
+
+    input_ids, attention_mask = _encode_prompts(tokenizer, [prompt], getattr(model, "device", None))
+    streamer = TextIteratorStreamer(
+        _LockedTokenizer(tokenizer), skip_prompt=True, skip_special_tokens=True,
+        timeout=LOCAL_STREAM_TIMEOUT
+    )
+    errors = []
+    draft = get_draft_model(model)
+
+    def run():
+        try:
+            if draft is not None:
+                _assisted_generate(tokenizer, model, draft, input_ids, attention_mask,
+                                   max_new_tokens, streamer=streamer)
+                return
+            with torch.no_grad():
+                model.generate(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    max_new_tokens=max_new_tokens,
+                    streamer=streamer,
+                    **_sampling_kwargs(tokenizer)
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()
+
+    thread = threading.Thread(target=run, name="local-stream", daemon=True)
+    thread.start()
+    for text in streamer:
+        if text:
+            yield text
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def _sampling_kwargs(tokenizer):
+    return {
+        "do_sample": True,
+        "temperature": 0.7,
+        "pad_token_id": tokenizer.eos_token_id,
+        "eos_token_id": tokenizer.eos_token_id
+    }
+
+
+def _encode_prompts(tokenizer, prompts, device=None):
+    """Tokenize prompts into left-padded input ids and attention mask"""
+
+    # For DialoGPT, we need to format the conversation properly
+    # DialoGPT expects: conversation history + eos_token + user_input + eos_token
+    conversation_texts = [prompt + tokenizer.eos_token for prompt in prompts]
+
+    # Decoder-only models continue from the last position, so pad (and
+    # truncate) on the left to keep every prompt's end aligned
+    with tokenizer_lock(tokenizer):
+        tokenizer.padding_side = "left"
+        tokenizer.truncation_side = "left"
+        inputs = tokenizer(
+            conversation_texts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=1024,
+            return_attention_mask=True
+        )
+    
+    input_ids = inputs['input_ids']
+    attention_mask = inputs['attention_mask']
+
+    # Move to the model's device (GPU when it was loaded there)
+    if device is not None:
+        input_ids = input_ids.to(device)
+        attention_mask = attention_mask.to(device)
+    return input_ids, attention_mask
+
+
+class GenerationScheduler:
+    """Dynamic batching of concurrent local generation requests
+
+    A background thread takes the first pending request, keeps collecting
+    for up to ``max_wait_ms`` or until ``max_batch_size`` requests are
+    waiting, runs them as one ``generate_batch`` call and hands each
+    continuation back to its caller. A request that ends up alone is
+    decoded speculatively when the model has a draft, or else goes
+    through the prefix KV-cache if it carries a user_id. Batched requests
+    run on this thread, but streams run on their own threads and request
+    threads count tokens while packing context, so every tokenizer call
+    holds tokenizer_lock.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_size=None, max_wait_ms=None,
+                 generate_fn=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_batch_size = max_batch_size or LOCAL_BATCH_MAX_SIZE
+        self.max_wait_ms = LOCAL_BATCH_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self._generate = generate_fn or generate_batch
+        self._generate_cached = generate_with_prefix_cache
+        self._generate_speculative = generate_speculative
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopped = False
+        self.requests = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self._thread = threading.Thread(
+            target=self._run, name="local-generation", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, prompt, max_new_tokens=256, user_id=None) -> Future:
+        """Queue a prompt; the returned future resolves to its continuation
+
+        After ``stop`` the future fails immediately instead of waiting on
+        a thread that is gone.
+        """
+        future = Future()
+        with self._lock:
+            if self._stopped:
+                future.set_exception(RuntimeError("Generation scheduler is stopped"))
+                return future
+            self._queue.put((prompt, max_new_tokens, user_id, future))
+            self.requests += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future
+
+    def generate(self, prompt, max_new_tokens=256, user_id=None) -> str:
+        return self.submit(prompt, max_new_tokens, user_id).result()
+
+    def stop(self, timeout=5.0) -> None:
+        """Serve what is queued, then end the thread; later submits fail"""
+        with self._lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _fail_pending(self) -> None:
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _STOP:
+                item[3].set_exception(RuntimeError("Generation scheduler is stopped"))
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Finish this batch first, then stop
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self._fail_pending()
+                return
+            try:
+                if len(batch) == 1 and get_draft_model(self.model) is not None:
+                    prompt, limit, _, _ = batch[0]
+                    texts = [self._generate_speculative(
+                        self.tokenizer, self.model, prompt, limit
+                    )]
+                elif len(batch) == 1 and batch[0][2] and LOCAL_KV_CACHE:
+                    prompt, limit, user_id, _ = batch[0]
+                    texts = [self._generate_cached(
+                        self.tokenizer, self.model, prompt, limit, user_id
+                    )]
+                else:
+                    texts = self._generate(
+                        self.tokenizer, self.model,
+                        [prompt for prompt, _, _, _ in batch],
+                        [limit for _, limit, _, _ in batch]
+                    )
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, _, _, future), text in zip(batch, texts):
+                    future.set_result(text)
+            with self._lock:
+                self.batches += 1
+
+    def stats(self):
+        """Queue depth and batching counters"""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms
+            }
+
+
+# id(model) -> GenerationScheduler serving that model
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+# Models whose scheduler was released on unload; they never get a new one
+_released_models = weakref.WeakSet()
+
+
+def _is_released(model) -> bool:
+    try:
+        return model in _released_models
+    except TypeError:
+        return False
+
+
+def get_scheduler(tokenizer, model):
+    """Return the model's scheduler, starting it on first use
+
+    Returns None for a model that was unloaded, so a late caller generates
+    unbatched instead of pinning the model with a new scheduler thread.
+    """
+    with _schedulers_lock:
+        if _is_released(model):
+            return None
+        scheduler = _schedulers.get(id(model))
+        if scheduler is None:
+            scheduler = GenerationScheduler(tokenizer, model)
+            _schedulers[id(model)] = scheduler
+        return scheduler
+
+
+def release_scheduler(model) -> None:
+    """Stop and forget the scheduler of a model that is being unloaded"""
+    with _schedulers_lock:
+        scheduler = _schedulers.pop(id(model), None)
+        try:
+            _released_models.add(model)
+        except TypeError:
+            pass
+    if scheduler is not None:
+        scheduler.stop()
+
+
+def get_generation_stats():
+    """Scheduler stats for every loaded local model, plus the KV-cache and
+    speculative decoding acceptance"""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    with _drafts_lock:
+        drafts = list(_drafts.values())
+    return {
+        "schedulers": {
+            getattr(getattr(s.model, "config", None), "_name_or_path", None) or str(i): s.stats()
+            for i, s in enumerate(schedulers)
+        },
+        "kv_cache": kv_cache.stats(),
+        "speculative": {draft.target_id: draft.stats() for draft in drafts},
+        "models": load_reports
+    }
+
+
 class MockTokenizer:
     """Mock tokenizer for demonstration"""
     def __init__(self):
@@ -165,6 +1023,16 @@ class MockModel:
 __all__ = [
     "load_local_model",
     "generate_local",
+    "generate_batch",
+    "stream_local",
+    "generate_with_prefix_cache",
+    "generate_speculative",
+    "DraftModel",
+    "get_draft_model",
+    "PrefixKVCache",
+    "benchmark_local_model",
+    "GenerationScheduler",
+    "get_generation_stats",
     "MockTokenizer",
     "MockModel"
 ]
@@ -0,0 +1,241 @@
+"""Pool of loaded local models keyed by model id
+
+Models are loaded on first use, their resident size is measured after
+loading, and the least recently used models are unloaded when the pool
+would exceed MODEL_POOL_MAX_BYTES. A background reaper unloads models
+idle for longer than MODEL_IDLE_TIMEOUT. Models held through ``use`` are
+never unloaded while a request is running on them. Concurrent requests
+for a model that is not loaded yet share one load, and loads of different
+models do not block each other or requests for models already in the pool.
+"""
+import gc
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.agent.model_loader import (
+    LOCAL_MODEL_ID,
+    _kv_nbytes,
+    get_draft_model,
+    kv_cache,
+    load_local_model,
+    release_draft_model,
+    release_scheduler
+)
+from src.infra.single_flight import SingleFlight
+
+# Resident bytes allowed for all pooled models (0 = unlimited)
+MODEL_POOL_MAX_BYTES = int(os.getenv("MODEL_POOL_MAX_BYTES", "0"))
+# Seconds a model may stay unused before it is unloaded (0 = never)
+MODEL_IDLE_TIMEOUT = float(os.getenv("MODEL_IDLE_TIMEOUT", "3600"))
+
+
+def model_nbytes(model: Any) -> int:
+    """Bytes held by a model's weights and buffers (0 for non-torch models)
+
+    Walks the state dict so dynamically quantized layers, whose packed
+    int8 weights are not parameters, are counted too.
+    """
+    state_dict = getattr(model, "state_dict", None)
+    if state_dict is None:
+        return 0
+    try:
+        return _kv_nbytes(list(state_dict().values()))
+    except Exception:
+        return 0
+
+
+class _Entry:
+    def __init__(self, tokenizer, model, nbytes: int):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.nbytes = nbytes
+        self.loaded_at = time.time()
+        self.last_used = time.monotonic()
+        self.uses = 0
+        # Requests currently running on the model (see ModelPool.use)
+        self.active = 0
+
+
+class ModelPool:
+    """Memory-budgeted LRU pool of (tokenizer, model) pairs"""
+
+    def __init__(
+        self,
+        loader: Callable[[str], Tuple[Any, Any]] = load_local_model,
+        max_bytes: int = MODEL_POOL_MAX_BYTES,
+        idle_timeout: float = MODEL_IDLE_TIMEOUT,
+        sizeof: Callable[[Any], int] = model_nbytes
+    ):
+        self._loader = loader
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self._sizeof = sizeof
+        self._entries = OrderedDict()
+        # Sizes seen at earlier loads, used to make room before reloading
+        self._known_sizes = {}
+        self._lock = threading.RLock()
+        self._flight = SingleFlight()
+        self._reaper = None
+        self._stop = threading.Event()
+        self.loads = 0
+        self.evictions = 0
+        self.idle_unloads = 0
+
+    def get(self, model_id: Optional[str] = None) -> Tuple[Any, Any]:
+        """Return (tokenizer, model) for model_id, loading it if needed
+
+        The model is not held: prefer ``use`` around generation so the
+        pool cannot unload it mid-request.
+        """
+        entry = self._acquire(model_id or LOCAL_MODEL_ID, hold=False)
+        return entry.tokenizer, entry.model
+
+    @contextmanager
+    def use(self, model_id: Optional[str] = None):
+        """Hold (tokenizer, model) for model_id for the length of the block"""
+        entry = self._acquire(model_id or LOCAL_MODEL_ID, hold=True)
+        try:
+            yield entry.tokenizer, entry.model
+        finally:
+            with self._lock:
+                entry.active -= 1
+                entry.last_used = time.monotonic()
+
+    def _acquire(self, model_id: str, hold: bool) -> _Entry:
+        while True:
+            with self._lock:
+                entry = self._entries.get(model_id)
+                if entry is not None:
+                    self._entries.move_to_end(model_id)
+                    entry.last_used = time.monotonic()
+                    entry.uses += 1
+                    if hold:
+                        entry.active += 1
+                    break
+            # Unloaded again before we got it (tiny budget): load again
+            self._flight.do(model_id, lambda: self._load(model_id))
+        self._start_reaper()
+        return entry
+
+    def _load(self, model_id: str) -> None:
+        with self._lock:
+            if model_id in self._entries:
+                return
+            self._make_room(self._known_sizes.get(model_id, 0))
+        print(f"Loading local model into pool: {model_id}")
+        tokenizer, model = self._loader(model_id)
+        nbytes = self._sizeof(model)
+        draft = get_draft_model(model)
+        if draft is not None:
+            nbytes += self._sizeof(draft.model)
+        with self._lock:
+            self._known_sizes[model_id] = nbytes
+            self._entries[model_id] = _Entry(tokenizer, model, nbytes)
+            self.loads += 1
+            self._make_room(0, keep=model_id)
+
+    def _make_room(self, incoming: int, keep: Optional[str] = None) -> None:
+        if self.max_bytes <= 0:
+            return
+        while self._entries and self.total_bytes() + incoming > self.max_bytes:
+            victim = next((mid for mid, entry in self._entries.items()
+                           if mid != keep and entry.active == 0), None)
+            if victim is None:
+                # Everything else is busy; stay over budget until it is not
+                print("Model pool over budget, but every other model is in use")
+                break
+            print(f"Model pool over budget, unloading {victim}")
+            self._unload(victim)
+            self.evictions += 1
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def unload(self, model_id: str) -> bool:
+        with self._lock:
+            if model_id not in self._entries:
+                return False
+            self._unload(model_id)
+            return True
+
+    def _unload(self, model_id: str) -> None:
+        entry = self._entries.pop(model_id)
+        release_scheduler(entry.model)
+        release_draft_model(entry.model)
+        kv_cache.discard_model(entry.model)
+        del entry
+        gc.collect()
+        # Only touch torch if a real model was ever loaded
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict_idle(self) -> List[str]:
+        """Unload models unused for longer than idle_timeout"""
+        if self.idle_timeout <= 0:
+            return []
+        now = time.monotonic()
+        with self._lock:
+            idle = [mid for mid, entry in self._entries.items()
+                    if entry.active == 0 and now - entry.last_used > self.idle_timeout]
+            for model_id in idle:
+                print(f"Unloading idle model {model_id}")
+                self._unload(model_id)
+                self.idle_unloads += 1
+        return idle
+
+    def _start_reaper(self) -> None:
+        if self.idle_timeout <= 0 or (self._reaper and self._reaper.is_alive()):
+            return
+        with self._lock:
+            if self._reaper and self._reaper.is_alive():
+                return
+            self._stop.clear()
+            self._reaper = threading.Thread(
+                target=self._reap, name="model-pool-reaper", daemon=True
+            )
+            self._reaper.start()
+
+    def _reap(self) -> None:
+        interval = min(60.0, max(1.0, self.idle_timeout / 4))
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                print(f"Model pool reaper error: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded models with their memory and idle time, plus counters"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "models": {
+                    model_id: {
+                        "bytes": entry.nbytes,
+                        "uses": entry.uses,
+                        "active": entry.active,
+                        "idle_seconds": round(now - entry.last_used, 1),
+                        "loaded_at": entry.loaded_at
+                    }
+                    for model_id, entry in self._entries.items()
+                },
+                "total_bytes": sum(entry.nbytes for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "idle_timeout": self.idle_timeout,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "idle_unloads": self.idle_unloads,
+                "loading": self._flight.stats()
+            }
+
+
+model_pool = ModelPool()
@@ -1,7 +1,6 @@
 import os
 import requests
-from huggingface_hub import InferenceClient
-from typing import List, Dict
+from typing import Dict, Iterator, List
 
 # Remote heavy model: Qwen2.5-7B via HF Inference API (working model)
 REMOTE_MODEL_ID = "Qwen/Qwen2.5-7B-Instruct"
@@ -27,6 +26,7 @@ def qwen3_infer(messages: List[Dict[str, str]], max_tokens: int = 512, temperatu
         Generated response text
     """
     try:
+        from huggingface_hub import InferenceClient
         client = InferenceClient(token=get_hf_token())
         
         response = client.chat.completions.create(
@@ -43,6 +43,32 @@ def qwen3_infer(messages: List[Dict[str, str]], max_tokens: int = 512, temperatu
         # Fallback to direct API call if InferenceClient fails
         return qwen3_infer_direct(messages, max_tokens, temperature)
 
+def qwen3_infer_stream(messages: List[Dict[str, str]], max_tokens: int = 512, temperature: float = 0.7) -> Iterator[str]:
+    """
+    Stream the remote reply piece by piece (chat-completions stream mode)
+    
+    Falls back to one non-streamed piece from the direct API if the
+    stream cannot be opened.
+    """
+    try:
+        from huggingface_hub import InferenceClient
+        client = InferenceClient(token=get_hf_token())
+        stream = client.chat.completions.create(
+            model=REMOTE_MODEL_ID,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+    except Exception as e:
+        print(f"Remote streaming error: {e}")
+        yield qwen3_infer_direct(messages, max_tokens, temperature)
+        return
+
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
 def qwen3_infer_direct(messages: List[Dict[str, str]], max_tokens: int = 512, temperature: float = 0.7) -> str:
     """
     Direct API call to HF Inference API as fallback
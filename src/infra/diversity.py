@@ -0,0 +1,46 @@
+"""Maximal-marginal-relevance selection over candidate embeddings"""
+from typing import List
+import numpy as np
+
+
+def maximal_marginal_relevance(
+    query: np.ndarray,
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float = 0.7,
+    max_redundancy: float = 0.95
+) -> List[int]:
+    """Pick up to k diverse, relevant rows of ``candidates``
+
+    Each step takes the candidate maximizing
+    ``lambda * sim(query, c) - (1 - lambda) * max(sim(c, selected))``
+    using cosine similarity. Candidates whose similarity to an already
+    selected row reaches ``max_redundancy`` are never picked, so near
+    copies shrink the result instead of filling it. Returns row indices
+    in selection order.
+    """
+    candidates = np.asarray(candidates, dtype=np.float32)
+    if k <= 0 or not len(candidates):
+        return []
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    unit = candidates / np.maximum(norms, 1e-12)
+    query = np.asarray(query, dtype=np.float32).ravel()
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = unit @ query
+    pairwise = unit @ unit.T
+    redundancy = np.full(len(unit), -np.inf, dtype=np.float32)
+    available = np.ones(len(unit), dtype=bool)
+    selected = []
+    while len(selected) < k:
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            break
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[:, best])
+        available &= redundancy < max_redundancy
+    return selected
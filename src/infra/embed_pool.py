@@ -0,0 +1,163 @@
+"""Multi-process embedding pool for bulk ingest
+
+Each worker process loads its own embedder (through
+``vector_store.get_embedder``, so it follows EMBEDDER_BACKEND) and splits
+the machine's cores with the other workers. For every ``encode`` call the
+parent allocates one shared-memory float32 matrix; workers embed their
+slice of the texts and write the rows straight into it at the slice's
+offset, so input order is preserved and only the texts are pickled.
+"""
+import atexit
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+# Worker processes used for ingest embedding (0 embeds in-process)
+EMBED_POOL_WORKERS = int(os.getenv("EMBED_POOL_WORKERS", "0"))
+# Smallest slice of texts sent to one worker
+EMBED_POOL_MIN_SLICE = int(os.getenv("EMBED_POOL_MIN_SLICE", "32"))
+
+# Embedder of the current worker process
+_worker_embedder = None
+
+
+def _init_worker(env: Dict[str, str]) -> None:
+    global _worker_embedder
+    os.environ.update(env)
+    threads = int(os.environ.get("EMBEDDER_THREADS") or 0)
+    if threads and os.environ.get("EMBEDDER_BACKEND", "sentence-transformers") == "sentence-transformers":
+        # torch's thread pool is process-wide; in a worker the embedder is
+        # the only thing using it
+        import torch
+        torch.set_num_threads(threads)
+    # Imported here so EMBEDDER_* settings from env apply in this process
+    from src.infra.vector_store import get_embedder
+    _worker_embedder = get_embedder()
+
+
+def _worker_dimension() -> int:
+    return int(_worker_embedder.get_sentence_embedding_dimension())
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        # Python 3.13+: the parent owns (and unlinks) the block
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _encode_into(texts: List[str], shm_name: str, start: int, shape: tuple) -> int:
+    embeddings = np.asarray(_worker_embedder.encode(texts), dtype=np.float32)
+    shm = _attach(shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[start:start + len(texts)] = embeddings
+        del out
+    finally:
+        shm.close()
+    return len(texts)
+
+
+class EmbeddingPool:
+    """Pool of embedder processes with an order-preserving ``encode``
+
+    ``env`` overrides environment variables in the workers (for example
+    ``{"EMBEDDER_BACKEND": "hashing"}``). Unless EMBEDDER_THREADS is set,
+    each worker gets an equal share of the CPU cores for its runtime's
+    thread pool so workers do not oversubscribe the machine.
+    """
+
+    def __init__(self, workers: int = EMBED_POOL_WORKERS,
+                 min_slice: int = EMBED_POOL_MIN_SLICE,
+                 env: Optional[Dict[str, str]] = None):
+        self.workers = max(1, workers)
+        self.min_slice = max(1, min_slice)
+        env = dict(env or {})
+        if not os.getenv("EMBEDDER_THREADS") and "EMBEDDER_THREADS" not in env:
+            env["EMBEDDER_THREADS"] = str(max(1, (os.cpu_count() or 1) // self.workers))
+        env.setdefault("TOKENIZERS_PARALLELISM", "false")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(env,)
+        )
+        self._dim = None
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.calls = 0
+
+    @property
+    def dim(self) -> int:
+        if self._dim is None:
+            self._dim = self._executor.submit(_worker_dimension).result()
+        return self._dim
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Embed texts across the workers into an (n, dim) float32 matrix"""
+        if isinstance(texts, str):
+            texts = [texts]
+        n = len(texts)
+        dim = self.dim
+        if n == 0:
+            return np.zeros((0, dim), dtype=np.float32)
+
+        size = max(self.min_slice, math.ceil(n / self.workers))
+        out = shared_memory.SharedMemory(create=True, size=n * dim * 4)
+        try:
+            futures = [
+                self._executor.submit(_encode_into, texts[s:s + size], out.name, s, (n, dim))
+                for s in range(0, n, size)
+            ]
+            for future in futures:
+                future.result()
+            view = np.ndarray((n, dim), dtype=np.float32, buffer=out.buf)
+            result = view.copy()
+            del view
+        finally:
+            out.close()
+            out.unlink()
+
+        with self._lock:
+            self.texts += n
+            self.calls += 1
+        return result
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"workers": self.workers, "calls": self.calls, "texts": self.texts}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_embed_pool() -> Optional[EmbeddingPool]:
+    """Shared pool when EMBED_POOL_WORKERS > 0, started on first use"""
+    global _pool
+    if EMBED_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            print(f"Starting embedding pool with {EMBED_POOL_WORKERS} workers...")
+            _pool = EmbeddingPool(EMBED_POOL_WORKERS)
+            atexit.register(shutdown_embed_pool)
+    return _pool
+
+
+def shutdown_embed_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -0,0 +1,206 @@
+"""Embedder backends beyond the default PyTorch SentenceTransformer
+
+* HashingEmbedder - offline feature hashing, no model download
+* load_onnx_embedder - dynamically quantized int8 ONNX export of a
+  sentence-transformers model, run on onnxruntime's CPU provider
+* check_embedder_parity - cosine agreement between two embedders
+"""
+import os
+import re
+import zlib
+from typing import Any, Dict, List, Optional
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+# splitmix64 finalizer constants, used to spread the rolling n-gram hashes
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_BASE = np.uint64(0x100000001B3)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    h = h ^ (h >> np.uint64(30))
+    h = h * _MIX_1
+    h = h ^ (h >> np.uint64(27))
+    h = h * _MIX_2
+    return h ^ (h >> np.uint64(31))
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder
+
+    Each text is lower-cased and padded with spaces, then hashed character
+    n-grams (``ngram_range``, computed for the whole batch at once with a
+    vectorized rolling hash) and whole words are folded into ``dim``
+    buckets with a random sign. Rows are L2-normalized, so texts sharing
+    words and sub-words end up close under cosine or L2 distance. It is
+    fast, needs no network, and is stable across processes and runs.
+    """
+
+    def __init__(self, dim: int = 384, ngram_range=(3, 5), word_weight: float = 2.0):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.word_weight = word_weight
+        self.model_id = f"hashing-{ngram_range[0]}-{ngram_range[1]}-{dim}"
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Embed a batch of texts into an (n, dim) float32 matrix"""
+        if isinstance(texts, str):
+            texts = [texts]
+        n = len(texts)
+        if n == 0:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        encoded = [f" {' '.join(text.lower().split())} ".encode("utf-8")
+                   for text in texts]
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=n)
+        ends = np.cumsum(lengths)
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+
+        rows, buckets, weights = [], [], []
+        lo, hi = self.ngram_range
+        for size in range(lo, hi + 1):
+            if len(data) < size:
+                continue
+            windows = np.lib.stride_tricks.sliding_window_view(data, size)
+            powers = _BASE ** np.arange(size, dtype=np.uint64)
+            hashes = _mix((windows * powers).sum(axis=1, dtype=np.uint64)
+                          + np.uint64(size))
+            starts = np.arange(len(windows))
+            owner = np.searchsorted(ends, starts, side="right")
+            # Drop windows that run across the boundary between two texts
+            valid = starts + size <= ends[np.minimum(owner, n - 1)]
+            rows.append(owner[valid])
+            buckets.append(hashes[valid])
+            weights.append(np.ones(int(valid.sum()), dtype=np.float32))
+
+        word_rows, word_hashes = [], []
+        for i, text in enumerate(texts):
+            for word in _WORD_RE.findall(text.lower()):
+                word_rows.append(i)
+                word_hashes.append(zlib.crc32(word.encode("utf-8")))
+        if word_rows:
+            rows.append(np.asarray(word_rows, dtype=np.int64))
+            buckets.append(_mix(np.asarray(word_hashes, dtype=np.uint64)))
+            weights.append(np.full(len(word_rows), self.word_weight, dtype=np.float32))
+
+        matrix = np.zeros(n * self.dim, dtype=np.float32)
+        if rows:
+            row = np.concatenate(rows)
+            h = np.concatenate(buckets)
+            weight = np.concatenate(weights)
+            sign = np.where((h >> np.uint64(63)) == 1, -1.0, 1.0).astype(np.float32)
+            col = (h % np.uint64(self.dim)).astype(np.int64)
+            matrix += np.bincount(row * self.dim + col, weights=sign * weight,
+                                  minlength=n * self.dim).astype(np.float32)
+        matrix = matrix.reshape(n, self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+# Sentences used by check_embedder_parity when none are given
+PARITY_SENTENCES = [
+    "I am a software developer",
+    "I work on AI projects in Python",
+    "My favorite programming language is Python",
+    "Remember: my project code name is Bluebird",
+    "User asked: what can you help me with?\nAssistant replied: I can answer "
+    "questions and remember things for you.",
+    "Explain quantum computing in detail with technical examples",
+    "The weather is nice today",
+    "Compare transformers and recurrent neural networks",
+]
+
+
+def load_onnx_embedder(
+    model_id: str = "all-MiniLM-L6-v2",
+    file_name: str = "onnx/model_quint8_avx2.onnx",
+    export_dir: str = "./models/onnx",
+    threads: Optional[int] = None
+):
+    """Load an int8-quantized ONNX version of a sentence-transformers model
+
+    Uses the pre-quantized ``file_name`` published with the model when it
+    exists; otherwise exports the model to ONNX, quantizes it dynamically
+    (AVX2 int8 config) into ``export_dir`` and loads that. ``threads`` caps
+    onnxruntime's intra-op thread pool. Requires
+    ``sentence-transformers[onnx]``.
+    """
+    import onnxruntime
+    from sentence_transformers import SentenceTransformer
+
+    session_options = onnxruntime.SessionOptions()
+    if threads:
+        session_options.intra_op_num_threads = threads
+        session_options.inter_op_num_threads = 1
+    model_kwargs = {
+        "provider": "CPUExecutionProvider",
+        "session_options": session_options
+    }
+
+    try:
+        return SentenceTransformer(
+            model_id, backend="onnx",
+            model_kwargs={**model_kwargs, "file_name": file_name}
+        )
+    except Exception as e:
+        print(f"No pre-quantized ONNX file for {model_id} ({e}); exporting...")
+
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    local_dir = os.path.join(export_dir, model_id.replace("/", "__"))
+    quantized_file = "onnx/model_qint8_avx2.onnx"
+    if not os.path.exists(os.path.join(local_dir, quantized_file)):
+        fp32 = SentenceTransformer(model_id, backend="onnx")
+        fp32.save_pretrained(local_dir)
+        export_dynamic_quantized_onnx_model(fp32, "avx2", local_dir)
+    return SentenceTransformer(
+        local_dir, backend="onnx",
+        model_kwargs={**model_kwargs, "file_name": quantized_file}
+    )
+
+
+def check_embedder_parity(
+    candidate: Any,
+    reference: Any,
+    texts: Optional[List[str]] = None,
+    min_cosine: float = 0.99
+) -> Dict[str, Any]:
+    """Measure cosine agreement between a candidate and a reference embedder
+
+    Returns mean/min cosine similarity of the per-text embeddings and
+    whether the minimum clears ``min_cosine``.
+    """
+    texts = texts or PARITY_SENTENCES
+    a = np.asarray(candidate.encode(texts), dtype=np.float32)
+    b = np.asarray(reference.encode(texts), dtype=np.float32)
+    a /= np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b /= np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    cosines = (a * b).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "mean_cosine": round(float(cosines.mean()), 6),
+        "min_cosine": round(float(cosines.min()), 6),
+        "min_required": min_cosine,
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+
+
+if __name__ == "__main__":
+    # Compare the int8 ONNX embedder against the fp32 PyTorch model
+    import time
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer("all-MiniLM-L6-v2")
+    candidate = load_onnx_embedder("all-MiniLM-L6-v2")
+    print("Parity:", check_embedder_parity(candidate, reference))
+
+    batch = PARITY_SENTENCES * 64
+    for name, embedder in (("fp32 torch", reference), ("int8 onnx", candidate)):
+        start = time.perf_counter()
+        embedder.encode(batch)
+        print(f"{name}: {len(batch) / (time.perf_counter() - start):.0f} texts/s")
@@ -0,0 +1,134 @@
+"""Incremental BM25 inverted index and rank fusion helpers"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+")
+
+# Function words dropped from queries: they match almost any memory and
+# would otherwise make unrelated questions look like exact hits
+STOPWORDS = frozenset("""
+a about am an and any are as at be been but by can could did do does for
+from had has have he her him his how i if in into is it its me my of on or
+our she so that the their them then there these they this those to was we
+were what when where which who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens used for both documents and queries"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory BM25 index that supports incremental add and remove
+
+    Postings map each term to ``{doc_id: term_frequency}``, so adding or
+    removing a document only touches that document's terms, and a query
+    only visits the postings of its own terms.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_lengths
+
+    def add(self, doc_id: str, text: str) -> None:
+        counts = Counter(tokenize(text))
+        with self._lock:
+            if doc_id in self._doc_lengths:
+                self._remove(doc_id)
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+            self._doc_terms[doc_id] = list(counts)
+            length = sum(counts.values())
+            self._doc_lengths[doc_id] = length
+            self._total_length += length
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str) -> None:
+        if doc_id not in self._doc_lengths:
+            return
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        n = len(self._doc_lengths)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[str, float, float, int]]:
+        """Return ``(doc_id, score, normalized_score, matched_terms)`` hits
+
+        Stopwords are dropped from the query unless it has nothing else.
+        ``normalized_score`` divides the BM25 score by the score of an
+        average-length document containing every query term once, capped
+        at 1, giving a corpus-independent confidence in [0, 1]. Terms the
+        corpus has never seen count with the idf of an unseen term, so a
+        query is only fully matched if all of its words are.
+        ``matched_terms`` counts the distinct non-stopword query terms the
+        document contains.
+        """
+        tokens = tokenize(query)
+        terms = Counter(t for t in tokens if t not in STOPWORDS) or Counter(tokens)
+        with self._lock:
+            if not terms or not self._doc_lengths:
+                return []
+            avg_length = self._total_length / len(self._doc_lengths)
+            scores = defaultdict(float)
+            matched = defaultdict(int)
+            max_score = 0.0
+            for term, qtf in terms.items():
+                idf = self._idf(term)
+                max_score += qtf * idf
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+                    if term not in STOPWORDS:
+                        matched[doc_id] += 1
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(doc_id, score, min(1.0, score / max_score) if max_score else 0.0,
+                 matched[doc_id])
+                for doc_id, score in best]
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[str]],
+    k: int = 60,
+    top_k: Optional[int] = None
+) -> List[Tuple[str, float]]:
+    """Fuse several ranked id lists with RRF: sum of 1 / (k + rank)"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return fused[:top_k] if top_k is not None else fused
@@ -0,0 +1,75 @@
+"""Single-flight execution of expensive loads
+
+Concurrent callers asking for the same key share one in-flight call: the
+first caller runs the loader, the others block until it finishes and get
+its result, or its exception. Nothing is cached once the call completes,
+so loaders should first re-check whatever cache the caller keeps (a
+caller may arrive just after the previous load finished) and a failed
+load is retried by the next caller.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls per key and record how long loads take"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.loads = 0
+        self.failures = 0
+        self.shared = 0
+        # key -> seconds taken by its most recent load
+        self.durations = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn for key unless a call for key is in flight, then share it"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        start = time.perf_counter()
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self.durations[key] = round(time.perf_counter() - start, 3)
+                self.loads += 1
+                if call.error is not None:
+                    self.failures += 1
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loads": self.loads,
+                "failures": self.failures,
+                "shared_waits": self.shared,
+                "in_flight": [str(key) for key in self._calls],
+                "load_seconds": {str(key): s for key, s in self.durations.items()}
+            }
@@ -0,0 +1,204 @@
+"""Columnar snapshots of agent memory for fast restore and migration
+
+A snapshot is an uncompressed ``.npz`` archive (a zip of ``.npy`` arrays)
+written and read one chunk at a time, so neither side holds more than one
+chunk in memory. Embeddings are stored as raw float32, so importing a
+snapshot never runs the embedder.
+
+Layout, for chunk ``n`` (``cNNNNNN``)::
+
+    manifest.npy                  UTF-8 JSON: format, embedder, dim, count, chunks
+    cNNNNNN_embeddings.npy        float32 (rows, dim)
+    cNNNNNN_<column>_data.npy     uint8, concatenated UTF-8 values
+    cNNNNNN_<column>_offsets.npy  int64 (rows + 1) value boundaries
+
+for the string columns ``ids``, ``documents`` and ``metadatas`` (JSON).
+
+Usage::
+
+    python -m src.infra.snapshot export memory.npz [--user-id alice]
+    python -m src.infra.snapshot import memory.npz
+"""
+import argparse
+import json
+import os
+import time
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+
+SNAPSHOT_FORMAT = "agent-memory-npz/1"
+# Rows per chunk written by export_memory
+SNAPSHOT_CHUNK_SIZE = int(os.getenv("SNAPSHOT_CHUNK_SIZE", "10000"))
+
+_STRING_COLUMNS = ("ids", "documents", "metadatas")
+
+
+def _encode_strings(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    raw = data.tobytes()
+    bounds = offsets.tolist()
+    return [raw[s:e].decode("utf-8") for s, e in zip(bounds[:-1], bounds[1:])]
+
+
+def _write_array(archive: zipfile.ZipFile, name: str, array: np.ndarray) -> None:
+    with archive.open(f"{name}.npy", "w", force_zip64=True) as f:
+        np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+
+def write_snapshot(path: str, chunks: Iterable[Dict[str, Any]],
+                   manifest: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Stream chunks of ids/documents/metadatas/embeddings into a snapshot
+
+    The archive is written to ``path + ".tmp"`` and renamed into place, so
+    an interrupted export never leaves a truncated snapshot behind.
+    Returns the manifest.
+    """
+    manifest = {"format": SNAPSHOT_FORMAT, "created": time.time(),
+                **(manifest or {}), "count": 0, "chunks": 0, "dim": None}
+    tmp_path = f"{path}.tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for chunk in chunks:
+            if not chunk["ids"]:
+                continue
+            prefix = f"c{manifest['chunks']:06d}"
+            embeddings = np.asarray(chunk["embeddings"], dtype=np.float32)
+            if manifest["dim"] is None:
+                manifest["dim"] = int(embeddings.shape[1])
+            elif embeddings.shape[1] != manifest["dim"]:
+                raise ValueError("All embeddings in a snapshot must share one dimension")
+            columns = {
+                "ids": chunk["ids"],
+                "documents": chunk["documents"],
+                "metadatas": [json.dumps(m or {}, separators=(",", ":"))
+                              for m in chunk["metadatas"]]
+            }
+            for column, values in columns.items():
+                data, offsets = _encode_strings(values)
+                _write_array(archive, f"{prefix}_{column}_data", data)
+                _write_array(archive, f"{prefix}_{column}_offsets", offsets)
+            _write_array(archive, f"{prefix}_embeddings", embeddings)
+            manifest["count"] += len(chunk["ids"])
+            manifest["chunks"] += 1
+        manifest_bytes = json.dumps(manifest).encode("utf-8")
+        _write_array(archive, "manifest", np.frombuffer(manifest_bytes, dtype=np.uint8))
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with np.load(path, allow_pickle=False) as snapshot:
+        return json.loads(snapshot["manifest"].tobytes().decode("utf-8"))
+
+
+def iter_snapshot(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the chunks of a snapshot one at a time"""
+    with np.load(path, allow_pickle=False) as snapshot:
+        manifest = json.loads(snapshot["manifest"].tobytes().decode("utf-8"))
+        if manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format: {manifest.get('format')}")
+        for n in range(manifest["chunks"]):
+            prefix = f"c{n:06d}"
+            chunk = {
+                column: _decode_strings(snapshot[f"{prefix}_{column}_data"],
+                                        snapshot[f"{prefix}_{column}_offsets"])
+                for column in _STRING_COLUMNS
+            }
+            chunk["metadatas"] = [json.loads(m) for m in chunk["metadatas"]]
+            chunk["embeddings"] = snapshot[f"{prefix}_embeddings"]
+            yield chunk
+
+
+def export_memory(path: str, user_id: Optional[str] = None,
+                  chunk_size: int = SNAPSHOT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Export all memories (or one user's partition) to a snapshot file"""
+    from src.infra import vector_store
+
+    def chunks():
+        for page in vector_store.scan_memory(
+                include=["documents", "metadatas", "embeddings"],
+                page_size=chunk_size, user_id=user_id):
+            yield page
+
+    start = time.perf_counter()
+    manifest = write_snapshot(path, chunks(), {
+        "embedder": vector_store.embedder_model_id(),
+        "backend": vector_store.VECTOR_STORE_BACKEND,
+        "partition_mode": vector_store.MEMORY_PARTITION_MODE,
+        "user_id": user_id
+    })
+    manifest["seconds"] = round(time.perf_counter() - start, 3)
+    return manifest
+
+
+def _base_model(model_id: Optional[str]) -> Optional[str]:
+    # The int8 ONNX export embeds into the same space as the fp32 model
+    return model_id.split(":", 1)[0] if model_id else model_id
+
+
+def import_memory(path: str, force: bool = False) -> Dict[str, Any]:
+    """Bulk-load a snapshot into the configured store without re-embedding
+
+    Refuses snapshots made with a different embedding model unless force is
+    set, since their vectors would not be comparable with new queries.
+    Documents already stored (same content in the same partition) are
+    skipped. Chunks are written in slices no larger than the backend's
+    max batch size.
+    """
+    from src.infra import vector_store
+
+    manifest = read_manifest(path)
+    current = vector_store.embedder_model_id()
+    if _base_model(manifest.get("embedder")) != _base_model(current) and not force:
+        raise ValueError(
+            f"Snapshot was embedded with {manifest.get('embedder')}, "
+            f"but the configured embedder is {current}"
+        )
+
+    start = time.perf_counter()
+    report = {"count": manifest["count"], "imported": 0, "duplicates": 0}
+    limit = vector_store.max_batch_size()
+    for chunk in iter_snapshot(path):
+        step = limit or len(chunk["ids"])
+        for s in range(0, len(chunk["ids"]), step):
+            results = vector_store.add_embedded(
+                chunk["ids"][s:s + step], chunk["documents"][s:s + step],
+                chunk["embeddings"][s:s + step], chunk["metadatas"][s:s + step]
+            )
+            duplicates = sum(result["duplicate"] for result in results)
+            report["duplicates"] += duplicates
+            report["imported"] += len(results) - duplicates
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export or import agent memory snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = commands.add_parser("export", help="Write memory to a snapshot file")
+    export_cmd.add_argument("path")
+    export_cmd.add_argument("--user-id", help="Only export this user's partition")
+    export_cmd.add_argument("--chunk-size", type=int, default=SNAPSHOT_CHUNK_SIZE)
+
+    import_cmd = commands.add_parser("import", help="Load a snapshot file into memory")
+    import_cmd.add_argument("path")
+    import_cmd.add_argument("--force", action="store_true",
+                            help="Import even if the embedding model differs")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        result = export_memory(args.path, user_id=args.user_id, chunk_size=args.chunk_size)
+    else:
+        result = import_memory(args.path, force=args.force)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
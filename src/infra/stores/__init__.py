@@ -0,0 +1,11 @@
+from .base import VectorStore, match_where
+from .chroma_store import ChromaStore
+from .numpy_store import NumpyStore
+
+
+__all__ = [
+    "VectorStore",
+    "match_where",
+    "ChromaStore",
+    "NumpyStore"
+]
@@ -0,0 +1,103 @@
+"""VectorStore protocol shared by the memory storage backends"""
+from typing import (
+    Any, Dict, Iterator, List, Optional, Protocol, Sequence, runtime_checkable
+)
+
+# Fields returned when a caller does not ask for a specific projection
+DEFAULT_QUERY_INCLUDE = ["documents", "metadatas", "distances"]
+DEFAULT_GET_INCLUDE = ["documents", "metadatas"]
+
+
+@runtime_checkable
+class VectorStore(Protocol):
+    """Minimal store interface used by src.infra.vector_store
+
+    Results use Chroma's dictionary layout so callers do not need to know
+    which backend produced them: ``query`` returns one nested list per
+    query (``{"ids": [[...]], "distances": [[...]], ...}``) and ``get``
+    returns flat lists.
+    """
+
+    name: str
+    # Most rows one add_batch call may hand to the backend (None = no limit)
+    max_batch_size: Optional[int]
+
+    def add(self, id: str, document: str, embedding: Sequence[float],
+            metadata: Dict[str, Any]) -> None:
+        ...
+
+    def add_batch(self, ids: List[str], documents: List[str], embeddings: Any,
+                  metadatas: List[Dict[str, Any]]) -> None:
+        ...
+
+    def query(self, embedding: Sequence[float], top_k: int,
+              where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> Dict[str, Any]:
+        ...
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        ...
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the metadata of existing documents"""
+        ...
+
+    def delete(self, ids: Optional[List[str]] = None,
+               where: Optional[dict] = None) -> None:
+        ...
+
+    def count(self) -> int:
+        ...
+
+    def iterate(self, batch_size: int = 1000, where: Optional[dict] = None,
+                include: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Yield ``get``-style pages of at most batch_size rows"""
+        ...
+
+
+def _compare(value: Any, condition: Any) -> bool:
+    """Evaluate one Chroma-style field condition against a metadata value"""
+    if not isinstance(condition, dict):
+        return value == condition
+    for op, operand in condition.items():
+        if op == "$eq":
+            ok = value == operand
+        elif op == "$ne":
+            ok = value != operand
+        elif op == "$in":
+            ok = value in operand
+        elif op == "$nin":
+            ok = value not in operand
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if value is None or isinstance(value, str) != isinstance(operand, str):
+                return False
+            ok = {
+                "$gt": value > operand,
+                "$gte": value >= operand,
+                "$lt": value < operand,
+                "$lte": value <= operand,
+            }[op]
+        else:
+            raise ValueError(f"Unsupported where operator: {op}")
+        if not ok:
+            return False
+    return True
+
+
+def match_where(metadata: Optional[dict], where: Optional[dict]) -> bool:
+    """Return True if metadata satisfies a Chroma-style where clause"""
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(match_where(metadata, clause) for clause in condition):
+                return False
+        elif not _compare(metadata.get(key), condition):
+            return False
+    return True
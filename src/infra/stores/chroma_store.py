@@ -0,0 +1,89 @@
+"""Chroma implementation of the VectorStore protocol"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import numpy as np
+
+from src.infra.stores.base import DEFAULT_GET_INCLUDE, DEFAULT_QUERY_INCLUDE
+
+
+class ChromaStore:
+    """VectorStore backed by a single Chroma collection
+
+    Chroma rejects an ``add`` larger than its client's max batch size, so
+    ``add_batch`` writes in slices of at most ``max_batch_size`` rows.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+        try:
+            self.max_batch_size = collection._client.get_max_batch_size()
+        except Exception:
+            self.max_batch_size = None
+
+    def add(self, id: str, document: str, embedding: Sequence[float],
+            metadata: Dict[str, Any]) -> None:
+        self.add_batch([id], [document], [embedding], [metadata])
+
+    def add_batch(self, ids: List[str], documents: List[str], embeddings: Any,
+                  metadatas: List[Dict[str, Any]]) -> None:
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        step = self.max_batch_size or len(ids)
+        for start in range(0, len(ids), step):
+            end = start + step
+            self.collection.add(
+                ids=ids[start:end],
+                documents=documents[start:end],
+                embeddings=embeddings[start:end],
+                metadatas=metadatas[start:end]
+            )
+
+    def query(self, embedding: Sequence[float], top_k: int,
+              where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> Dict[str, Any]:
+        return self.collection.query(
+            query_embeddings=[np.asarray(embedding, dtype=np.float32)],
+            n_results=top_k,
+            where=where,
+            include=include or DEFAULT_QUERY_INCLUDE
+        )
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        return self.collection.get(
+            ids=ids,
+            where=where,
+            limit=limit,
+            offset=offset,
+            include=DEFAULT_GET_INCLUDE if include is None else include
+        )
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        step = self.max_batch_size or len(ids) or 1
+        for start in range(0, len(ids), step):
+            self.collection.update(
+                ids=ids[start:start + step],
+                metadatas=metadatas[start:start + step]
+            )
+
+    def delete(self, ids: Optional[List[str]] = None,
+               where: Optional[dict] = None) -> None:
+        if ids is not None and not ids:
+            return
+        self.collection.delete(ids=ids, where=where)
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def iterate(self, batch_size: int = 1000, where: Optional[dict] = None,
+                include: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        offset = 0
+        while True:
+            page = self.get(where=where, limit=batch_size, offset=offset,
+                            include=include)
+            if not page["ids"]:
+                return
+            yield page
+            offset += len(page["ids"])
@@ -0,0 +1,566 @@
+"""Memory-mapped NumPy implementation of the VectorStore protocol
+
+Embeddings live in a float32 ``embeddings.npy`` matrix opened with
+``mmap_mode``, so the store opens instantly and worker processes share one
+copy through the page cache. Their squared norms are kept next to it in
+``norms.npy`` so opening never reads the matrix. Ids, documents and
+metadata live in an append-only ``records.jsonl`` log; a row only counts
+once its record line is written, which lets the matrix be over-allocated
+and grown geometrically. Metadata updates append the new metadata and
+deletes append a tombstone line that only masks their rows; once more than ``compact_ratio`` of the rows are dead the files
+are rewritten without them.
+
+Queries are exact by default: squared L2 distances (Chroma's default
+metric) are computed with a blocked matmul and the top-k is selected with
+``np.argpartition``. Rows are looked up per ``user_id`` through an
+in-memory index, so partition-filtered queries never scan every record.
+With ``index_mode`` set to ``int8`` or ``binary`` a compact QuantizedIndex
+held in RAM preselects candidates, which are then rescored exactly against
+the float32 rows paged in from disk; on open it is rebuilt in a background
+thread and queries stay exact until it is ready. A single writer process
+is assumed; readers in other processes pick up appended rows on their
+next call.
+"""
+import itertools
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+import numpy as np
+
+from src.infra.stores.base import (
+    DEFAULT_GET_INCLUDE, DEFAULT_QUERY_INCLUDE, match_where
+)
+from src.infra.stores.quantized import QuantizedIndex
+
+# Rows scored per matmul block during a query
+QUERY_BLOCK_ROWS = int(os.getenv("NUMPY_STORE_BLOCK_ROWS", "65536"))
+INITIAL_CAPACITY = 1024
+
+# "exact", or "int8"/"binary" for quantized candidate search with exact rerank
+NUMPY_INDEX_MODE = os.getenv("NUMPY_INDEX_MODE", "exact")
+# Candidates rescored in full precision per quantized query
+RERANK_CANDIDATES = int(os.getenv("NUMPY_RERANK_CANDIDATES", "256"))
+# Fraction of deleted rows that triggers rewriting the files without them
+NUMPY_COMPACT_RATIO = float(os.getenv("NUMPY_COMPACT_RATIO", "0.25"))
+
+
+class NumpyStore:
+    """VectorStore backed by a memory-mapped float32 matrix on disk"""
+
+    max_batch_size = None
+
+    def __init__(self, path: str, index_mode: str = NUMPY_INDEX_MODE,
+                 rerank_candidates: int = RERANK_CANDIDATES,
+                 compact_ratio: float = NUMPY_COMPACT_RATIO):
+        self.path = path
+        self.index_mode = index_mode
+        self.rerank_candidates = rerank_candidates
+        self.compact_ratio = compact_ratio
+        self.name = os.path.basename(os.path.normpath(path))
+        self._emb_path = os.path.join(path, "embeddings.npy")
+        self._norm_path = os.path.join(path, "norms.npy")
+        self._rec_path = os.path.join(path, "records.jsonl")
+        self._lock = threading.RLock()
+        self._index_ready = threading.Event()
+        # Bumped whenever the rows are renumbered, so a stale background
+        # index build knows to give up
+        self._generation = 0
+        os.makedirs(path, exist_ok=True)
+        self._reload()
+
+    # ------------------------------------------------------------------
+    # Loading and growth
+    # ------------------------------------------------------------------
+
+    def _reload(self, index: Optional[QuantizedIndex] = None) -> None:
+        """Load the record log and map the embedding and norm files"""
+        self._ids = []
+        self._documents = []
+        self._metadatas = []
+        self._rows = {}
+        self._deleted = set()
+        self._live = None
+        # user_id -> {row: None} of live rows, in insertion order
+        self._by_user = {}
+        self._rec_offset = 0
+        self._rec_inode = None
+        self._matrix = None
+        self._emb_inode = None
+        self._norms = None
+        self._norm_inode = None
+        self.dim = None
+        self._generation += 1
+        self._read_new_records()
+        self._map_matrix()
+        self._map_norms()
+        self._index = index
+        self._index_ready.clear()
+        if index is not None or self.index_mode == "exact" or not self._ids:
+            self._index_ready.set()
+        else:
+            threading.Thread(
+                target=self._build_index, args=(self._generation,),
+                name=f"numpy-index-{self.name}", daemon=True
+            ).start()
+
+    def _read_new_records(self) -> None:
+        """Apply log lines written since the last read (by any process)"""
+        if not os.path.exists(self._rec_path):
+            return
+        with open(self._rec_path, "rb") as f:
+            self._rec_inode = os.fstat(f.fileno()).st_ino
+            f.seek(self._rec_offset)
+            data = f.read()
+        # Ignore a trailing line that another process is still writing
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            record = json.loads(line)
+            op = record.get("op")
+            if op == "delete":
+                self._tombstone(record["ids"])
+            elif op == "update":
+                self._set_metadata(record["ids"], record["metadatas"])
+            else:
+                self._append_row(record["id"], record["document"], record["metadata"])
+        self._rec_offset += end
+
+    def _append_row(self, doc_id: str, document: str, metadata: dict) -> None:
+        row = len(self._ids)
+        self._rows[doc_id] = row
+        self._ids.append(doc_id)
+        self._documents.append(document)
+        self._metadatas.append(metadata)
+        self._by_user.setdefault((metadata or {}).get("user_id"), {})[row] = None
+        if self._deleted:
+            self._live = None
+
+    def _set_metadata(self, ids: List[str], metadatas: List[dict]) -> None:
+        for doc_id, metadata in zip(ids, metadatas):
+            row = self._rows.get(doc_id)
+            if row is None:
+                continue
+            old_user = (self._metadatas[row] or {}).get("user_id")
+            new_user = (metadata or {}).get("user_id")
+            if old_user != new_user:
+                self._by_user.get(old_user, {}).pop(row, None)
+                self._by_user.setdefault(new_user, {})[row] = None
+            self._metadatas[row] = metadata
+
+    def _tombstone(self, ids: List[str]) -> None:
+        for doc_id in ids:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                continue
+            self._deleted.add(row)
+            rows = self._by_user.get((self._metadatas[row] or {}).get("user_id"))
+            if rows is not None:
+                rows.pop(row, None)
+            self._documents[row] = None
+            self._metadatas[row] = None
+        self._live = None
+
+    def _map_matrix(self) -> None:
+        if not os.path.exists(self._emb_path):
+            return
+        self._matrix = np.load(self._emb_path, mmap_mode="r+")
+        self._emb_inode = os.stat(self._emb_path).st_ino
+        self.dim = self._matrix.shape[1]
+
+    def _map_norms(self) -> None:
+        """Map the squared-norm file, writing it once for older stores"""
+        if self._matrix is None:
+            return
+        if not os.path.exists(self._norm_path):
+            # Store written before norms were persisted: compute them once
+            norms = np.lib.format.open_memmap(
+                self._norm_path + ".tmp.npy", mode="w+", dtype=np.float32,
+                shape=(self._matrix.shape[0],)
+            )
+            norms[:len(self._ids)] = self._row_norms(0, len(self._ids))
+            norms.flush()
+            del norms
+            os.replace(self._norm_path + ".tmp.npy", self._norm_path)
+        self._norms = np.load(self._norm_path, mmap_mode="r+")
+        self._norm_inode = os.stat(self._norm_path).st_ino
+
+    def _row_norms(self, start: int, stop: int) -> np.ndarray:
+        norms = np.empty(stop - start, dtype=np.float32)
+        for s in range(start, stop, QUERY_BLOCK_ROWS):
+            e = min(stop, s + QUERY_BLOCK_ROWS)
+            block = self._matrix[s:e]
+            norms[s - start:e - start] = np.einsum("ij,ij->i", block, block)
+        return norms
+
+    def _build_index(self, generation: int) -> None:
+        """Encode the stored rows into a fresh quantized index, off the
+        request path, and install it once it has caught up with the store"""
+        index = QuantizedIndex(self.index_mode, self.dim, QUERY_BLOCK_ROWS)
+        done = 0
+        while True:
+            with self._lock:
+                if self._generation != generation:
+                    return
+                total, matrix = len(self._ids), self._matrix
+                if done >= total:
+                    self._index = index
+                    self._index_ready.set()
+                    return
+            stop = min(total, done + QUERY_BLOCK_ROWS)
+            index.append(matrix[done:stop])
+            done = stop
+
+    def wait_for_index(self, timeout: Optional[float] = None) -> bool:
+        """Block until the quantized index (if any) is ready"""
+        return self._index_ready.wait(timeout)
+
+    def _index_rows(self, start: int, stop: int) -> None:
+        """Add stored rows [start, stop) to the quantized index, if enabled"""
+        if self.index_mode == "exact" or self._matrix is None:
+            return
+        if self._index is None:
+            if not self._index_ready.is_set():
+                # The background build catches up with these rows
+                return
+            self._index = QuantizedIndex(self.index_mode, self.dim, QUERY_BLOCK_ROWS)
+        for s in range(start, stop, QUERY_BLOCK_ROWS):
+            self._index.append(self._matrix[s:min(stop, s + QUERY_BLOCK_ROWS)])
+
+    def _refresh(self) -> None:
+        """Pick up changes made by other processes since the last call"""
+        try:
+            rec_stat = os.stat(self._rec_path)
+        except FileNotFoundError:
+            if self._ids:
+                self._reload()
+            return
+        if rec_stat.st_ino != self._rec_inode or rec_stat.st_size < self._rec_offset:
+            # Records were rewritten (e.g. by a compaction)
+            self._reload()
+            return
+        if rec_stat.st_size == self._rec_offset:
+            return
+        start = len(self._ids)
+        self._read_new_records()
+        if os.stat(self._emb_path).st_ino != self._emb_inode:
+            self._map_matrix()
+        if os.stat(self._norm_path).st_ino != self._norm_inode:
+            self._map_norms()
+        self._index_rows(start, len(self._ids))
+
+    def _ensure_capacity(self, rows: int, dim: int) -> None:
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if capacity >= rows:
+            return
+        new_capacity = max(rows, 2 * capacity, INITIAL_CAPACITY)
+        count = len(self._ids)
+        tmp_path = self._emb_path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, dim)
+        )
+        for s in range(0, count, QUERY_BLOCK_ROWS):
+            e = min(count, s + QUERY_BLOCK_ROWS)
+            grown[s:e] = self._matrix[s:e]
+        grown.flush()
+        del grown
+        tmp_norms = self._norm_path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(
+            tmp_norms, mode="w+", dtype=np.float32, shape=(new_capacity,)
+        )
+        if self._norms is not None:
+            grown[:count] = self._norms[:count]
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self._emb_path)
+        os.replace(tmp_norms, self._norm_path)
+        self._map_matrix()
+        self._map_norms()
+
+    def _append_log(self, lines: List[dict]) -> None:
+        payload = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        with open(self._rec_path, "ab") as f:
+            f.write(payload)
+            self._rec_inode = os.fstat(f.fileno()).st_ino
+        self._rec_offset += len(payload)
+
+    # ------------------------------------------------------------------
+    # VectorStore protocol
+    # ------------------------------------------------------------------
+
+    def add(self, id: str, document: str, embedding: Sequence[float],
+            metadata: Dict[str, Any]) -> None:
+        self.add_batch([id], [document], [embedding], [metadata])
+
+    def add_batch(self, ids: List[str], documents: List[str], embeddings: Any,
+                  metadatas: List[Dict[str, Any]]) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            self._refresh()
+            duplicates = [doc_id for doc_id in ids if doc_id in self._rows]
+            if duplicates or len(set(ids)) != len(ids):
+                raise ValueError(f"Duplicate ids in add: {duplicates or ids}")
+            if self.dim is not None and vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match "
+                    f"store dimension {self.dim}"
+                )
+
+            start = len(self._ids)
+            self._ensure_capacity(start + len(ids), vectors.shape[1])
+            self._matrix[start:start + len(ids)] = vectors
+            self._matrix.flush()
+            self._norms[start:start + len(ids)] = np.einsum("ij,ij->i", vectors, vectors)
+            self._norms.flush()
+
+            # Appending the records is the commit point for the new rows
+            self._append_log([
+                {"id": i, "document": d, "metadata": m}
+                for i, d, m in zip(ids, documents, metadatas)
+            ])
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                self._append_row(doc_id, document, metadata)
+            self._index_rows(start, len(self._ids))
+
+    def _live_rows(self) -> Optional[np.ndarray]:
+        """Rows not deleted, or None when every row is live"""
+        if not self._deleted:
+            return None
+        if self._live is None:
+            alive = np.ones(len(self._ids), dtype=bool)
+            alive[np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted))] = False
+            self._live = np.flatnonzero(alive)
+        return self._live
+
+    def _user_rows(self, where: dict):
+        """(rows, rest) when where pins user_id to one or more values
+
+        rows are the live rows of those users from the in-memory index and
+        rest is what of the clause still has to be checked per row; None
+        when the clause does not constrain user_id at the top level.
+        """
+        clauses = where["$and"] if set(where) == {"$and"} else [where]
+        for clause in clauses:
+            if not isinstance(clause, dict) or "user_id" not in clause:
+                continue
+            condition = clause["user_id"]
+            if isinstance(condition, dict):
+                if set(condition) == {"$eq"}:
+                    users = [condition["$eq"]]
+                elif set(condition) == {"$in"}:
+                    users = list(condition["$in"])
+                else:
+                    continue
+            else:
+                users = [condition]
+            rows = [row for user in users for row in self._by_user.get(user, ())]
+            rows = np.sort(np.asarray(rows, dtype=np.int64))
+            rest = [c for c in clauses if c is not clause]
+            if len(clause) > 1:
+                rest.append({k: v for k, v in clause.items() if k != "user_id"})
+            return rows, ({"$and": rest} if len(rest) > 1 else (rest[0] if rest else None))
+        return None
+
+    def _candidate_rows(self, where: Optional[dict]) -> Optional[np.ndarray]:
+        """Live row indices matching a where clause, or None for all rows"""
+        if not where:
+            return self._live_rows()
+        narrowed = self._user_rows(where)
+        if narrowed is not None:
+            rows, where = narrowed
+            if not where:
+                return rows
+        else:
+            rows = self._live_rows()
+            rows = range(len(self._ids)) if rows is None else rows
+        return np.fromiter(
+            (r for r in rows if match_where(self._metadatas[r], where)),
+            dtype=np.int64
+        )
+
+    def _top_k(self, query: np.ndarray, top_k: int,
+               rows: Optional[np.ndarray]):
+        """Exact top-k by squared L2 distance over all rows or a subset"""
+        total = len(self._ids) if rows is None else len(rows)
+        query_sq = float(query @ query)
+        best_rows, best_dists = [], []
+        for s in range(0, total, QUERY_BLOCK_ROWS):
+            e = min(total, s + QUERY_BLOCK_ROWS)
+            if rows is None:
+                block_rows = np.arange(s, e)
+                block = self._matrix[s:e]
+            else:
+                block_rows = rows[s:e]
+                block = self._matrix[block_rows]
+            dists = self._norms[block_rows] - 2.0 * (block @ query) + query_sq
+            k = min(top_k, len(dists))
+            part = np.argpartition(dists, k - 1)[:k]
+            best_rows.append(block_rows[part])
+            best_dists.append(dists[part])
+
+        if not best_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        cand_rows = np.concatenate(best_rows)
+        cand_dists = np.concatenate(best_dists)
+        k = min(top_k, len(cand_dists))
+        part = np.argpartition(cand_dists, k - 1)[:k]
+        order = part[np.argsort(cand_dists[part], kind="stable")]
+        return cand_rows[order], np.maximum(cand_dists[order], 0.0)
+
+    def _search(self, query: np.ndarray, top_k: int,
+                rows: Optional[np.ndarray]):
+        """Top-k search, preselecting candidates from the quantized index"""
+        total = len(self._ids) if rows is None else len(rows)
+        n_candidates = max(self.rerank_candidates, top_k)
+        if self._index is not None and total > n_candidates:
+            candidates = self._index.candidates(
+                query, n_candidates, rows, self._norms
+            )
+            # Sorted rows keep the rerank reads sequential on disk
+            rows = np.sort(candidates)
+        return self._top_k(query, top_k, rows)
+
+    def index_stats(self) -> Dict[str, Any]:
+        """Resident size of the quantized index (if any)"""
+        with self._lock:
+            return {
+                "mode": self.index_mode,
+                "rows": len(self._rows),
+                "deleted_rows": len(self._deleted),
+                "index_ready": self._index_ready.is_set(),
+                "index_bytes": self._index.nbytes if self._index is not None else 0,
+                "users": len(self._by_user)
+            }
+
+    def _project(self, rows: Sequence[int], include: List[str]) -> Dict[str, Any]:
+        result = {"ids": [self._ids[r] for r in rows]}
+        result["documents"] = (
+            [self._documents[r] for r in rows] if "documents" in include else None
+        )
+        result["metadatas"] = (
+            [self._metadatas[r] for r in rows] if "metadatas" in include else None
+        )
+        if "embeddings" in include:
+            result["embeddings"] = (
+                np.array(self._matrix[np.asarray(rows, dtype=np.int64)])
+                if len(rows) else np.empty((0, self.dim or 0), dtype=np.float32)
+            )
+        else:
+            result["embeddings"] = None
+        return result
+
+    def query(self, embedding: Sequence[float], top_k: int,
+              where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = include or DEFAULT_QUERY_INCLUDE
+        with self._lock:
+            self._refresh()
+            rows = dists = []
+            if self._rows and top_k > 0:
+                query = np.asarray(embedding, dtype=np.float32).ravel()
+                rows, dists = self._search(query, top_k, self._candidate_rows(where))
+            flat = self._project(list(rows), include)
+        result = {key: None if value is None else [value]
+                  for key, value in flat.items()}
+        result["distances"] = (
+            [[float(d) for d in dists]] if "distances" in include else None
+        )
+        return result
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict[str, Any]:
+        include = DEFAULT_GET_INCLUDE if include is None else include
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                rows = [self._rows[i] for i in ids if i in self._rows]
+                if where:
+                    rows = [r for r in rows if match_where(self._metadatas[r], where)]
+            else:
+                rows = self._candidate_rows(where)
+                if rows is None:
+                    rows = range(len(self._ids))
+            start = offset or 0
+            stop = None if limit is None else start + limit
+            return self._project(list(itertools.islice(rows, start, stop)), include)
+
+    def update(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the metadata of existing documents (unknown ids are skipped)"""
+        with self._lock:
+            self._refresh()
+            known = [(i, m) for i, m in zip(ids, metadatas) if i in self._rows]
+            if not known:
+                return
+            ids, metadatas = [i for i, _ in known], [m for _, m in known]
+            self._append_log([{"op": "update", "ids": ids, "metadatas": metadatas}])
+            self._set_metadata(ids, metadatas)
+
+    def delete(self, ids: Optional[List[str]] = None,
+               where: Optional[dict] = None) -> None:
+        """Tombstone matching rows; compact once enough rows are dead"""
+        with self._lock:
+            self._refresh()
+            doomed = self.get(ids=ids, where=where, include=[])["ids"]
+            if not doomed:
+                return
+            self._append_log([{"op": "delete", "ids": doomed}])
+            self._tombstone(doomed)
+            if len(self._deleted) > self.compact_ratio * len(self._ids):
+                self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the files without deleted rows, replacing the records last"""
+        with self._lock:
+            self._refresh()
+            if not self._deleted:
+                return
+            keep = self._live_rows()
+            tmp_emb = self._emb_path + ".tmp.npy"
+            tmp_norms = self._norm_path + ".tmp.npy"
+            capacity = max(len(keep), INITIAL_CAPACITY)
+            compacted = np.lib.format.open_memmap(
+                tmp_emb, mode="w+", dtype=np.float32, shape=(capacity, self.dim)
+            )
+            norms = np.lib.format.open_memmap(
+                tmp_norms, mode="w+", dtype=np.float32, shape=(capacity,)
+            )
+            for s in range(0, len(keep), QUERY_BLOCK_ROWS):
+                e = min(len(keep), s + QUERY_BLOCK_ROWS)
+                compacted[s:e] = self._matrix[keep[s:e]]
+                norms[s:e] = self._norms[keep[s:e]]
+            compacted.flush()
+            norms.flush()
+            del compacted, norms
+
+            tmp_rec = self._rec_path + ".tmp"
+            with open(tmp_rec, "wb") as f:
+                for r in keep:
+                    f.write((json.dumps({
+                        "id": self._ids[r],
+                        "document": self._documents[r],
+                        "metadata": self._metadatas[r]
+                    }) + "\n").encode("utf-8"))
+            index = self._index.take(keep) if self._index is not None else None
+            self._matrix = self._norms = None
+            os.replace(tmp_emb, self._emb_path)
+            os.replace(tmp_norms, self._norm_path)
+            os.replace(tmp_rec, self._rec_path)
+            self._reload(index)
+
+    def count(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._rows)
+
+    def iterate(self, batch_size: int = 1000, where: Optional[dict] = None,
+                include: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        offset = 0
+        while True:
+            page = self.get(where=where, limit=batch_size, offset=offset,
+                            include=include)
+            if not page["ids"]:
+                return
+            yield page
+            offset += len(page["ids"])
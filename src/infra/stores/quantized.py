@@ -0,0 +1,128 @@
+"""Compact in-RAM codes for approximate candidate search
+
+The NumPy backend keeps full-precision vectors in a memory-mapped file and
+can hold one of these indexes in RAM next to it:
+
+* ``int8``   - per-vector symmetric scalar quantization (4x smaller than
+  float32), scored with an asymmetric float-query x int8-code dot product.
+* ``binary`` - one sign bit per dimension (32x smaller), scored by Hamming
+  distance over packed bits.
+
+Only the best ``n`` candidates are returned; the store rescores them
+exactly against the float32 rows it reads from disk.
+"""
+from typing import Optional
+import numpy as np
+
+INDEX_MODES = ("int8", "binary")
+
+# Bits set in every byte value, for NumPy builds without np.bitwise_count
+_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT[x]
+
+
+class QuantizedIndex:
+    """Growable array of int8 or binary codes, one row per stored vector"""
+
+    def __init__(self, mode: str, dim: int, block_rows: int = 65536):
+        if mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode: {mode}")
+        self.mode = mode
+        self.dim = dim
+        self.block_rows = block_rows
+        width = dim if mode == "int8" else (dim + 7) // 8
+        dtype = np.int8 if mode == "int8" else np.uint8
+        self._codes = np.empty((0, width), dtype=dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return self._codes[:self._size].nbytes + self._scales[:self._size].nbytes
+
+    def _encode(self, vectors: np.ndarray):
+        if self.mode == "binary":
+            return np.packbits(vectors > 0, axis=1), None
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def append(self, vectors: np.ndarray) -> None:
+        """Encode and append float32 vectors (rows must arrive in store order)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        codes, scales = self._encode(vectors)
+        needed = self._size + len(codes)
+        if needed > len(self._codes):
+            capacity = max(needed, 2 * len(self._codes), 1024)
+            grown = np.empty((capacity, self._codes.shape[1]), dtype=self._codes.dtype)
+            grown[:self._size] = self._codes[:self._size]
+            self._codes = grown
+            if scales is not None:
+                grown_scales = np.empty(capacity, dtype=np.float32)
+                grown_scales[:self._size] = self._scales[:self._size]
+                self._scales = grown_scales
+        self._codes[self._size:needed] = codes
+        if scales is not None:
+            self._scales[self._size:needed] = scales
+        self._size = needed
+
+    def take(self, rows: np.ndarray) -> "QuantizedIndex":
+        """New index holding only the given rows, renumbered from 0"""
+        taken = QuantizedIndex(self.mode, self.dim, self.block_rows)
+        taken._codes = self._codes[rows]
+        if self.mode == "int8":
+            taken._scales = self._scales[rows]
+        taken._size = len(rows)
+        return taken
+
+    def candidates(self, query: np.ndarray, n: int,
+                   rows: Optional[np.ndarray] = None,
+                   sq_norms: Optional[np.ndarray] = None) -> np.ndarray:
+        """Row ids of the n best approximate matches (unordered)
+
+        ``rows`` restricts the search to a subset; ``sq_norms`` (exact
+        squared norms per row) turns int8 scores into approximate squared
+        L2 distances so they rank like the exact metric.
+        """
+        query = np.asarray(query, dtype=np.float32).ravel()
+        if self.mode == "binary":
+            query_bits = np.packbits(query > 0)
+        total = self._size if rows is None else len(rows)
+        best_rows, best_scores = [], []
+        for s in range(0, total, self.block_rows):
+            e = min(total, s + self.block_rows)
+            block_rows = np.arange(s, e) if rows is None else rows[s:e]
+            codes = self._codes[s:e] if rows is None else self._codes[block_rows]
+            if self.mode == "binary":
+                scores = _popcount(np.bitwise_xor(codes, query_bits)).sum(
+                    axis=1, dtype=np.int32
+                )
+            else:
+                scores = -2.0 * self._scales[block_rows] * (
+                    codes.astype(np.float32) @ query
+                )
+                if sq_norms is not None:
+                    scores += sq_norms[block_rows]
+            k = min(n, len(scores))
+            part = np.argpartition(scores, k - 1)[:k]
+            best_rows.append(block_rows[part])
+            best_scores.append(scores[part])
+
+        if not best_rows:
+            return np.empty(0, dtype=np.int64)
+        cand_rows = np.concatenate(best_rows)
+        cand_scores = np.concatenate(best_scores)
+        if len(cand_rows) <= n:
+            return cand_rows
+        return cand_rows[np.argpartition(cand_scores, n - 1)[:n]]
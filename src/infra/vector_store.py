@@ -1,111 +1,1009 @@
+import os
+import json
+import threading
+import time
 import uuid
 import hashlib
 import numpy as np
-import chromadb
-from sentence_transformers import SentenceTransformer
-from typing import Optional
+from typing import Any, Dict, Iterator, List, Optional
+from src.infra.cache import LRUCache
+from src.infra.diversity import maximal_marginal_relevance
+from src.infra.embed_pool import get_embed_pool
+from src.infra.embedders import (
+    HashingEmbedder,
+    check_embedder_parity,
+    load_onnx_embedder
+)
+from src.infra.lexical_index import BM25Index, reciprocal_rank_fusion
+from src.infra.single_flight import SingleFlight
+from src.infra.stores import ChromaStore, NumpyStore, VectorStore
 
-# Initialize Chroma client
-client = chromadb.PersistentClient(path="./chroma_db")
-collection = client.get_or_create_collection("agent_memory")
+# Embedder backend: "sentence-transformers" (default, PyTorch fp32), "onnx"
+# (int8-quantized ONNX on onnxruntime) or "hashing" (offline, deterministic
+# feature hashing for load tests and CI)
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "sentence-transformers")
+EMBEDDER_MODEL_ID = os.getenv("EMBEDDER_MODEL_ID", "all-MiniLM-L6-v2")
+EMBEDDER_ONNX_FILE = os.getenv("EMBEDDER_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# CPU threads of the ONNX embedder's onnxruntime session (0 keeps the
+# runtime default). In the serving process the PyTorch embedder is not
+# limited separately: torch's thread pool is process-wide and sized by
+# LOCAL_CPU_THREADS for the local model. Embed pool workers, which run only
+# the embedder, apply it to torch as well
+EMBEDDER_THREADS = int(os.getenv("EMBEDDER_THREADS", "0"))
+# Compare the ONNX embedder against fp32 on load and refuse it below this
+EMBEDDER_PARITY_CHECK = os.getenv("EMBEDDER_PARITY_CHECK", "0") == "1"
+EMBEDDER_PARITY_MIN_COSINE = float(os.getenv("EMBEDDER_PARITY_MIN_COSINE", "0.99"))
+
+# Number of texts embedded and written per chunk by add_contexts
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+# Page size for streaming scans and batched deletes
+SCAN_PAGE_SIZE = int(os.getenv("SCAN_PAGE_SIZE", "1000"))
+
+# Bounds for the query-embedding LRU cache used by query_context
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "4096"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Bounds for the query_context result cache. Entries are invalidated
+# exactly by store generation on in-process writes; the TTL bounds
+# staleness from writes made by other processes
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2048"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+
+# How memory is separated between users:
+#   "filter"     - one shared collection, queries filtered by user_id metadata
+#   "collection" - one collection per user, handles kept in a bounded cache
+#   "none"       - one shared collection searched by everyone
+MEMORY_PARTITION_MODE = os.getenv("MEMORY_PARTITION_MODE", "filter")
+# user_id stored on memories added without one in "filter" mode (knowledge
+# base imports and other shared items); every user's queries include them
+SHARED_USER_ID = "__shared__"
+# Scan stored memories at startup and add user_id/content_hash to records
+# written before those fields existed (set to 0 once every store is migrated)
+MEMORY_BACKFILL_ON_START = os.getenv("MEMORY_BACKFILL_ON_START", "1") == "1"
+PARTITION_HANDLE_CACHE_SIZE = int(os.getenv("PARTITION_HANDLE_CACHE_SIZE", "256"))
+
+# Content hashes remembered for duplicate checks before falling back to a
+# metadata lookup in the store
+HASH_INDEX_MAX_ENTRIES = int(os.getenv("HASH_INDEX_MAX_ENTRIES", "100000"))
+
+# Hybrid retrieval: BM25 indexes kept per partition (bounded), and the
+# normalized BM25 score / matched-term count above which a lexical hit is
+# trusted without running the embedder
+LEXICAL_INDEX_CACHE_SIZE = int(os.getenv("LEXICAL_INDEX_CACHE_SIZE", "512"))
+# Partitions with more documents than this get no BM25 index (dense only)
+LEXICAL_INDEX_MAX_DOCS = int(os.getenv("LEXICAL_INDEX_MAX_DOCS", "50000"))
+LEXICAL_SHORTCUT_SCORE = float(os.getenv("LEXICAL_SHORTCUT_SCORE", "0.85"))
+LEXICAL_SHORTCUT_MIN_TERMS = int(os.getenv("LEXICAL_SHORTCUT_MIN_TERMS", "2"))
+# Lexical hits below this normalized score are not fused with dense results,
+# so weak keyword overlap cannot bring back memories the distance cutoff
+# dropped
+LEXICAL_FUSION_MIN_SCORE = float(os.getenv("LEXICAL_FUSION_MIN_SCORE", "0.3"))
+
+# Adaptive dense retrieval (query_diverse): candidates fetched, squared-L2
+# distance beyond which they are dropped (1.5 ~ cosine 0.25 for unit
+# vectors), and the MMR relevance/diversity trade-off
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", "20"))
+RETRIEVAL_MAX_DISTANCE = float(os.getenv("RETRIEVAL_MAX_DISTANCE", "1.5"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MMR_MAX_REDUNDANCY = float(os.getenv("MMR_MAX_REDUNDANCY", "0.95"))
+
+# Storage backend: "chroma" (persistent Chroma client) or "numpy"
+# (memory-mapped float32 matrix per collection, see src.infra.stores)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma")
+CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH", "./chroma_db")
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", "./vector_db")
+
+COLLECTION_NAME = "agent_memory"
+USER_COLLECTION_PREFIX = "agent_memory_u_"
+
+# Chroma client and shared store, created on first use so importing this
+# module neither loads chromadb nor touches the database directory
+_client = None
+_store = None
+_store_lock = threading.RLock()
+
+
+def get_client():
+    """Return the persistent Chroma client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _store_lock:
+            if _client is None:
+                import chromadb
+                _client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return _client
+
+
+def open_store(name: str) -> VectorStore:
+    """Open (creating if needed) a named collection on the configured backend"""
+    if VECTOR_STORE_BACKEND == "numpy":
+        return NumpyStore(os.path.join(NUMPY_STORE_PATH, name))
+    if VECTOR_STORE_BACKEND == "chroma":
+        return ChromaStore(get_client().get_or_create_collection(name))
+    raise ValueError(f"Unknown VECTOR_STORE_BACKEND: {VECTOR_STORE_BACKEND}")
+
+
+def list_store_names() -> List[str]:
+    """Names of every collection on the configured backend"""
+    if VECTOR_STORE_BACKEND == "numpy":
+        if not os.path.isdir(NUMPY_STORE_PATH):
+            return []
+        return [name for name in os.listdir(NUMPY_STORE_PATH)
+                if os.path.isdir(os.path.join(NUMPY_STORE_PATH, name))]
+    return [getattr(coll, "name", coll) for coll in get_client().list_collections()]
+
+
+def get_shared_store() -> VectorStore:
+    """Return the shared memory store, opening it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_store(COLLECTION_NAME)
+    return _store
+
+
+def max_batch_size() -> Optional[int]:
+    """Most rows the configured backend accepts in one write, or None"""
+    return getattr(get_shared_store(), "max_batch_size", None)
+
+
+def check_batch_size(batch_size: Optional[int]) -> None:
+    """Raise ValueError unless batch_size is None or 1..max_batch_size()"""
+    if batch_size is None:
+        return
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    store_limit = max_batch_size()
+    if store_limit and batch_size > store_limit:
+        raise ValueError(
+            f"batch_size must not exceed the store's max batch size ({store_limit})"
+        )
+
+
+def __getattr__(name: str):
+    # Lazily resolved module attributes kept for backward compatibility:
+    # ``store`` and its older name ``collection``, and the Chroma ``client``
+    if name in ("store", "collection"):
+        return get_shared_store()
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# user_id -> open per-user store (only used in "collection" mode)
+_user_stores = LRUCache(max_entries=PARTITION_HANDLE_CACHE_SIZE)
 
 # Lazy load embedder to avoid startup issues
 _embedder = None
+_embedder_model_id = None
+_embedder_flight = SingleFlight()
+
+# (model id, normalized query) -> float32 query embedding
+_query_embedding_cache = LRUCache(
+    max_entries=QUERY_CACHE_MAX_ENTRIES,
+    max_bytes=QUERY_CACHE_MAX_BYTES,
+    sizeof=lambda vector: vector.nbytes
+)
+
+# (embedding fingerprint, top_k, filter, generation) -> (time, results)
+_result_cache = LRUCache(max_entries=RESULT_CACHE_MAX_ENTRIES)
+# Write generations: one per partition plus a global epoch bumped by deletes
+_generations = {}
+_delete_epoch = 0
+_generation_lock = threading.Lock()
+
+# partition -> BM25 index over that partition's documents. Built by a
+# background thread on first use, then kept current by the write and
+# delete paths
+_lexical_indexes = LRUCache(max_entries=LEXICAL_INDEX_CACHE_SIZE)
+_lexical_lock = threading.RLock()
+# partition -> (index, ids deleted meanwhile, thread) for builds in progress
+_lexical_building = {}
+# Partitions over LEXICAL_INDEX_MAX_DOCS, never indexed lexically
+_lexical_oversized = set()
+
+# (partition, content_hash) -> document id for documents written or seen by
+# this process. Only a hint: other processes may have deleted the document
+_hash_index = LRUCache(max_entries=HASH_INDEX_MAX_ENTRIES)
+
+
+def partition_for(user_id: Optional[str]) -> Optional[str]:
+    """Return the partition key for a user, or None for the shared store"""
+    if MEMORY_PARTITION_MODE in ("filter", "collection") and user_id:
+        return str(user_id)
+    return None
+
+
+def user_collection_name(user_id: str) -> str:
+    """Chroma-safe collection name for a user's partition"""
+    digest = hashlib.sha256(str(user_id).encode("utf-8")).hexdigest()[:24]
+    return f"{USER_COLLECTION_PREFIX}{digest}"
+
+
+def get_store(partition: Optional[str] = None) -> VectorStore:
+    """Return the store holding a partition's memories"""
+    if partition is None or MEMORY_PARTITION_MODE != "collection":
+        return get_shared_store()
+    handle = _user_stores.get(partition)
+    if handle is None:
+        handle = open_store(user_collection_name(partition))
+        _user_stores.put(partition, handle)
+    return handle
+
+
+def partition_where(partition: Optional[str]) -> Optional[dict]:
+    """Metadata filter that restricts a shared collection to a partition"""
+    if partition is not None and MEMORY_PARTITION_MODE == "filter":
+        return {"user_id": partition}
+    return None
+
+
+def shared_partition() -> Optional[str]:
+    """Partition holding memories that were stored without a user_id"""
+    return SHARED_USER_ID if MEMORY_PARTITION_MODE == "filter" else None
+
+
+def readable_partitions(partition: Optional[str]) -> List[Optional[str]]:
+    """Partitions a query for ``partition`` searches: its own plus shared"""
+    if partition is None or partition == shared_partition():
+        return [partition]
+    return [partition, shared_partition()]
+
+
+def read_where(partition: Optional[str]) -> Optional[dict]:
+    """Metadata filter for queries: the partition's memories plus shared ones
+
+    Writes, scans and deletes use partition_where, which never reaches
+    into the shared partition.
+    """
+    if partition is not None and MEMORY_PARTITION_MODE == "filter":
+        return {"user_id": {"$in": readable_partitions(partition)}}
+    return None
+
+
+def all_stores() -> List[VectorStore]:
+    """Every store that may hold memories (shared plus per-user)"""
+    stores = [get_shared_store()]
+    if MEMORY_PARTITION_MODE == "collection":
+        for name in list_store_names():
+            if name.startswith(USER_COLLECTION_PREFIX):
+                stores.append(open_store(name))
+    return stores
 
 
 def get_embedder():
-    """Lazy load sentence transformer model"""
-    global _embedder
+    """Lazy load the configured embedder
+
+    EMBEDDER_BACKEND=hashing selects the offline HashingEmbedder directly
+    and EMBEDDER_BACKEND=onnx tries the int8 ONNX model first; otherwise
+    sentence-transformers is tried and the hashing embedder is the
+    last-resort fallback. Concurrent first calls share a single load.
+    """
     if _embedder is None:
+        _embedder_flight.do("embedder", _load_embedder)
+    return _embedder
+
+
+def _load_embedder():
+    global _embedder, _embedder_model_id
+    if _embedder is not None:
+        # Loaded by a flight that finished after our check
+        return _embedder
+
+    embedder = None
+    if EMBEDDER_BACKEND == "hashing":
+        print("Using offline hashing embedder...")
+        embedder = HashingEmbedder()
+        model_id = embedder.model_id
+
+    if embedder is None and EMBEDDER_BACKEND == "onnx":
+        embedder = _load_onnx_embedder()
+        model_id = f"{EMBEDDER_MODEL_ID}:onnx-int8"
+
+    if embedder is None:
         print("Loading sentence transformer model...")
         try:
-            # Try the model without specifying the full path first
-            _embedder = SentenceTransformer("all-MiniLM-L6-v2")
-        except Exception as e:
-            print(f"Warning: Could not load all-MiniLM-L6-v2: {e}")
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            print(f"Warning: sentence-transformers is not installed: {e}")
+            SentenceTransformer = None
+        if SentenceTransformer is not None:
             try:
-                # Try alternative model that might not need auth
-                print("Trying alternative model: paraphrase-MiniLM-L6-v2")
-                _embedder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
-            except Exception as e2:
-                print(f"Warning: Could not load paraphrase-MiniLM-L6-v2: {e2}")
-                print("Using a simple mock embedder for testing...")
-                # Create a mock embedder for testing
-                _embedder = MockEmbedder()
-    return _embedder
+                # Try the model without specifying the full path first
+                embedder = SentenceTransformer(EMBEDDER_MODEL_ID)
+                model_id = EMBEDDER_MODEL_ID
+            except Exception as e:
+                print(f"Warning: Could not load {EMBEDDER_MODEL_ID}: {e}")
+                try:
+                    # Try alternative model that might not need auth
+                    print("Trying alternative model: paraphrase-MiniLM-L6-v2")
+                    embedder = SentenceTransformer("paraphrase-MiniLM-L6-v2")
+                    model_id = "paraphrase-MiniLM-L6-v2"
+                except Exception as e2:
+                    print(f"Warning: Could not load paraphrase-MiniLM-L6-v2: {e2}")
 
+    if embedder is None:
+        print("Falling back to the offline hashing embedder...")
+        embedder = HashingEmbedder()
+        model_id = embedder.model_id
 
-class MockEmbedder:
-    """Simple mock embedder for testing when real models fail"""
-    def encode(self, texts):
-        """Create simple hash-based embeddings for testing"""
-        embeddings = []
-        for text in texts:
-            # Create a simple hash-based vector
-            hash_obj = hashlib.md5(text.encode())
-            hash_hex = hash_obj.hexdigest()
-            # Convert to numbers and normalize
-            vector = [
-                int(hash_hex[i:i+2], 16) / 255.0
-                for i in range(0, min(len(hash_hex), 32), 2)
-            ]
-            # Pad to 384 dimensions (like all-MiniLM-L6-v2)
-            while len(vector) < 384:
-                extend_len = min(384-len(vector), len(vector))
-                vector.extend(vector[:extend_len])
-            embeddings.append(vector[:384])
-
-        return np.array(embeddings)
+    # Publish the id first: readers only look at it once _embedder is set
+    _embedder_model_id = model_id
+    _embedder = embedder
+    return embedder
 
 
-def add_context(text: str, metadata: Optional[dict] = None):
-    """Add text and metadata to the vector store"""
-    # Check for duplicates by searching for exact text match
+def _load_onnx_embedder():
+    """Load the int8 ONNX embedder, or return None to fall back to PyTorch"""
+    print(f"Loading int8 ONNX embedder for {EMBEDDER_MODEL_ID}...")
     try:
-        existing = collection.get(where_document={"$contains": text})
-        if existing and existing['documents']:
-            # Check if exact text already exists
-            for doc in existing['documents']:
-                if doc.strip() == text.strip():
-                    print(f"Skipping duplicate: {text[:50]}...")
-                    return
+        embedder = load_onnx_embedder(
+            EMBEDDER_MODEL_ID, EMBEDDER_ONNX_FILE,
+            threads=EMBEDDER_THREADS or None
+        )
+    except Exception as e:
+        print(f"Warning: Could not load ONNX embedder: {e}")
+        return None
+
+    if EMBEDDER_PARITY_CHECK:
+        try:
+            from sentence_transformers import SentenceTransformer
+            reference = SentenceTransformer(EMBEDDER_MODEL_ID)
+        except Exception as e:
+            # Without the fp32 model the check cannot run; the PyTorch
+            # fallback would not load either, so keep the ONNX model
+            print(f"Warning: Skipping the ONNX parity check, no reference model: {e}")
+            return embedder
+        report = check_embedder_parity(
+            embedder, reference, min_cosine=EMBEDDER_PARITY_MIN_COSINE
+        )
+        print(f"ONNX embedder parity: {report}")
+        if not report["passed"]:
+            print("Warning: ONNX embedder failed the parity check, using PyTorch")
+            return None
+    return embedder
+
+
+def embedder_model_id() -> str:
+    """Id of the embedder in use, or of the configured one if not loaded yet"""
+    if _embedder_model_id is not None:
+        return _embedder_model_id
+    if EMBEDDER_BACKEND == "hashing":
+        return HashingEmbedder().model_id
+    if EMBEDDER_BACKEND == "onnx":
+        return f"{EMBEDDER_MODEL_ID}:onnx-int8"
+    return EMBEDDER_MODEL_ID
+
+
+def embed_query(query: str) -> np.ndarray:
+    """Embed a query, serving repeated queries from the LRU cache
+
+    Returns a read-only float32 vector.
+    """
+    embedder = get_embedder()
+    key = (_embedder_model_id, " ".join(query.split()))
+    vector = _query_embedding_cache.get(key)
+    if vector is None:
+        vector = np.asarray(embedder.encode([query])[0], dtype=np.float32)
+        vector.setflags(write=False)
+        _query_embedding_cache.put(key, vector)
+    return vector
+
+
+def store_generation(partition: Optional[str]) -> tuple:
+    """Version of a partition's contents, changed by every write or delete"""
+    with _generation_lock:
+        return (_delete_epoch, _generations.get(partition, 0))
+
+
+def _bump_generation(partition: Optional[str]) -> None:
+    with _generation_lock:
+        _generations[partition] = _generations.get(partition, 0) + 1
+        if partition is not None and MEMORY_PARTITION_MODE == "filter":
+            # Unscoped queries search the whole shared collection
+            _generations[None] = _generations.get(None, 0) + 1
+
+
+def _bump_delete_epoch() -> None:
+    global _delete_epoch
+    with _generation_lock:
+        _delete_epoch += 1
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of whitespace-normalized text, used for exact-duplicate checks"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def find_duplicates(
+    digests: List[str],
+    partition: Optional[str] = None
+) -> Dict[str, str]:
+    """Map each content hash already stored in a partition to its document id
+
+    Ids remembered in the hash index are confirmed to still exist, since
+    another process may have deleted them.
+    """
+    found = {}
+    for digest in set(digests):
+        doc_id = _hash_index.get((partition, digest))
+        if doc_id is not None:
+            found[digest] = doc_id
+    if found:
+        try:
+            alive = set(get_store(partition).get(
+                ids=list(set(found.values())), include=[]
+            )["ids"])
+        except Exception:
+            alive = set()
+        for digest, doc_id in list(found.items()):
+            if doc_id not in alive:
+                _hash_index.pop((partition, digest))
+                del found[digest]
+    missing = [d for d in set(digests) if d not in found]
+    if not missing:
+        return found
+    # Fall back to an indexed metadata lookup so documents written by other
+    # processes (or before this one started) are still detected
+    try:
+        where = ({"content_hash": missing[0]} if len(missing) == 1
+                 else {"content_hash": {"$in": missing}})
+        scope = partition_where(partition)
+        if scope:
+            where = {"$and": [where, scope]}
+        existing = get_store(partition).get(
+            where=where, include=["metadatas"]
+        )
+        for doc_id, meta in zip(existing["ids"], existing["metadatas"]):
+            digest = (meta or {}).get("content_hash")
+            if digest:
+                _hash_index.put((partition, digest), doc_id)
+                found[digest] = doc_id
     except Exception:
         # Continue if duplicate check fails
         pass
-    
-    embedder = get_embedder()
-    embedding = embedder.encode([text]).tolist()
-    doc_id = str(uuid.uuid4())
-    collection.add(
-        ids=[doc_id],
-        documents=[text],
-        embeddings=embedding,
-        metadatas=[metadata or {}]
-    )
+    return found
 
 
-def query_context(query: str, top_k: int = 3):
-    """Query the vector store for similar contexts"""
-    embedder = get_embedder()
-    embedding = embedder.encode([query]).tolist()
-    results = collection.query(query_embeddings=embedding, n_results=top_k)
+def find_duplicate(digest: str, partition: Optional[str] = None) -> Optional[str]:
+    """Return the id of a stored document with this content hash, if any"""
+    return find_duplicates([digest], partition).get(digest)
+
+
+def add_contexts(
+    texts: List[str],
+    metadatas: Optional[List[Optional[dict]]] = None,
+    batch_size: int = EMBED_BATCH_SIZE
+) -> List[Dict[str, Any]]:
+    """Add many texts to the vector store in batches
+
+    Each chunk of ``batch_size`` texts is embedded with a single encode call
+    and committed with one add_batch per user partition in the chunk.
+    Exact duplicates (against the partition or earlier in the same input)
+    are skipped. With EMBED_POOL_WORKERS set, chunks are embedded by the
+    process pool and grown so every worker gets at least one slice.
+
+    Returns one ``{"id": ..., "duplicate": bool}`` entry per input text.
+    """
+    if metadatas is not None and len(metadatas) != len(texts):
+        raise ValueError("metadatas must have the same length as texts")
+    metadatas = metadatas or [None] * len(texts)
+    pool = get_embed_pool()
+    if pool is not None:
+        batch_size = max(batch_size, pool.workers * pool.min_slice)
+
+    results = []
+    for start in range(0, len(texts), batch_size):
+        chunk_results, new_items = _dedupe_chunk(
+            texts[start:start + batch_size], metadatas[start:start + batch_size]
+        )
+        results.extend(chunk_results)
+        if not new_items:
+            continue
+        embedder = pool if pool is not None else get_embedder()
+        embeddings = np.asarray(
+            embedder.encode([item[1] for item in new_items]),
+            dtype=np.float32
+        )
+        _write_items(new_items, embeddings)
+
     return results
 
 
+def add_embedded(
+    ids: List[str],
+    documents: List[str],
+    embeddings: Any,
+    metadatas: Optional[List[Optional[dict]]] = None
+) -> List[Dict[str, Any]]:
+    """Add documents with precomputed embeddings, keeping their ids
+
+    Used to bulk-load snapshots without running the embedder. Duplicates
+    are skipped exactly as in add_contexts, and the result has the same
+    layout.
+    """
+    if not (len(ids) == len(documents) == len(embeddings)):
+        raise ValueError("ids, documents and embeddings must have the same length")
+    metadatas = metadatas or [None] * len(ids)
+    results, new_items = _dedupe_chunk(documents, metadatas, ids)
+    if new_items:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        _write_items(new_items, embeddings[[item[4] for item in new_items]])
+    return results
+
+
+def _dedupe_chunk(
+    texts: List[str],
+    metadatas: List[Optional[dict]],
+    ids: Optional[List[str]] = None
+):
+    """Split a chunk into per-text results and the items still to be written
+
+    New items are ``(id, text, metadata, partition, row)`` tuples, where
+    row is the text's position in the chunk and metadata carries its
+    content hash.
+    """
+    metadatas = [dict(m or {}) for m in metadatas]
+    if MEMORY_PARTITION_MODE == "filter":
+        for metadata in metadatas:
+            if not metadata.get("user_id"):
+                metadata["user_id"] = SHARED_USER_ID
+    digests = [content_hash(text) for text in texts]
+    partitions = [partition_for(m.get("user_id")) for m in metadatas]
+
+    existing = {}
+    for partition in set(partitions):
+        part_digests = [d for d, p in zip(digests, partitions) if p == partition]
+        for digest, doc_id in find_duplicates(part_digests, partition).items():
+            existing[(partition, digest)] = doc_id
+
+    results, new_items = [], []
+    for row, (text, metadata, digest, partition) in enumerate(
+            zip(texts, metadatas, digests, partitions)):
+        if (partition, digest) in existing:
+            results.append({"id": existing[(partition, digest)],
+                            "duplicate": True})
+            continue
+        doc_id = ids[row] if ids is not None else str(uuid.uuid4())
+        existing[(partition, digest)] = doc_id
+        new_items.append((doc_id, text,
+                          {**metadata, "content_hash": digest}, partition, row))
+        results.append({"id": doc_id, "duplicate": False})
+    return results, new_items
+
+
+def _write_items(new_items: List[tuple], embeddings: np.ndarray) -> None:
+    """Write deduplicated items with one add_batch per partition"""
+    for partition in {item[3] for item in new_items}:
+        rows = [i for i, item in enumerate(new_items) if item[3] == partition]
+        get_store(partition).add_batch(
+            ids=[new_items[i][0] for i in rows],
+            documents=[new_items[i][1] for i in rows],
+            embeddings=embeddings[rows],
+            metadatas=[new_items[i][2] for i in rows]
+        )
+        for i in rows:
+            _hash_index.put((partition, new_items[i][2]["content_hash"]), new_items[i][0])
+        _index_lexical(partition, [(new_items[i][0], new_items[i][1]) for i in rows])
+        _bump_generation(partition)
+
+
+def add_context(text: str, metadata: Optional[dict] = None):
+    """Add text and metadata to the vector store
+
+    Returns the id of the stored document, or of the existing document
+    when the text is an exact duplicate.
+    """
+    result = add_contexts([text], [metadata])[0]
+    if result["duplicate"]:
+        print(f"Skipping duplicate: {text[:50]}...")
+    return result["id"]
+
+
+def query_context(query: str, top_k: int = 3, user_id: Optional[str] = None,
+                  include: Optional[List[str]] = None):
+    """Query the vector store for similar contexts
+
+    With a user_id and partitioning enabled, that user's memories and the
+    shared ones (stored without a user_id) are searched. Repeated queries
+    against unchanged partitions are served from the result cache; treat
+    the returned dict as read-only.
+    """
+    include = include or ["documents", "metadatas", "distances"]
+    embedding = embed_query(query)
+    partition = partition_for(user_id)
+    partitions = readable_partitions(partition)
+    where = read_where(partition)
+    key = (
+        hashlib.blake2b(embedding.tobytes(), digest_size=16).hexdigest(),
+        top_k,
+        tuple(include),
+        json.dumps(where, sort_keys=True),
+        partition,
+        tuple(store_generation(p) for p in partitions)
+    )
+    cached = _result_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < RESULT_CACHE_TTL:
+        return cached[1]
+
+    if MEMORY_PARTITION_MODE == "collection" and len(partitions) > 1:
+        # The user's collection and the shared one, merged by distance
+        results = _merge_nearest([
+            get_store(p).query(embedding, top_k, include=include) for p in partitions
+        ], top_k)
+    else:
+        results = get_store(partition).query(embedding, top_k, where=where, include=include)
+    _result_cache.put(key, (time.monotonic(), results))
+    return results
+
+
+def _merge_nearest(result_sets: list, top_k: int):
+    """Merge query results from several stores, nearest first"""
+    keys = [key for key, values in result_sets[0].items()
+            if isinstance(values, list) and values and key != "included"]
+    rows = []
+    for results in result_sets:
+        distances = (results.get("distances") or [[]])[0]
+        for i in range(len(results["ids"][0])):
+            rows.append((distances[i] if i < len(distances) else 0.0, results, i))
+    rows.sort(key=lambda row: row[0])
+    return {key: [[results[key][0][i] for _, results, i in rows[:top_k]]] for key in keys}
+
+
+def query_diverse(
+    query: str,
+    top_k: int = 5,
+    user_id: Optional[str] = None,
+    fetch_k: int = RETRIEVAL_FETCH_K,
+    max_distance: float = RETRIEVAL_MAX_DISTANCE,
+    lambda_mult: float = MMR_LAMBDA
+):
+    """Dense retrieval with a distance cutoff and MMR diversification
+
+    Over-fetches ``fetch_k`` candidates, drops those farther than
+    ``max_distance``, then picks up to ``top_k`` with maximal marginal
+    relevance, so the result may hold fewer items (or none) when the
+    store has little that is relevant. Same layout as query_context, plus
+    ``scores`` (cosine similarity to the query).
+    """
+    results = query_context(
+        query, top_k=max(fetch_k, top_k), user_id=user_id,
+        include=["documents", "metadatas", "distances", "embeddings"]
+    )
+    ids = (results.get("ids") or [[]])[0]
+    distances = np.asarray((results.get("distances") or [[]])[0], dtype=np.float32)
+    keep = np.flatnonzero(distances <= max_distance)
+    selected = []
+    if len(keep):
+        candidates = np.asarray(results["embeddings"][0], dtype=np.float32)[keep]
+        embedding = embed_query(query)
+        picks = maximal_marginal_relevance(
+            embedding, candidates, top_k, lambda_mult, MMR_MAX_REDUNDANCY
+        )
+        selected = [int(keep[i]) for i in picks]
+        norms = np.linalg.norm(candidates, axis=1) * max(float(np.linalg.norm(embedding)), 1e-12)
+        cosine = (candidates @ embedding) / np.maximum(norms, 1e-12)
+        scores = {int(keep[i]): float(cosine[i]) for i in picks}
+
+    documents = (results.get("documents") or [[]])[0]
+    metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(ids)
+    return {
+        "ids": [[ids[i] for i in selected]],
+        "documents": [[documents[i] for i in selected]],
+        "metadatas": [[metadatas[i] for i in selected]],
+        "distances": [[float(distances[i]) for i in selected]],
+        "scores": [[scores[i] for i in selected]]
+    }
+
+
+def get_lexical_index(partition: Optional[str] = None,
+                      wait: bool = False) -> Optional[BM25Index]:
+    """Return the partition's BM25 index, or None if it is not ready
+
+    The first call starts building the index in a background thread so
+    no request pays for the scan; pass ``wait=True`` to block until it is
+    done. Partitions over LEXICAL_INDEX_MAX_DOCS always return None.
+    """
+    with _lexical_lock:
+        index = _lexical_indexes.get(partition)
+        if index is not None or partition in _lexical_oversized:
+            return index
+        build = _lexical_building.get(partition)
+        if build is None:
+            build = (BM25Index(), set(), threading.Thread(
+                target=_build_lexical_index, args=(partition,),
+                name="lexical-index", daemon=True
+            ))
+            _lexical_building[partition] = build
+            build[2].start()
+    if not wait:
+        return None
+    build[2].join()
+    with _lexical_lock:
+        return _lexical_indexes.get(partition)
+
+
+def _build_lexical_index(partition: Optional[str]) -> None:
+    with _lexical_lock:
+        build = _lexical_building.get(partition)
+    if build is None:
+        return
+    index, deleted, _ = build
+    try:
+        pages = get_store(partition).iterate(
+            SCAN_PAGE_SIZE, where=partition_where(partition), include=["documents"]
+        )
+        for page in pages:
+            with _lexical_lock:
+                if _lexical_building.get(partition) is not build:
+                    return
+                # Writes made during the scan were added by _index_lexical
+                # already; deletes made during it must not come back
+                index.add_many((doc_id, doc) for doc_id, doc in
+                               zip(page["ids"], page["documents"])
+                               if doc_id not in deleted)
+                if len(index) > LEXICAL_INDEX_MAX_DOCS:
+                    _lexical_oversized.add(partition)
+                    print(f"Partition {partition!r} has over {LEXICAL_INDEX_MAX_DOCS} "
+                          "memories, skipping its keyword index")
+                    return
+        with _lexical_lock:
+            if _lexical_building.get(partition) is build:
+                _lexical_indexes.put(partition, index)
+    except Exception as e:
+        print(f"Warning: Could not build keyword index for {partition!r}: {e}")
+    finally:
+        with _lexical_lock:
+            if _lexical_building.get(partition) is build:
+                del _lexical_building[partition]
+
+
+def warm_lexical_index(partition: Optional[str] = None) -> None:
+    """Start building a partition's BM25 index ahead of its first query"""
+    get_lexical_index(partition)
+
+
+def _index_lexical(partition: Optional[str], items: List[tuple]) -> None:
+    """Add freshly written (id, text) pairs to loaded or building BM25 indexes"""
+    targets = [partition]
+    if partition is not None and MEMORY_PARTITION_MODE == "filter":
+        # Unscoped queries search the whole shared collection
+        targets.append(None)
+    with _lexical_lock:
+        for target in targets:
+            if target in _lexical_building:
+                _lexical_building[target][0].add_many(items)
+            index = _lexical_indexes.get(target)
+            if index is None:
+                continue
+            index.add_many(items)
+            if len(index) > LEXICAL_INDEX_MAX_DOCS:
+                _lexical_indexes.pop(target)
+                _lexical_oversized.add(target)
+
+
+def _unindex_lexical(ids: List[str]) -> None:
+    """Drop deleted ids from loaded and building BM25 indexes"""
+    with _lexical_lock:
+        indexes = [index for _, index in _lexical_indexes.items()]
+        for index, deleted, _ in _lexical_building.values():
+            indexes.append(index)
+            deleted.update(ids)
+        for index in indexes:
+            for doc_id in ids:
+                index.remove(doc_id)
+
+
+def lexical_query(query: str, top_k: int = 5, user_id: Optional[str] = None):
+    """BM25 keyword search over a user's memories and the shared ones
+
+    Returns Chroma-style nested results with ``scores``,
+    ``normalized_scores`` and ``matched_terms`` in place of distances.
+    """
+    by_id, hits = {}, []
+    for partition in readable_partitions(partition_for(user_id)):
+        index = get_lexical_index(partition)
+        if index is None:
+            continue
+        part_hits = index.search(query, top_k)
+        ids = [hit[0] for hit in part_hits]
+        if not ids:
+            continue
+        found = get_store(partition).get(ids=ids)
+        by_id.update((doc_id, (doc, meta)) for doc_id, doc, meta in
+                     zip(found["ids"], found["documents"], found["metadatas"]))
+        hits.extend(part_hits)
+    # Normalized scores are comparable across indexes, raw BM25 is not
+    hits.sort(key=lambda hit: (hit[2], hit[1]), reverse=True)
+    hits = [hit for hit in hits if hit[0] in by_id][:top_k]
+    return {
+        "ids": [[hit[0] for hit in hits]],
+        "documents": [[by_id[hit[0]][0] for hit in hits]],
+        "metadatas": [[by_id[hit[0]][1] for hit in hits]],
+        "scores": [[hit[1] for hit in hits]],
+        "normalized_scores": [[hit[2] for hit in hits]],
+        "matched_terms": [[hit[3] for hit in hits]]
+    }
+
+
+def is_confident_lexical(results) -> bool:
+    """True if the best lexical hit is strong enough to skip dense search"""
+    scores = results.get("normalized_scores", [[]])[0]
+    matched = results.get("matched_terms", [[]])[0]
+    return bool(scores) and (scores[0] >= LEXICAL_SHORTCUT_SCORE
+                             and matched[0] >= LEXICAL_SHORTCUT_MIN_TERMS)
+
+
+def strong_lexical_hits(results, min_score: float = LEXICAL_FUSION_MIN_SCORE):
+    """Keep only lexical hits whose normalized score reaches min_score"""
+    keep = [i for i, score in enumerate(results.get("normalized_scores", [[]])[0])
+            if score >= min_score]
+    return {
+        key: [[values[0][i] for i in keep]] if values else values
+        for key, values in results.items()
+    }
+
+
+def fuse_results(result_sets: list, top_k: int = 5):
+    """Merge Chroma-style result sets with reciprocal-rank fusion
+
+    Returns nested results whose ``scores`` are the fused RRF scores.
+    """
+    docs = {}
+    rankings = []
+    for results in result_sets:
+        ids = (results.get("ids") or [[]])[0]
+        documents = (results.get("documents") or [[]])[0]
+        metadatas = (results.get("metadatas") or [[]])[0] or [{}] * len(ids)
+        for doc_id, doc, meta in zip(ids, documents, metadatas):
+            docs.setdefault(doc_id, (doc, meta))
+        rankings.append(ids)
+    fused = reciprocal_rank_fusion(rankings, top_k=top_k)
+    return {
+        "ids": [[doc_id for doc_id, _ in fused]],
+        "documents": [[docs[doc_id][0] for doc_id, _ in fused]],
+        "metadatas": [[docs[doc_id][1] for doc_id, _ in fused]],
+        "scores": [[score for _, score in fused]]
+    }
+
+
+def scan_memory(
+    where: Optional[dict] = None,
+    include: Optional[List[str]] = None,
+    page_size: int = SCAN_PAGE_SIZE,
+    user_id: Optional[str] = None
+) -> Iterator[Dict[str, Any]]:
+    """Stream stored memories page by page
+
+    Walks every store (or only the user's partition when user_id is given)
+    with limit/offset pages, so memory use is bounded by page_size. Pages
+    use ``get``'s layout with only the ``include`` fields populated
+    (metadatas by default; pass [] for ids only).
+    """
+    include = ["metadatas"] if include is None else include
+    if user_id is not None:
+        partition = partition_for(user_id)
+        scope = partition_where(partition)
+        if scope:
+            where = {"$and": [where, scope]} if where else scope
+        stores = [get_store(partition)]
+    else:
+        stores = all_stores()
+    for memory_store in stores:
+        yield from memory_store.iterate(page_size, where=where, include=include)
+
+
+def delete_where(
+    where: dict,
+    batch_size: int = SCAN_PAGE_SIZE,
+    user_id: Optional[str] = None
+) -> int:
+    """Delete memories matching a where clause in bounded batches
+
+    Returns the number of deleted items.
+    """
+    if user_id is not None:
+        partition = partition_for(user_id)
+        scope = partition_where(partition)
+        if scope:
+            where = {"$and": [where, scope]}
+        stores = [get_store(partition)]
+    else:
+        stores = all_stores()
+
+    deleted = 0
+    for memory_store in stores:
+        while True:
+            # Deleted rows drop out of the filter, so always read the first page
+            page = memory_store.get(where=where, limit=batch_size, include=[])
+            if not page["ids"]:
+                break
+            delete_ids(page["ids"], memory_store)
+            deleted += len(page["ids"])
+    return deleted
+
+
+def delete_ids(ids: List[str], memory_store: Optional[VectorStore] = None) -> None:
+    """Delete documents by id and drop them from the in-process indexes"""
+    if not ids:
+        return
+    memory_store = memory_store or get_shared_store()
+    try:
+        metadatas = memory_store.get(ids=ids, include=["metadatas"])["metadatas"]
+    except Exception:
+        metadatas = []
+    memory_store.delete(ids=ids)
+    _bump_delete_epoch()
+    for metadata in metadatas:
+        digest = (metadata or {}).get("content_hash")
+        if digest:
+            _hash_index.pop((partition_for(metadata.get("user_id")), digest))
+    _unindex_lexical(ids)
+
+
+def backfill_legacy_metadata(page_size: int = SCAN_PAGE_SIZE) -> int:
+    """Add the fields newer code relies on to memories written without them
+
+    Sets ``content_hash`` (exact-duplicate detection) on every record that
+    lacks one and, in filter mode, ``user_id=SHARED_USER_ID`` on records
+    stored without an owner so queries scoped to a user still see them.
+    Records that already have both are left alone, so running it again is
+    cheap. Returns the number of records updated.
+    """
+    updated = 0
+    for memory_store in all_stores():
+        # Updates keep each record's position, so offset paging stays valid
+        for page in memory_store.iterate(page_size, include=["documents", "metadatas"]):
+            ids, metadatas = [], []
+            for doc_id, document, metadata in zip(
+                    page["ids"], page["documents"], page["metadatas"]):
+                fixed = dict(metadata or {})
+                if not fixed.get("content_hash") and document is not None:
+                    fixed["content_hash"] = content_hash(document)
+                if MEMORY_PARTITION_MODE == "filter" and not fixed.get("user_id"):
+                    fixed["user_id"] = SHARED_USER_ID
+                if fixed != (metadata or {}):
+                    ids.append(doc_id)
+                    metadatas.append(fixed)
+            if ids:
+                memory_store.update(ids, metadatas)
+                updated += len(ids)
+    if updated:
+        print(f"Backfilled content_hash/user_id on {updated} legacy memories")
+        _bump_delete_epoch()
+        with _lexical_lock:
+            # Owners changed, so every partition's index must be rebuilt
+            _lexical_indexes.clear()
+            _lexical_building.clear()
+            _lexical_oversized.clear()
+    return updated
+
+
+def start_legacy_backfill() -> Optional[threading.Thread]:
+    """Run backfill_legacy_metadata in a background thread (see
+    MEMORY_BACKFILL_ON_START) so startup does not wait for the scan"""
+    if not MEMORY_BACKFILL_ON_START:
+        return None
+
+    def run():
+        try:
+            backfill_legacy_metadata()
+        except Exception as e:
+            print(f"Warning: Could not backfill legacy memories: {e}")
+
+    thread = threading.Thread(target=run, name="memory-backfill", daemon=True)
+    thread.start()
+    return thread
+
+
 def clear_test_data():
     """Clear test data from the vector store"""
     try:
-        # Get all items with test metadata
-        all_items = collection.get()
-        if all_items and all_items['metadatas']:
-            test_ids = []
-            for i, metadata in enumerate(all_items['metadatas']):
-                if metadata and metadata.get('test') == True:
-                    test_ids.append(all_items['ids'][i])
-            
-            if test_ids:
-                collection.delete(ids=test_ids)
-                print(f"Cleared {len(test_ids)} test items from memory")
+        deleted = delete_where({"test": True})
+        if deleted:
+            print(f"Cleared {deleted} test items from memory")
     except Exception as e:
         print(f"Warning: Could not clear test data: {e}")
 
@@ -113,8 +1011,23 @@ def clear_test_data():
 def get_collection_stats():
     """Get statistics about the vector store"""
     try:
-        all_items = collection.get()
-        count = len(all_items['ids']) if all_items and all_items['ids'] else 0
-        return {"total_items": count}
+        stores = all_stores()
+        count = sum(memory_store.count() for memory_store in stores)
+        stats = {
+            "total_items": count,
+            "backend": VECTOR_STORE_BACKEND,
+            "partition_mode": MEMORY_PARTITION_MODE,
+            "collections": len(stores),
+            "query_embedding_cache": _query_embedding_cache.stats(),
+            "result_cache": _result_cache.stats(),
+            "lexical_indexes": len(_lexical_indexes),
+            "embedder_load": _embedder_flight.stats()
+        }
+        pool = get_embed_pool()
+        if pool is not None:
+            stats["embed_pool"] = pool.stats()
+        if hasattr(stores[0], "index_stats"):
+            stats["index"] = stores[0].index_stats()
+        return stats
     except Exception as e:
         return {"error": str(e)}
@@ -0,0 +1,181 @@
+"""Write-behind queue that takes memory writes off the request path"""
+import atexit
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from src.infra.vector_store import add_contexts
+
+# Set MEMORY_WRITE_BEHIND=0 to write memories inline instead
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "1") == "1"
+MEMORY_QUEUE_MAX = int(os.getenv("MEMORY_QUEUE_MAX", "10000"))
+MEMORY_FLUSH_SIZE = int(os.getenv("MEMORY_FLUSH_SIZE", "64"))
+MEMORY_FLUSH_INTERVAL = float(os.getenv("MEMORY_FLUSH_INTERVAL", "0.5"))
+MEMORY_PUT_TIMEOUT = float(os.getenv("MEMORY_PUT_TIMEOUT", "1.0"))
+
+_STOP = object()
+
+
+class MemoryWriteQueue:
+    """Bounded queue drained by a background thread in batched writes
+
+    Pending memories are committed through ``writer`` (``add_contexts`` by
+    default) once ``flush_size`` items are waiting or ``flush_interval``
+    seconds have passed since the first one arrived. When the queue is full
+    ``submit`` blocks for up to ``put_timeout`` seconds and then writes the
+    item inline, so producers slow down instead of dropping memories. If a
+    batched write fails, its items are retried one by one so only the ones
+    that fail on their own are dropped.
+    """
+
+    def __init__(
+        self,
+        writer: Callable[[List[str], List[Dict[str, Any]]], Any] = add_contexts,
+        max_pending: int = MEMORY_QUEUE_MAX,
+        flush_size: int = MEMORY_FLUSH_SIZE,
+        flush_interval: float = MEMORY_FLUSH_INTERVAL,
+        put_timeout: float = MEMORY_PUT_TIMEOUT
+    ):
+        self._writer = writer
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._thread = None
+        self._lock = threading.Lock()
+        self.written = 0
+        self.batches = 0
+        self.inline_writes = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="memory-write-behind", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a memory for writing; returns False if it was written inline"""
+        self.start()
+        try:
+            self._queue.put((text, metadata or {}), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self._count(inline_writes=1)
+            self._writer([text], [metadata or {}])
+            return False
+
+    def flush(self) -> None:
+        """Block until everything queued so far has been written"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Flush pending writes and stop the worker thread"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write(batch)
+            for _ in range(len(batch) + stopping):
+                self._queue.task_done()
+            if stopping:
+                return
+
+    def _count(self, **deltas: int) -> None:
+        # Counters are bumped by the worker and by producers writing inline
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _write(self, batch) -> None:
+        try:
+            self._writer([text for text, _ in batch], [meta for _, meta in batch])
+            self._count(written=len(batch), batches=1)
+            return
+        except Exception as e:
+            batch_error = e
+        written, first_error = 0, None
+        if len(batch) > 1:
+            for text, meta in batch:
+                try:
+                    self._writer([text], [meta])
+                    written += 1
+                except Exception as e:
+                    first_error = first_error or e
+        dropped = len(batch) - written
+        self._count(written=written, dropped=dropped,
+                    errors=1 + (dropped if len(batch) > 1 else 0))
+        if dropped:
+            print(f"Memory write-behind error: dropped {dropped} of {len(batch)} items "
+                  f"({first_error or batch_error})")
+        else:
+            print(f"Memory write-behind error, wrote {len(batch)} items one by one: "
+                  f"{batch_error}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "written": self.written,
+                "batches": self.batches,
+                "inline_writes": self.inline_writes,
+                "errors": self.errors,
+                "dropped": self.dropped
+            }
+
+
+_write_queue = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> MemoryWriteQueue:
+    """Return the process-wide write-behind queue"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = MemoryWriteQueue()
+            atexit.register(_write_queue.stop)
+    return _write_queue
+
+
+def save_memory(text: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+    """Persist a memory, through the write-behind queue when enabled"""
+    if MEMORY_WRITE_BEHIND:
+        get_write_queue().submit(text, metadata)
+    else:
+        add_contexts([text], [metadata])
+
+
+def flush_memory_writes() -> None:
+    """Flush and stop the write-behind queue (used on shutdown)"""
+    if _write_queue is not None:
+        _write_queue.stop()
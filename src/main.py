@@ -1,6 +1,8 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, field_validator, model_validator
+from typing import Optional, Dict, Any, List
 import os
 import sys
 from pathlib import Path
@@ -10,8 +12,21 @@ from dotenv import load_dotenv
 sys.path.append(str(Path(__file__).parent.parent))
 
 # Import our agent
-from src.agent.agent import run_agent
-from src.infra.vector_store import add_context, query_context
+from src.agent.agent import run_agent, run_agent_sse
+from src.agent.model_loader import get_generation_stats
+from src.agent.model_pool import model_pool
+from src.infra.vector_store import (
+    SHARED_USER_ID,
+    add_context,
+    add_contexts,
+    check_batch_size,
+    query_context,
+    shared_partition,
+    start_legacy_backfill,
+    warm_lexical_index
+)
+from src.infra.write_queue import flush_memory_writes
+from src.agent.compaction import compaction_worker, run_compaction
 
 # Load environment variables
 load_dotenv()
@@ -24,8 +39,53 @@ app = FastAPI(
     version="0.1.0"
 )
 
+@app.on_event("startup")
+def start_memory_compaction():
+    """Start background memory compaction (if MEMORY_COMPACTION_INTERVAL > 0)"""
+    compaction_worker.start()
+
+@app.on_event("startup")
+def backfill_legacy_memories():
+    """Add user_id/content_hash to memories written by older versions"""
+    start_legacy_backfill()
+
+@app.on_event("startup")
+def warm_keyword_index():
+    """Build the shared memories' BM25 index before the first query needs it"""
+    warm_lexical_index(shared_partition())
+
+@app.on_event("shutdown")
+def shutdown_memory_writes():
+    """Flush queued memory writes before the server exits"""
+    compaction_worker.stop()
+    model_pool.stop()
+    flush_memory_writes()
+
+def _check_user_id(user_id: Optional[str]) -> Optional[str]:
+    if user_id == SHARED_USER_ID:
+        raise ValueError(f"user_id {SHARED_USER_ID!r} is reserved for shared memories")
+    return user_id
+
 # Request/Response models
-class ChatRequest(BaseModel):
+class UserScopedRequest(BaseModel):
+    """Request carrying a user_id, which may not name the shared partition
+
+    The same holds for a user_id given inside metadata.
+    """
+
+    @field_validator("user_id", check_fields=False)
+    @classmethod
+    def user_id_not_reserved(cls, user_id):
+        return _check_user_id(user_id)
+
+    @model_validator(mode="after")
+    def metadata_user_ids_not_reserved(self):
+        metadatas = getattr(self, "metadatas", None) or [getattr(self, "metadata", None)]
+        for metadata in metadatas:
+            _check_user_id((metadata or {}).get("user_id"))
+        return self
+
+class ChatRequest(UserScopedRequest):
     user_id: str
     text: str
 
@@ -33,16 +93,27 @@ class ChatResponse(BaseModel):
     reply: str
     model_used: str
     context_items: int
+    context_tokens: int = 0
     processing_time: float
     memory_saved: list = []
 
-class MemoryRequest(BaseModel):
+class MemoryRequest(UserScopedRequest):
     text: str
     metadata: Optional[Dict[str, Any]] = None
+    user_id: Optional[str] = None
+
+class BatchMemoryRequest(UserScopedRequest):
+    texts: List[str]
+    metadatas: Optional[List[Optional[Dict[str, Any]]]] = None
+    # Owner of every item; without one they are shared with all users
+    user_id: Optional[str] = None
+    batch_size: Optional[int] = None
 
 class HealthResponse(BaseModel):
     status: str
     models_available: Dict[str, bool]
+    local_generation: Dict[str, Any] = {}
+    model_pool: Dict[str, Any] = {}
 
 # API Endpoints
 @app.get("/health", response_model=HealthResponse)
@@ -60,7 +131,9 @@ async def health_check():
             models_available={
                 "local": local_model_available,
                 "remote": hf_token_available
-            }
+            },
+            local_generation=get_generation_stats(),
+            model_pool=model_pool.stats()
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
@@ -72,13 +145,15 @@ async def ask_agent(request: ChatRequest):
         if not request.text.strip():
             raise HTTPException(status_code=400, detail="Text cannot be empty")
         
-        # Run the agent
-        result = run_agent(request.text, request.user_id)
+        # Run the agent in the threadpool so concurrent requests can be
+        # batched by the local generation scheduler
+        result = await run_in_threadpool(run_agent, request.text, request.user_id)
         
         return ChatResponse(
             reply=result["response"],
             model_used=result["model_used"],
             context_items=result["context_items"],
+            context_tokens=result.get("context_tokens", 0),
             processing_time=result["processing_time"],
             memory_saved=result.get("memory_saved", [])
         )
@@ -86,21 +161,85 @@ async def ask_agent(request: ChatRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Agent error: {str(e)}")
 
+@app.post("/ask/stream")
+async def ask_agent_stream(request: ChatRequest):
+    """Stream the agent's reply as Server-Sent Events
+
+    Emits a ``start`` event, one ``token`` event per generated piece and a
+    final ``done`` event carrying the same fields as /ask.
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+
+    # A sync generator is iterated in the threadpool, off the event loop
+    return StreamingResponse(
+        run_agent_sse(request.text, request.user_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/memory/add")
 async def add_memory(request: MemoryRequest):
     """Add information to memory manually"""
     try:
-        add_context(request.text, request.metadata or {})
+        metadata = dict(request.metadata or {})
+        if request.user_id:
+            metadata["user_id"] = request.user_id
+        # Embedding and writing block; keep them off the event loop
+        await run_in_threadpool(add_context, request.text, metadata)
         return {"status": "success", "message": "Memory added"}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Memory error: {str(e)}")
 
+@app.post("/memory/add_batch")
+async def add_memory_batch(request: BatchMemoryRequest):
+    """Add many memories in batched embed/write calls"""
+    if request.metadatas is not None and len(request.metadatas) != len(request.texts):
+        raise HTTPException(status_code=400, detail="metadatas must match texts in length")
+    try:
+        check_batch_size(request.batch_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        metadatas = request.metadatas
+        if request.user_id:
+            metadatas = [{**(m or {}), "user_id": request.user_id}
+                         for m in (metadatas or [None] * len(request.texts))]
+        kwargs = {"batch_size": request.batch_size} if request.batch_size else {}
+        # Embedding and writing block for seconds on large batches; keep
+        # them off the event loop
+        results = await run_in_threadpool(add_contexts, request.texts, metadatas, **kwargs)
+        added = sum(1 for r in results if not r["duplicate"])
+        return {
+            "status": "success",
+            "added": added,
+            "duplicates": len(results) - added,
+            "results": results
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Memory error: {str(e)}")
+
+@app.post("/memory/compact")
+def compact_memory():
+    """Run one memory compaction pass (TTL, quotas, consolidation)"""
+    try:
+        return {"status": "success", "report": run_compaction()}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Compaction error: {str(e)}")
+
 @app.get("/memory/search")
-async def search_memory(query: str, top_k: int = 5):
+async def search_memory(query: str, top_k: int = 5, user_id: Optional[str] = None):
     """Search memory/context"""
     try:
-        results = query_context(query, top_k)
+        _check_user_id(user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        results = await run_in_threadpool(query_context, query, top_k, user_id=user_id)
         return {
             "query": query,
             "results": results
@@ -116,8 +255,11 @@ async def root():
         "message": "Anigma F1 AI Agent API",
         "endpoints": {
             "chat": "/ask",
+            "chat_stream": "/ask/stream",
             "health": "/health", 
             "add_memory": "/memory/add",
+            "add_memory_batch": "/memory/add_batch",
+            "compact_memory": "/memory/compact",
             "search_memory": "/memory/search"
         }
     }
@@ -6,7 +6,7 @@ Simple interface to chat with the FastAPI server
 
 import requests
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Tuple
 
 # Default server URL
 DEFAULT_URL = "http://localhost:8000"
@@ -36,6 +36,30 @@ class AgentClient:
         except requests.exceptions.RequestException as e:
             return {"error": f"Request failed: {str(e)}"}
 
+    def ask_stream(self, text: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Send question to agent and yield (event, data) as tokens arrive"""
+        try:
+            with self.session.post(
+                f"{self.base_url}/ask/stream",
+                json={"user_id": self.user_id, "text": text},
+                stream=True,
+                timeout=(10, 120)
+            ) as response:
+                response.raise_for_status()
+                event = "message"
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        yield event, json.loads(line[len("data:"):].strip())
+
+        except requests.exceptions.ConnectionError:
+            yield "error", {"error": "Cannot connect to agent server. Is it running?"}
+        except requests.exceptions.Timeout:
+            yield "error", {"error": "Request timed out"}
+        except requests.exceptions.RequestException as e:
+            yield "error", {"error": f"Request failed: {str(e)}"}
+
     def health_check(self) -> Dict[str, Any]:
         """Check server health"""
         try:
@@ -69,7 +93,11 @@ def print_response(result: Dict[str, Any]):
         return
 
     print(f"🤖 {result.get('reply', 'No response')}")
+    print_metadata(result)
+
 
+def print_metadata(result: Dict[str, Any]):
+    """Print model, timing and memory details of a reply"""
     # Show metadata
     model = result.get('model_used', 'unknown')
     time_taken = result.get('processing_time', 0)
@@ -84,7 +112,28 @@ def print_response(result: Dict[str, Any]):
         print(f"   └─ Saved to memory: {', '.join(result['memory_saved'])}")
 
 
-def interactive_mode(client: AgentClient):
+def stream_response(client: AgentClient, text: str):
+    """Print the agent's reply token by token as it is generated"""
+    result = {}
+    started = False
+    for event, data in client.ask_stream(text):
+        if event == "token":
+            if not started:
+                print("🤖 ", end="", flush=True)
+                started = True
+            print(data.get("text", ""), end="", flush=True)
+        elif event in ("done", "error"):
+            result = data
+    if started:
+        print()
+
+    if "error" in result:
+        print(f"❌ Error: {result['error']}")
+    elif result:
+        print_metadata(result)
+
+
+def interactive_mode(client: AgentClient, stream: bool = True):
     """Interactive chat mode"""
     print("🚀 Anigma F1 AI Agent - Interactive Mode")
     print("Type 'quit', 'exit', or 'q' to exit")
@@ -126,6 +175,9 @@ def interactive_mode(client: AgentClient):
                 continue
 
             # Send to agent
+            if stream:
+                stream_response(client, user_input)
+                continue
             print("🤔 Thinking...")
             result = client.ask(user_input)
             print_response(result)
@@ -137,8 +189,11 @@ def interactive_mode(client: AgentClient):
             print(f"❌ Unexpected error: {e}")
 
 
-def single_question_mode(client: AgentClient, question: str):
+def single_question_mode(client: AgentClient, question: str, stream: bool = True):
     """Ask single question and exit"""
+    if stream:
+        stream_response(client, question)
+        return
     result = client.ask(question)
     print_response(result)
 
@@ -158,6 +213,9 @@ def main():
                         help="Ask single question and exit")
     parser.add_argument("--health",
                         action="store_true", help="Check health and exit")
+    parser.add_argument("--no-stream",
+                        action="store_true",
+                        help="Wait for the full reply instead of streaming")
 
     args = parser.parse_args()
 
@@ -172,11 +230,11 @@ def main():
 
     # Single question mode
     if args.question:
-        single_question_mode(client, args.question)
+        single_question_mode(client, args.question, stream=not args.no_stream)
         return
 
     # Interactive mode
-    interactive_mode(client)
+    interactive_mode(client, stream=not args.no_stream)
 
 
 if __name__ == "__main__":
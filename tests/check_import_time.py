@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark: measure `import src.main` with `python -X importtime`
+
+Fails (exit code 1) when the cumulative import time exceeds the budget or
+when a heavy module is imported eagerly. The budget is tracked here and
+can be overridden with IMPORT_TIME_BUDGET_MS.
+
+    python tests/check_import_time.py [module]
+"""
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+# Cumulative import time allowed for src.main, in milliseconds
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1000"))
+# Modules that must only be imported on first use
+LAZY_MODULES = ["torch", "transformers", "sentence_transformers", "chromadb",
+                "onnxruntime", "huggingface_hub"]
+RUNS = int(os.getenv("IMPORT_TIME_RUNS", "3"))
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str):
+    """One cold import in a fresh interpreter: (cumulative us, rows, loaded)"""
+    code = (f"import sys, {module}; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    rows, total = [], None
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        rows.append((int(cumulative_us), int(self_us), name))
+        if name == module and len(indent) == 1:
+            total = int(cumulative_us)
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return total, rows, loaded
+
+
+def check_import_time(module: str = "src.main") -> bool:
+    print(f"⏱️  Measuring import time of {module} ({RUNS} runs)...")
+    print("=" * 50)
+    try:
+        runs = [measure(module) for _ in range(RUNS)]
+    except RuntimeError as e:
+        print(f"❌ Could not import {module}: {e}")
+        return False
+    # The fastest run is the least disturbed by the rest of the machine
+    total, rows, loaded = min(runs, key=lambda run: run[0] or 0)
+    total_ms = (total or 0) / 1000
+
+    print("Slowest modules (cumulative ms):")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:15]:
+        print(f"  {cumulative_us / 1000:9.1f}  {name}")
+
+    ok = True
+    print(f"\n{module}: {total_ms:.1f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+    if total_ms > IMPORT_TIME_BUDGET_MS:
+        print("❌ Import time over budget")
+        ok = False
+    if loaded:
+        print(f"❌ Heavy modules imported eagerly: {', '.join(loaded)}")
+        ok = False
+    if ok:
+        print("✅ Import time within budget, heavy modules deferred")
+    return ok
+
+
+if __name__ == "__main__":
+    target = sys.argv[1] if len(sys.argv) > 1 else "src.main"
+    sys.exit(0 if check_import_time(target) else 1)
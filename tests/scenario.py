@@ -0,0 +1,27 @@
+"""
+Run a test scenario in a fresh interpreter against throwaway stores
+
+The store backend, its paths and the embedder are read from the
+environment when src.infra.vector_store is imported, so tests that need
+particular settings re-run their own module as
+``python <test file> <scenario>`` with those settings. Scenarios get a
+temporary NumPy store (Chroma also writes there when selected) and the
+offline hashing embedder unless they override them.
+"""
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def run_scenario(test_file, name, **env):
+    """Run scenario ``name`` of ``test_file`` in a subprocess and assert it passed"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {**os.environ, "VECTOR_STORE_BACKEND": "numpy",
+               "NUMPY_STORE_PATH": tmp, "CHROMA_DB_PATH": tmp,
+               "EMBEDDER_BACKEND": "hashing", "MEMORY_BACKFILL_ON_START": "0",
+               "SCENARIO_TMP_DIR": tmp, **env}
+        result = subprocess.run([sys.executable, test_file, name],
+                                env=env, capture_output=True, text=True)
+        print(result.stdout)
+        assert result.returncode == 0, result.stderr[-2000:]
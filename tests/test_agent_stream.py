@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test the /ask/stream event sequence with a fake local model
+
+Runs in a fresh interpreter against a temporary numpy store with the
+offline hashing embedder; generation is replaced so no model is loaded.
+"""
+import sys
+import os
+import json
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.scenario import run_scenario
+
+
+class FakePool:
+    """Stands in for model_pool without loading a model"""
+    @contextmanager
+    def use(self, model_id=None):
+        yield None, None
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        assert chunk.endswith("\n\n"), chunk
+        name_line, data_line = chunk.strip().split("\n")
+        assert name_line.startswith("event: ") and data_line.startswith("data: ")
+        events.append((name_line[len("event: "):], json.loads(data_line[len("data: "):])))
+    return events
+
+
+def sse_event_order():
+    from src.agent import agent
+
+    saved = []
+    agent.model_pool = FakePool()
+    agent.should_use_remote = lambda text, context_length=0: False
+    agent.stream_local = lambda tokenizer, model, prompt, max_new_tokens=256: \
+        iter(["Box ", "this ", "lap"])
+    agent.save_memory = lambda text, metadata=None: saved.append(text)
+
+    events = parse_events(agent.run_agent_sse("When should I pit?", "alice"))
+    names = [name for name, _ in events]
+    print("Events:", names)
+    assert names == ["start", "token", "token", "token", "done"], names
+    assert events[0][1]["model_used"] == "local"
+    assert "".join(data["text"] for name, data in events if name == "token") == "Box this lap"
+    done = events[-1][1]
+    assert done["reply"] == "Box this lap" and "response" not in done
+    # Memory is saved once, after the last token
+    assert len(saved) == 1 and "Box this lap" in saved[0]
+
+    print("Ending a failed stream with an error event...")
+
+    def broken_stream(user_input, user_id="default_user"):
+        yield {"event": "start", "model_used": "local", "context_items": 0}
+        raise RuntimeError("model crashed")
+
+    agent.run_agent_stream = broken_stream
+    events = parse_events(agent.run_agent_sse("When should I pit?", "alice"))
+    assert [name for name, _ in events] == ["start", "error"], events
+    assert events[-1][1] == {"error": "Agent error: model crashed"}
+
+
+def test_sse_event_order():
+    print("Streaming a reply...")
+    run_scenario(__file__, "sse_event_order")
+    print("✅ Streams emit start, tokens and done, or end with an error event")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        globals()[sys.argv[1]]()
+    else:
+        test_sse_event_order()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Test the bounded LRU cache used for query embeddings
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_lru_cache():
+    from src.infra.cache import LRUCache
+
+    print("Testing LRU eviction by entry count...")
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "a" is now most recently used
+    cache.put("c", 3)
+    assert "b" not in cache, "least recently used entry should be evicted"
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    print("Testing eviction by byte budget...")
+    cache = LRUCache(max_entries=100, max_bytes=10, sizeof=len)
+    cache.put("x", b"12345")
+    cache.put("y", b"123456")
+    assert "x" not in cache and "y" in cache
+    cache.put("z", b"12345678901")  # larger than the whole budget
+    assert "z" not in cache
+
+    stats = cache.stats()
+    print(f"Cache stats: {stats}")
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 6
+
+
+if __name__ == "__main__":
+    test_lru_cache()
+    print("✅ LRU cache tests passed")
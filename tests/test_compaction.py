@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Test memory compaction: explicit memories are never evicted or merged
+
+Runs in a fresh interpreter against a temporary numpy store with the
+offline hashing embedder, since the backend is chosen from the
+environment at import time.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.scenario import run_scenario
+
+
+def user_requests_survive():
+    import time
+    from src.agent import compaction
+    from src.infra import vector_store
+
+    old = time.time() - 90 * 24 * 3600
+    remembered = [
+        ("My locker code is 4471", {"source": "user_request", "user_id": "alice",
+                                     "timestamp": old}),
+        # Even tagged as a qa_pair, an explicit memory is never compacted
+        ("My car is a blue hatchback", {"source": "user_request", "user_id": "alice",
+                                         "timestamp": old, "type": "qa_pair"}),
+    ]
+    for text, metadata in remembered:
+        vector_store.add_context(text, metadata)
+    for i in range(6):
+        vector_store.add_context(
+            f"User asked: question {i}\nAssistant replied: answer {i}",
+            {"source": "conversation", "user_id": "alice", "type": "qa_pair",
+             "timestamp": old + i}
+        )
+
+    def remaining():
+        page = vector_store.get_store(vector_store.partition_for("alice")).get(
+            where={"user_id": "alice"}, include=["documents", "metadatas"]
+        )
+        return dict(zip(page["documents"], page["metadatas"]))
+
+    print("Consolidating old conversations...")
+    assert compaction.consolidate_user("alice", older_than=3600, group_size=3,
+                                       summarize=lambda texts: "summary of " + texts[0]) == 2
+    print("Enforcing a quota that counts summaries...")
+    for i in range(2):
+        vector_store.add_context(f"User asked: recent {i}\nAssistant replied: ok",
+                                 {"source": "conversation", "user_id": "alice",
+                                  "type": "qa_pair", "timestamp": time.time() + i})
+    # Two summaries and two recent conversations: the oldest summary goes
+    assert compaction.enforce_user_quota("alice", max_items=3) == 1
+    vector_store.add_context("User asked: stale\nAssistant replied: stale",
+                             {"source": "conversation", "user_id": "alice",
+                              "type": "qa_pair", "timestamp": old})
+    print("Evicting expired conversations and summaries...")
+    assert compaction.evict_expired(max_age=3600) == 2
+    assert compaction.run_compaction(summarize=lambda texts: "unused")["summaries"] == 0
+
+    memories = remaining()
+    for text, _ in remembered:
+        assert text in memories, memories
+    assert sorted(text for text in memories if text.startswith("User asked:")) \
+        == [f"User asked: recent {i}\nAssistant replied: ok" for i in range(2)], memories
+    assert not any(m["source"] == "consolidation" for m in memories.values()), memories
+
+
+def test_user_requests_survive_compaction():
+    for mode in ("filter", "collection"):
+        print(f"Compacting in {mode} mode...")
+        run_scenario(__file__, "user_requests_survive", MEMORY_PARTITION_MODE=mode)
+    print("✅ Summaries expire and count against quotas; user_request memories survive")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        globals()[sys.argv[1]]()
+    else:
+        test_user_requests_survive_compaction()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Test token-budgeted context packing
+"""
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+class CharTokenizer:
+    """One token per character, so budgets are easy to reason about"""
+    def encode(self, text, add_special_tokens=False):
+        return [ord(c) for c in text]
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(chr(i) for i in ids)
+
+
+def test_pack_context():
+    from src.agent.context_packer import count_tokens, pack_context
+
+    tokenizer = CharTokenizer()
+    items = [
+        {"text": "[conversation]: user likes tea", "score": 0.2},
+        {"text": "[user_request]: project code name is Bluebird", "score": 0.9},
+        {"text": "[user_request]: the project code name is Bluebird", "score": 0.5},
+        {"text": "[conversation]: " + "long filler text " * 20, "score": 0.4},
+    ]
+
+    print("Packing by score with near-duplicate removal...")
+    packed = pack_context(items, budget=100, tokenizer=tokenizer)
+    assert packed["text"].split("\n") == [items[1]["text"], items[0]["text"]]
+    assert packed["duplicates"] == 1 and packed["skipped"] == 1
+    assert packed["tokens"] == count_tokens(packed["text"], tokenizer)
+    assert packed["tokens"] <= 100
+
+    print("Truncating the best item when nothing fits...")
+    packed = pack_context(items, budget=20, tokenizer=tokenizer)
+    assert packed["items"] == 1 and packed["tokens"] == 20
+    assert items[1]["text"].startswith(packed["text"])
+
+    print("Estimating tokens without a tokenizer...")
+    packed = pack_context(items, budget=1000)
+    assert packed["items"] == 3 and packed["tokens"] > 0
+    assert pack_context([], budget=100)["text"] == ""
+    print("✅ Context packing respects the budget")
+
+
+class NonReentrantTokenizer(CharTokenizer):
+    """Fails like a fast tokenizer when two threads are inside it at once"""
+    def __init__(self):
+        self.busy = False
+
+    def encode(self, text, add_special_tokens=False):
+        if self.busy:
+            raise RuntimeError("Already borrowed")
+        self.busy = True
+        try:
+            time.sleep(0.001)
+            return super().encode(text, add_special_tokens)
+        finally:
+            self.busy = False
+
+
+def test_shared_tokenizer():
+    from src.agent.context_packer import count_tokens
+    from src.agent.model_loader import tokenizer_lock
+
+    tokenizer = NonReentrantTokenizer()
+    assert tokenizer_lock(tokenizer) is tokenizer_lock(tokenizer)
+    assert tokenizer_lock(tokenizer) is not tokenizer_lock(CharTokenizer())
+
+    print("Counting tokens from 8 threads with one tokenizer...")
+    counts = []
+
+    def count():
+        for _ in range(20):
+            # count_tokens falls back to an estimate if the tokenizer raises
+            counts.append(count_tokens("exactly 20 charactrs", tokenizer))
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert counts == [20] * 160, set(counts)
+    print("✅ Tokenizer calls are serialized across threads")
+
+
+def test_remote_tokenizer_load():
+    import types
+    from src.agent import context_packer
+
+    calls = []
+    outcomes = [ValueError("hub unreachable"), CharTokenizer()]
+
+    def from_pretrained(model_id, cache_dir=None):
+        calls.append(model_id)
+        time.sleep(0.2)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    fake = types.ModuleType("transformers")
+    fake.AutoTokenizer = types.SimpleNamespace(from_pretrained=from_pretrained)
+    saved = sys.modules.get("transformers")
+    sys.modules["transformers"] = fake
+    try:
+        print("Sharing one load between concurrent first calls...")
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            context_packer.get_remote_tokenizer("test/model"))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert calls == ["test/model"] and results == [None] * 4
+
+        print("Estimating tokens until the retry delay passes, then retrying...")
+        assert context_packer.get_remote_tokenizer("test/model") is None
+        assert len(calls) == 1
+        context_packer._remote_tokenizer_failures["test/model"] -= \
+            context_packer.REMOTE_TOKENIZER_RETRY_SECONDS
+        tokenizer = context_packer.get_remote_tokenizer("test/model")
+        assert isinstance(tokenizer, CharTokenizer) and len(calls) == 2
+        assert context_packer.get_remote_tokenizer("test/model") is tokenizer
+        assert len(calls) == 2
+    finally:
+        if saved is None:
+            sys.modules.pop("transformers", None)
+        else:
+            sys.modules["transformers"] = saved
+        context_packer._remote_tokenizers.pop("test/model", None)
+        context_packer._remote_tokenizer_failures.pop("test/model", None)
+    print("✅ Remote tokenizer loads once, shares in-flight loads and retries failures")
+
+
+if __name__ == "__main__":
+    test_pack_context()
+    test_shared_tokenizer()
+    test_remote_tokenizer_load()
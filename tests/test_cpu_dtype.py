@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Test the CPU inference precision choice for the local model
+"""
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_cpu_dtype_mode():
+    from src.agent.model_loader import cpu_dtype_mode, cpu_supports_bf16
+
+    print("Reading bf16 support from cpuinfo...")
+    with tempfile.TemporaryDirectory() as tmp:
+        cpuinfo = os.path.join(tmp, "cpuinfo")
+        with open(cpuinfo, "w") as f:
+            f.write("flags\t\t: fpu sse2 avx2 avx512f avx512bw avx512_vnni\n")
+        assert not cpu_supports_bf16(cpuinfo)
+        with open(cpuinfo, "a") as f:
+            f.write("flags\t\t: fpu avx512f amx_bf16 amx_int8\n")
+        assert cpu_supports_bf16(cpuinfo)
+        assert not cpu_supports_bf16(os.path.join(tmp, "missing"))
+
+    print("Falling back to int8 without bf16...")
+    assert cpu_dtype_mode("auto", bf16_supported=False) == "int8"
+    assert cpu_dtype_mode("auto", bf16_supported=True) == "bf16"
+    assert cpu_dtype_mode("auto") in ("bf16", "int8")
+
+    print("Honouring a forced mode...")
+    for mode in ("bf16", "int8", "fp32"):
+        assert cpu_dtype_mode(mode, bf16_supported=False) == mode
+    try:
+        cpu_dtype_mode("fp16")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an unknown LOCAL_CPU_DTYPE was accepted")
+    print("✅ CPU mode uses bf16 only where supported and int8 elsewhere")
+
+
+if __name__ == "__main__":
+    test_cpu_dtype_mode()
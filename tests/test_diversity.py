@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test maximal-marginal-relevance selection
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+
+def test_mmr():
+    from src.infra.diversity import maximal_marginal_relevance
+
+    query = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    candidates = np.array([
+        [0.9, 0.1, 0.0],    # most relevant
+        [0.9, 0.1, 0.001],  # near copy of the first
+        [0.7, 0.0, 0.7],    # relevant, different direction
+        [0.0, 1.0, 0.0],    # unrelated
+    ], dtype=np.float32)
+
+    print("Selecting diverse candidates...")
+    picks = maximal_marginal_relevance(query, candidates, k=3, lambda_mult=0.7)
+    assert picks[0] == 0
+    assert 1 not in picks, "near copies must be skipped"
+    assert picks[1] == 2
+    assert picks == [0, 2, 3]
+
+    print("Pure relevance keeps score order...")
+    picks = maximal_marginal_relevance(query, candidates, k=2, lambda_mult=1.0,
+                                       max_redundancy=1.1)
+    assert picks == [0, 1]
+
+    assert maximal_marginal_relevance(query, candidates[:0], k=3) == []
+    print("✅ MMR balances relevance and diversity")
+
+
+if __name__ == "__main__":
+    test_mmr()
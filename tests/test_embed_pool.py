@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Test the multi-process embedding pool
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+
+def test_embed_pool():
+    from src.infra.embed_pool import EmbeddingPool
+    from src.infra.embedders import HashingEmbedder
+
+    texts = [f"memory {i}: the user likes topic {i % 17}" for i in range(1000)]
+    expected = HashingEmbedder().encode(texts)
+
+    print("Encoding across 3 worker processes...")
+    pool = EmbeddingPool(workers=3, min_slice=50, env={"EMBEDDER_BACKEND": "hashing"})
+    try:
+        assert pool.dim == expected.shape[1]
+        embeddings = pool.encode(texts)
+        assert embeddings.dtype == np.float32
+        # Rows come back in input order
+        assert np.array_equal(embeddings, expected)
+        assert pool.encode([]).shape == (0, pool.dim)
+        assert np.array_equal(pool.encode(texts[:7]), expected[:7])
+        assert pool.stats()["texts"] == 1007
+    finally:
+        pool.shutdown()
+    print("✅ Pool output matches in-process embedding")
+
+
+if __name__ == "__main__":
+    test_embed_pool()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test the ONNX embedder parity check against an fp32 reference
+
+The hashing embedder stands in for the fp32 model, and a copy with noise
+added stands in for an int8 export that drifted from it.
+"""
+import sys
+import os
+import types
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from tests.scenario import run_scenario
+
+
+class DriftingEmbedder:
+    """Reference embeddings plus Gaussian noise of the given scale"""
+    def __init__(self, reference, noise):
+        self.reference = reference
+        self.noise = noise
+
+    def encode(self, texts, **kwargs):
+        vectors = np.asarray(self.reference.encode(texts), dtype=np.float32)
+        rng = np.random.default_rng(0)
+        return vectors + self.noise * rng.standard_normal(vectors.shape).astype(np.float32)
+
+
+def test_parity_report():
+    from src.infra.embedders import HashingEmbedder, check_embedder_parity
+
+    reference = HashingEmbedder()
+    print("Accepting a faithful model...")
+    report = check_embedder_parity(DriftingEmbedder(reference, 0.001), reference)
+    assert report["passed"] and report["min_cosine"] > 0.99, report
+
+    print("Rejecting a model that drifted from fp32...")
+    report = check_embedder_parity(DriftingEmbedder(reference, 0.05), reference)
+    assert not report["passed"] and report["min_cosine"] < 0.99, report
+    assert report["texts"] > 1 and report["mean_cosine"] >= report["min_cosine"]
+    print(f"✅ Drifting model rejected: {report}")
+
+
+def drifting_onnx_rejected():
+    from src.infra import vector_store
+    from src.infra.embedders import HashingEmbedder
+
+    reference = HashingEmbedder()
+    drifting = DriftingEmbedder(reference, 0.05)
+    vector_store.load_onnx_embedder = lambda *args, **kwargs: drifting
+    fake = types.ModuleType("sentence_transformers")
+    fake.SentenceTransformer = lambda model_id: reference
+    sys.modules["sentence_transformers"] = fake
+
+    embedder = vector_store.get_embedder()
+    assert embedder is reference, embedder
+    assert vector_store.embedder_model_id() == vector_store.EMBEDDER_MODEL_ID
+
+
+def test_drifting_onnx_rejected():
+    print("Loading a drifting ONNX embedder with the parity check on...")
+    run_scenario(__file__, "drifting_onnx_rejected",
+                 EMBEDDER_BACKEND="onnx", EMBEDDER_PARITY_CHECK="1")
+    print("✅ An ONNX embedder that fails the parity check is not used")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        globals()[sys.argv[1]]()
+    else:
+        test_parity_report()
+        test_drifting_onnx_rejected()
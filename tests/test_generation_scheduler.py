@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test dynamic batching of local generation requests
+"""
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_generation_scheduler():
+    from src.agent.model_loader import GenerationScheduler
+
+    batch_sizes = []
+
+    def fake_generate(tokenizer, model, prompts, max_new_tokens):
+        batch_sizes.append(len(prompts))
+        time.sleep(0.05)  # one "forward pass" for the whole batch
+        return [f"{p} -> {n}" for p, n in zip(prompts, max_new_tokens)]
+
+    scheduler = GenerationScheduler(None, None, max_batch_size=4, max_wait_ms=50,
+                                    generate_fn=fake_generate)
+    try:
+        print("Submitting 10 concurrent requests...")
+        results = {}
+
+        def call(i):
+            results[i] = scheduler.generate(f"prompt {i}", max_new_tokens=i)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Every caller gets its own continuation back
+        assert results == {i: f"prompt {i} -> {i}" for i in range(10)}
+        assert max(batch_sizes) == 4 and sum(batch_sizes) == 10
+        assert len(batch_sizes) <= 4, batch_sizes
+        stats = scheduler.stats()
+        assert stats["requests"] == 10 and stats["queue_depth"] == 0
+        assert stats["max_queue_depth"] >= 1
+        print(f"   batches={batch_sizes} stats={stats}")
+
+        print("Errors reach every waiting caller...")
+        failing = GenerationScheduler(None, None, generate_fn=lambda *a: 1 / 0)
+        try:
+            failing.generate("boom")
+            assert False, "expected ZeroDivisionError"
+        except ZeroDivisionError:
+            pass
+        failing.stop()
+    finally:
+        scheduler.stop()
+    print("✅ Concurrent requests were batched")
+
+
+class FakeModel:
+    pass
+
+
+def test_scheduler_stop():
+    from src.agent.model_loader import (
+        GenerationScheduler, get_scheduler, release_scheduler
+    )
+
+    def slow_generate(tokenizer, model, prompts, max_new_tokens):
+        time.sleep(0.1)
+        return [p.upper() for p in prompts]
+
+    print("Stopping a scheduler with requests queued...")
+    scheduler = GenerationScheduler(None, None, max_batch_size=1, max_wait_ms=0,
+                                    generate_fn=slow_generate)
+    queued = [scheduler.submit(f"p{i}") for i in range(3)]
+    scheduler.stop()
+    # Requests accepted before stop are still served
+    assert [f.result(timeout=1) for f in queued] == ["P0", "P1", "P2"]
+    # Later requests fail at once instead of hanging
+    late = scheduler.submit("late")
+    try:
+        late.result(timeout=1)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+    print("Not restarting schedulers of unloaded models...")
+    model = FakeModel()
+    first = get_scheduler(None, model)
+    assert get_scheduler(None, model) is first
+    release_scheduler(model)
+    assert get_scheduler(None, model) is None
+    print("✅ Stopped schedulers fail late requests and are never recreated")
+
+
+def test_background_bypasses_scheduler():
+    from src.agent import model_loader
+
+    calls = []
+
+    def fake_generate(tokenizer, model, prompts, max_new_tokens):
+        calls.append((threading.current_thread().name, prompts))
+        return ["a background summary"]
+
+    print("Generating in the background with a scheduler running...")
+    model = FakeModel()
+    scheduler = model_loader.get_scheduler(None, model)
+    original = model_loader.generate_batch
+    model_loader.generate_batch = fake_generate
+    try:
+        text = model_loader.generate_local(None, model, "Summarize", background=True)
+    finally:
+        model_loader.generate_batch = original
+        model_loader.release_scheduler(model)
+    assert text == "a background summary"
+    # Decoded on the caller's thread; nothing was queued for live requests
+    assert calls == [(threading.current_thread().name, ["Summarize"])]
+    assert scheduler.stats()["requests"] == 0
+    print("✅ Background generation never enters the request scheduler")
+
+
+if __name__ == "__main__":
+    test_generation_scheduler()
+    test_scheduler_stop()
+    test_background_bypasses_scheduler()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Test the offline feature-hashing embedder
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+
+def test_hashing_embedder():
+    from src.infra.embedders import HashingEmbedder
+
+    embedder = HashingEmbedder()
+    memories = [
+        "My project code name is Bluebird",
+        "I love quantum computing",
+        "I work on AI projects in Python",
+        "The weather is nice today",
+    ]
+
+    print("Checking shape, dtype and normalization...")
+    vectors = embedder.encode(memories)
+    assert vectors.shape == (4, 384) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    assert np.allclose(embedder.encode([""]), 0.0)
+
+    print("Checking determinism and batch independence...")
+    assert np.array_equal(vectors[1:2], embedder.encode([memories[1]]))
+
+    print("Checking lexically similar texts rank closest...")
+    queries = ["what is my project code name?", "quantum computers", "python AI work"]
+    scores = embedder.encode(queries) @ vectors.T
+    assert list(scores.argmax(axis=1)) == [0, 1, 2]
+    print(f"✅ Best matches: {[memories[i] for i in scores.argmax(axis=1)]}")
+
+
+if __name__ == "__main__":
+    test_hashing_embedder()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test the per-user prefix KV-cache bookkeeping
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+class FakeTensor:
+    """Stands in for a torch tensor: only its size matters here"""
+    def __init__(self, n):
+        self.data = [0.0] * n
+
+    def element_size(self):
+        return 2
+
+    def nelement(self):
+        return len(self.data)
+
+
+class FakeCache:
+    """Cache object holding per-layer key/value tensors, one value per position"""
+    def __init__(self, layers, n):
+        self.key_cache = [FakeTensor(n) for _ in range(layers)]
+        self.value_cache = [FakeTensor(n) for _ in range(layers)]
+
+    def crop(self, length):
+        for tensor in self.key_cache + self.value_cache:
+            tensor.data = tensor.data[:length]
+
+
+def test_prefix_kv_cache():
+    from src.agent.model_loader import PrefixKVCache, _kv_nbytes
+
+    print("Sizing past_key_values...")
+    legacy = tuple((FakeTensor(10), FakeTensor(10)) for _ in range(3))
+    assert _kv_nbytes(legacy) == 3 * 2 * 10 * 2
+    assert _kv_nbytes(FakeCache(4, 100)) == 4 * 2 * 100 * 2
+
+    cache = PrefixKVCache(max_bytes=2000, max_entries=10, min_match=3)
+    model = object()
+    prefix = list(range(100))
+
+    print("Caching per user and prefix...")
+    cache.put(model, "alice", prefix, FakeCache(2, 100))  # 800 bytes
+    assert cache.match(model, "bob", prefix) == (None, 0)
+    hit, length = cache.match(model, "alice", prefix)
+    assert isinstance(hit, FakeCache) and length == 100
+    hit.key_cache.append(FakeTensor(1))  # callers get a private copy
+    assert len(cache.match(model, "alice", prefix)[0].key_cache) == 2
+
+    print("Reusing the longest shared prefix...")
+    # Same framing and first context tokens, different ending
+    past, length = cache.match(model, "alice", prefix[:60] + [-1] * 50)
+    assert length == 60 and past.key_cache[0].nelement() == 60
+    assert cache.match(model, "alice", prefix + [100, 101])[1] == 100
+    # Too little in common to be worth copying
+    assert cache.match(model, "alice", prefix[:2] + [-1] * 98) == (None, 0)
+    # The stored entry still covers the whole prefix
+    assert cache.match(model, "alice", prefix)[0].key_cache[0].nelement() == 100
+    stats = cache.stats()
+    assert (stats["hits"], stats["partial_hits"], stats["misses"]) == (3, 2, 2), stats
+    assert stats["reused_tokens"] == 3 * 100 + 60 + 100
+
+    print("Evicting under the byte budget...")
+    cache.put(model, "bob", prefix, FakeCache(2, 100))
+    cache.put(model, "carol", prefix, FakeCache(2, 100))
+    assert cache.match(model, "alice", prefix) == (None, 0)
+    assert cache.stats()["bytes"] <= 2000
+
+    cache.discard_model(model)
+    assert cache.stats()["entries"] == 0
+    print("✅ Prefix KV-cache matches the longest cached prefix under a byte budget")
+
+
+if __name__ == "__main__":
+    test_prefix_kv_cache()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test the incremental BM25 index and reciprocal-rank fusion
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_bm25_index():
+    from src.infra.lexical_index import BM25Index
+
+    index = BM25Index()
+    index.add("code", "My project code name is Bluebird")
+    index.add("quantum", "I love quantum computing")
+    index.add("qa", "User asked: hello there\nAssistant replied: hi")
+    index.add("france", "User asked: what is the capital of France?\n"
+                        "Assistant replied: The capital of France is Paris.")
+
+    print("Checking exact-term lookup...")
+    hits = index.search("what is my project code name?", top_k=3)
+    assert hits[0][0] == "code"
+    # Stopwords (what, is, my) are not counted as matches
+    assert hits[0][2] > 0.8 and hits[0][3] == 3
+    assert index.search("bluebird")[0][0] == "code"
+
+    print("Checking that unseen and stop words lower confidence...")
+    hits = index.search("what is the capital of Germany")
+    assert hits[0][0] == "france"
+    assert hits[0][2] < 0.5 and hits[0][3] == 1
+    assert index.search("what is the capital of France")[0][2] > 0.8
+    assert index.search("what is the")[0][3] == 0
+
+    print("Checking incremental remove...")
+    index.remove("code")
+    assert "code" not in index and len(index) == 3
+    assert index.search("bluebird") == []
+
+
+def test_reciprocal_rank_fusion():
+    from src.infra.lexical_index import reciprocal_rank_fusion
+
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], top_k=2)
+    print(f"Fused ranking: {fused}")
+    assert [doc_id for doc_id, _ in fused] == ["a", "c"]
+
+
+def test_strong_lexical_hits():
+    from src.infra.vector_store import strong_lexical_hits
+
+    results = {
+        "ids": [["a", "b", "c"]],
+        "documents": [["doc a", "doc b", "doc c"]],
+        "metadatas": [[{}, {"n": 1}, {}]],
+        "scores": [[3.0, 1.0, 0.5]],
+        "normalized_scores": [[0.9, 0.2, 0.35]],
+        "matched_terms": [[3, 1, 1]]
+    }
+    strong = strong_lexical_hits(results, min_score=0.3)
+    print(f"Hits kept for fusion: {strong['ids']}")
+    assert strong["ids"] == [["a", "c"]]
+    assert strong["documents"] == [["doc a", "doc c"]]
+    assert strong["normalized_scores"] == [[0.9, 0.35]]
+    assert strong_lexical_hits(results, min_score=0.95)["ids"] == [[]]
+
+
+if __name__ == "__main__":
+    test_bm25_index()
+    test_reciprocal_rank_fusion()
+    test_strong_lexical_hits()
+    print("✅ Lexical index tests passed")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Test the memory-budgeted local model pool with a fake loader
+"""
+import sys
+import os
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+class FakeModel:
+    def __init__(self, model_id, nbytes):
+        self.model_id = model_id
+        self.nbytes = nbytes
+
+
+def test_model_pool():
+    from src.agent.model_pool import ModelPool
+
+    sizes = {"small": 300, "medium": 500, "large": 900}
+    loaded = []
+
+    def loader(model_id):
+        loaded.append(model_id)
+        return f"tok-{model_id}", FakeModel(model_id, sizes[model_id])
+
+    pool = ModelPool(loader=loader, max_bytes=1000, idle_timeout=0,
+                     sizeof=lambda model: model.nbytes)
+
+    print("Loading on demand...")
+    tokenizer, model = pool.get("small")
+    assert tokenizer == "tok-small" and model.model_id == "small"
+    assert pool.get("small")[1] is model
+    pool.get("medium")
+    assert loaded == ["small", "medium"]
+    assert pool.total_bytes() == 800
+
+    print("Evicting least recently used under the budget...")
+    pool.get("small")  # medium is now least recently used
+    pool.get("large")
+    stats = pool.stats()
+    assert list(stats["models"]) == ["large"], stats["models"]
+    assert stats["total_bytes"] == 900 and stats["evictions"] == 2
+
+    # Known size: room is made before reloading
+    pool.get("medium")
+    assert list(pool.stats()["models"]) == ["medium"]
+
+    print("Never unloading a model that is in use...")
+    with pool.use("medium") as (_, busy):
+        pool.get("small")  # over budget, but medium is busy
+        assert set(pool.stats()["models"]) == {"medium", "small"}
+        assert pool.stats()["models"]["medium"]["active"] == 1
+        pool.idle_timeout = 0.05
+        time.sleep(0.1)
+        assert pool.evict_idle() == ["small"]
+    assert busy.model_id == "medium"
+
+    print("Unloading idle models...")
+    time.sleep(0.1)
+    assert pool.evict_idle() == ["medium"]
+    assert pool.stats()["models"] == {} and pool.stats()["idle_unloads"] == 2
+    pool.stop()
+    print("✅ Model pool loads on demand, evicts LRU over budget and unloads idle models")
+
+
+if __name__ == "__main__":
+    test_model_pool()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Test the memory-mapped NumPy vector store backend
+"""
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+
+def test_numpy_store():
+    from src.infra.stores import NumpyStore, VectorStore
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2500, 16)).astype(np.float32)
+    ids = [f"doc-{i}" for i in range(len(vectors))]
+    metadatas = [{"user_id": f"u{i % 3}", "test": i % 2 == 0} for i in range(len(vectors))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "agent_memory")
+        store = NumpyStore(path)
+        assert isinstance(store, VectorStore)
+
+        print("Adding vectors in batches (forces the matrix to grow)...")
+        for start in range(0, len(vectors), 700):
+            stop = start + 700
+            store.add_batch(ids[start:stop], ids[start:stop],
+                            vectors[start:stop], metadatas[start:stop])
+        assert store.count() == len(vectors)
+
+        print("Checking top-k against a brute-force reference...")
+        query = vectors[42] + 0.01
+        expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:5]
+        results = store.query(query, top_k=5)
+        assert results["ids"][0] == [ids[i] for i in expected]
+        assert results["distances"][0] == sorted(results["distances"][0])
+
+        print("Checking where-filtered queries...")
+        results = store.query(query, top_k=5, where={"user_id": "u1"})
+        assert all(m["user_id"] == "u1" for m in results["metadatas"][0])
+
+        results = store.query(query, top_k=5, where={"$and": [
+            {"user_id": {"$in": ["u1", "u2"]}}, {"test": True}
+        ]})
+        assert all(m["user_id"] in ("u1", "u2") and m["test"]
+                   for m in results["metadatas"][0])
+        assert len(store.get(where={"user_id": "u0"}, include=[])["ids"]) == 834
+
+        print("Reopening from disk and deleting...")
+        reopened = NumpyStore(path)
+        assert reopened.count() == len(vectors)
+        # Norms are read from disk, not recomputed from the matrix
+        assert np.allclose(reopened._norms[:len(vectors)], (vectors ** 2).sum(axis=1))
+        reopened.delete(where={"test": True})
+        assert reopened.count() == len(vectors) // 2
+        assert store.count() == len(vectors) // 2  # other handle refreshes
+        page = reopened.get(limit=10, offset=5, include=["embeddings"])
+        assert page["ids"] == ids[11:31:2]
+        assert np.allclose(page["embeddings"], vectors[11:31:2])
+        # A large delete compacted the files; both handles agree
+        assert reopened.index_stats()["deleted_rows"] == 0
+        assert store.query(query, top_k=5)["ids"][0] == reopened.query(query, top_k=5)["ids"][0]
+        print(f"✅ NumPy store holds {reopened.count()} items after delete")
+
+
+def test_numpy_store_tombstones():
+    from src.infra.stores import NumpyStore
+
+    rng = np.random.default_rng(2)
+    vectors = rng.standard_normal((100, 8)).astype(np.float32)
+    ids = [f"doc-{i}" for i in range(len(vectors))]
+    metadatas = [{"user_id": f"u{i % 2}"} for i in range(len(vectors))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "agent_memory")
+        store = NumpyStore(path, compact_ratio=0.25)
+        store.add_batch(ids, ids, vectors, metadatas)
+        records = os.path.join(path, "records.jsonl")
+        embeddings = os.path.join(path, "embeddings.npy")
+
+        print("Deleting one by one appends tombstones...")
+        size = os.path.getsize(embeddings)
+        inode = os.stat(embeddings).st_ino
+        for doc_id in ids[:20]:
+            store.delete(ids=[doc_id])
+        assert os.stat(embeddings).st_ino == inode and os.path.getsize(embeddings) == size
+        assert store.count() == 80 and store.index_stats()["deleted_rows"] == 20
+        assert store.get(ids=ids[:25], include=[])["ids"] == ids[20:25]
+        results = store.query(vectors[0], top_k=100, where={"user_id": "u0"})
+        assert len(results["ids"][0]) == 40 and ids[0] not in results["ids"][0]
+
+        reopened = NumpyStore(path)
+        assert reopened.count() == 80
+        assert reopened.get(where={"user_id": "u1"}, include=[])["ids"] == ids[21::2]
+
+        print("Compacting past the dead-row ratio...")
+        store.delete(ids=ids[20:30])
+        assert store.index_stats()["deleted_rows"] == 0
+        assert os.stat(embeddings).st_ino != inode
+        with open(records) as f:
+            assert sum(1 for _ in f) == 70
+        assert reopened.count() == 70
+        assert reopened.query(vectors[50], top_k=1)["ids"][0] == [ids[50]]
+    print("✅ Deletes are tombstoned and compacted in bulk")
+
+
+def test_quantized_index():
+    from src.infra.stores import NumpyStore
+
+    # 500 clusters of 10 nearby vectors, so each query has 10 true neighbours
+    rng = np.random.default_rng(1)
+    centers = rng.standard_normal((500, 128)).astype(np.float32)
+    vectors = np.repeat(centers, 10, axis=0)
+    vectors += 0.3 * rng.standard_normal(vectors.shape).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    ids = [f"doc-{i}" for i in range(len(vectors))]
+    metas = [{"i": i} for i in range(len(vectors))]
+    queries = centers[:20] / np.linalg.norm(centers[:20], axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = NumpyStore(os.path.join(tmp, "exact"))
+        exact.add_batch(ids, ids, vectors, metas)
+        for mode in ("int8", "binary"):
+            print(f"Checking {mode} candidate search with exact rerank...")
+            store = NumpyStore(os.path.join(tmp, mode), index_mode=mode,
+                               rerank_candidates=500)
+            store.add_batch(ids, ids, vectors, metas)
+            hits = 0
+            for query in queries:
+                want = exact.query(query, top_k=10)["ids"][0]
+                got = store.query(query, top_k=10)
+                hits += len(set(want) & set(got["ids"][0]))
+                assert got["distances"][0] == sorted(got["distances"][0])
+            recall = hits / (10 * len(queries))
+            stats = store.index_stats()
+            print(f"   recall@10={recall:.3f} index_bytes={stats['index_bytes']}")
+            assert recall >= 0.9
+            assert stats["index_bytes"] < vectors.nbytes / 3
+
+            # Rebuilt in the background; queries are exact until it is ready
+            reopened = NumpyStore(os.path.join(tmp, mode), index_mode=mode)
+            assert reopened.query(queries[0], top_k=10)["ids"][0] \
+                == exact.query(queries[0], top_k=10)["ids"][0]
+            assert reopened.wait_for_index(timeout=30)
+            assert reopened.index_stats()["index_bytes"] == stats["index_bytes"]
+
+            reopened.delete(ids=ids[:2000])
+            assert reopened.index_stats()["index_bytes"] < stats["index_bytes"]
+            got = reopened.query(vectors[3000], top_k=1)["ids"][0]
+            assert got == [ids[3000]]
+
+
+if __name__ == "__main__":
+    test_numpy_store()
+    test_numpy_store_tombstones()
+    test_quantized_index()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test single-flight loading: one load shared by concurrent callers
+"""
+import sys
+import os
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def run_concurrently(fn, n=8):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(fn())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+
+def test_single_flight():
+    from src.infra.single_flight import SingleFlight
+
+    flight = SingleFlight()
+    started = []
+
+    def slow_load():
+        started.append(1)
+        time.sleep(0.2)
+        return object()
+
+    print("Sharing one load between 8 concurrent callers...")
+    results, errors = run_concurrently(lambda: flight.do("model", slow_load))
+    assert not errors and len(started) == 1
+    assert all(result is results[0] for result in results)
+    stats = flight.stats()
+    assert stats["loads"] == 1 and stats["shared_waits"] == 7
+    assert stats["load_seconds"]["model"] >= 0.2 and stats["in_flight"] == []
+
+    print("Propagating a failed load to every waiter...")
+
+    def failing_load():
+        time.sleep(0.1)
+        raise RuntimeError("out of memory")
+
+    results, errors = run_concurrently(lambda: flight.do("broken", failing_load))
+    assert not results and len(errors) == 8
+    assert all(str(e) == "out of memory" for e in errors)
+    assert flight.stats()["failures"] == 1
+
+    # Failures are not cached: the next caller tries again
+    assert flight.do("broken", lambda: "recovered") == "recovered"
+    print("✅ Concurrent loads deduplicated, failures shared and retried")
+
+
+if __name__ == "__main__":
+    test_single_flight()
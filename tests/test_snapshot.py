@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test the columnar memory snapshot format
+"""
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from tests.scenario import run_scenario
+
+
+def test_snapshot_roundtrip():
+    from src.infra.snapshot import iter_snapshot, read_manifest, write_snapshot
+
+    rng = np.random.default_rng(0)
+    chunks = []
+    for c in range(3):
+        n = 0 if c == 1 else 50  # empty pages are skipped
+        chunks.append({
+            "ids": [f"doc-{c}-{i}" for i in range(n)],
+            "documents": [f"memory {c}/{i} — ünïcode ✅" for i in range(n)],
+            "metadatas": [{"user_id": f"u{i % 3}", "n": i} for i in range(n)],
+            "embeddings": rng.standard_normal((n, 16)).astype(np.float32)
+        })
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "memory.npz")
+        print("Writing snapshot...")
+        manifest = write_snapshot(path, iter(chunks), {"embedder": "test-model"})
+        assert manifest["count"] == 100 and manifest["chunks"] == 2
+        assert not os.path.exists(path + ".tmp")
+        assert read_manifest(path)["embedder"] == "test-model"
+
+        print("Reading snapshot back...")
+        restored = list(iter_snapshot(path))
+        expected = [chunk for chunk in chunks if chunk["ids"]]
+        assert len(restored) == len(expected)
+        for got, want in zip(restored, expected):
+            assert got["ids"] == want["ids"]
+            assert got["documents"] == want["documents"]
+            assert got["metadatas"] == want["metadatas"]
+            assert got["embeddings"].dtype == np.float32
+            assert np.array_equal(got["embeddings"], want["embeddings"])
+    print("✅ Snapshot round trip preserved every column")
+
+
+def store_roundtrip(n=6000):
+    """export -> delete -> import against the configured store"""
+    from src.infra import vector_store
+    from src.infra.snapshot import export_memory, import_memory
+
+    texts = [f"snapshot test memory number {i}" for i in range(n)]
+    vector_store.add_contexts(texts, [{"test": True, "user_id": f"u{i % 2}"} for i in range(n)])
+    assert vector_store.get_shared_store().count() == n
+
+    path = os.path.join(os.environ["SCENARIO_TMP_DIR"], "memory.npz")
+    print("Exporting...")
+    assert export_memory(path)["count"] == n
+    assert vector_store.delete_where({"test": True}) == n
+    assert vector_store.get_shared_store().count() == 0
+
+    print("Importing...")
+    report = import_memory(path)
+    assert report["imported"] == n and report["duplicates"] == 0, report
+    assert vector_store.get_shared_store().count() == n
+    hit = vector_store.query_context(texts[123], top_k=1, user_id="u1")
+    assert hit["documents"][0][0] == texts[123]
+    assert import_memory(path)["duplicates"] == n
+
+
+def test_export_import_store():
+    # A fresh interpreter, so the backend setting takes effect
+    run_scenario(__file__, "store_roundtrip", VECTOR_STORE_BACKEND="chroma")
+    print("✅ Snapshot restored into a real store past Chroma's max batch size")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        globals()[sys.argv[1]]()
+    else:
+        test_snapshot_roundtrip()
+        test_export_import_store()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test speculative decoding bookkeeping and scheduler routing
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def test_speculative():
+    from src.agent import model_loader
+    from src.agent.model_loader import DraftModel, GenerationScheduler, get_draft_model
+
+    print("Counting accepted draft tokens...")
+    draft = DraftModel("main", "draft", object())
+    # 20 new tokens from 6 verification passes, 25 tokens proposed:
+    # 14 draft tokens were accepted
+    draft.record(new_tokens=20, target_passes=6, proposed=25)
+    # Draft rejected every time: one token per pass, nothing accepted
+    draft.record(new_tokens=5, target_passes=5, proposed=15)
+    stats = draft.stats()
+    assert stats["accepted_tokens"] == 14 and stats["proposed_tokens"] == 40
+    assert stats["acceptance_rate"] == 0.35
+    assert stats["tokens_per_pass"] == round(25 / 11, 2)
+
+    print("Routing lone requests to speculative decoding...")
+    model = object()
+    calls = []
+    scheduler = GenerationScheduler(
+        None, model, max_batch_size=4, max_wait_ms=0,
+        generate_fn=lambda t, m, prompts, limits: [f"batch {p}" for p in prompts]
+    )
+    scheduler._generate_speculative = lambda t, m, prompt, limit: calls.append(prompt) or f"spec {prompt}"
+    try:
+        assert scheduler.generate("a") == "batch a"
+        model_loader._drafts[id(model)] = draft
+        assert get_draft_model(model) is draft
+        assert scheduler.generate("b", user_id="alice") == "spec b"
+        assert calls == ["b"]
+        assert model_loader.get_generation_stats()["speculative"]["main"]["calls"] == 2
+    finally:
+        scheduler.stop()
+        model_loader.release_draft_model(model)
+    assert get_draft_model(model) is None
+    print("✅ Acceptance rate counted and lone requests decoded speculatively")
+
+
+if __name__ == "__main__":
+    test_speculative()
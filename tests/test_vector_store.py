@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Test memory writes and retrieval through src.infra.vector_store
+
+Each scenario runs in a fresh interpreter against a temporary numpy store
+with the offline hashing embedder, since the backend is chosen from the
+environment at import time.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tests.scenario import run_scenario
+
+
+def dedup_after_external_delete():
+    from src.infra import vector_store
+
+    text = "My car is a blue hatchback"
+    doc_id = vector_store.add_context(text, {"user_id": "alice"})
+    assert vector_store.add_context(text, {"user_id": "alice"}) == doc_id
+
+    # Deleted behind this process's back (another worker, compaction)
+    vector_store.get_shared_store().delete(ids=[doc_id])
+    new_id = vector_store.add_context(text, {"user_id": "alice"})
+    assert new_id != doc_id
+    assert vector_store.get_shared_store().count() == 1
+
+    print("Bounding the hash index...")
+    vector_store.add_contexts([f"note {i}" for i in range(50)])
+    assert len(vector_store._hash_index) <= vector_store.HASH_INDEX_MAX_ENTRIES == 20
+    # Hashes evicted from the index are still found in the store
+    results = vector_store.add_contexts([f"note {i}" for i in range(50)])
+    assert all(result["duplicate"] for result in results)
+
+
+def shared_memories_visible():
+    from src.infra import vector_store
+    from src.agent.agent import AgentState, retrieve_context_node
+
+    vector_store.add_contexts(["The team's pit crew changes four tyres in two seconds"])
+    vector_store.add_context("Bob prefers window seats on flights", {"user_id": "bob"})
+
+    state = AgentState()
+    state.user_input = "How fast does the pit crew change tyres?"
+    state.user_id = "alice"
+    state = retrieve_context_node(state)
+    assert any("pit crew" in text for text in state.retrieved_context), state.retrieved_context
+
+    # Shared items are visible, other users' items are not
+    results = vector_store.query_context("window seats on flights", top_k=5, user_id="alice")
+    assert not any("Bob" in doc for doc in results["documents"][0])
+    results = vector_store.query_context("pit crew tyres", top_k=5, user_id="bob")
+    assert len(results["documents"][0]) == 2
+    # Deletes scoped to a user never reach shared memories
+    assert vector_store.delete_where({"test": {"$ne": True}}, user_id="alice") == 0
+
+
+def legacy_records_migrated():
+    import numpy as np
+    from src.infra import vector_store
+
+    print("Writing records the way older versions did...")
+    texts = ["The paddock opens at nine on race day",
+             "Alice's garage pass is number 31"]
+    legacy_store = vector_store.get_shared_store()
+    embeddings = np.asarray(vector_store.get_embedder().encode(texts), dtype=np.float32)
+    legacy_store.add_batch(["legacy-0", "legacy-1"], texts, embeddings,
+                           [{"source": "manual"}, {"source": "manual", "user_id": "alice"}])
+    if vector_store.MEMORY_PARTITION_MODE == "filter":
+        results = vector_store.query_context("paddock race day", top_k=5, user_id="alice")
+        assert "legacy-0" not in results["ids"][0]
+
+    print("Backfilling user_id and content_hash...")
+    assert vector_store.backfill_legacy_metadata() >= 1
+    assert vector_store.backfill_legacy_metadata() == 0
+    results = vector_store.query_context("paddock race day", top_k=5, user_id="alice")
+    assert "legacy-0" in results["ids"][0], results
+    # Existing documents are detected as duplicates again
+    assert vector_store.add_context(texts[0]) == "legacy-0"
+    if vector_store.MEMORY_PARTITION_MODE != "collection":
+        # (in collection mode alice's legacy record is not in her collection)
+        assert vector_store.add_context(texts[1], {"user_id": "alice"}) == "legacy-1"
+
+    print("Deleting drops only the deleted hashes from the index...")
+    kept = vector_store.add_context("Box box, this lap", {"user_id": "alice"})
+    gone = vector_store.add_context("Stay out, stay out", {"user_id": "alice"})
+    before = len(vector_store._hash_index)
+    vector_store.delete_ids([gone], vector_store.get_store(vector_store.partition_for("alice")))
+    assert len(vector_store._hash_index) == before - 1
+    assert vector_store.add_context("Box box, this lap", {"user_id": "alice"}) == kept
+    assert vector_store.add_context("Stay out, stay out", {"user_id": "alice"}) != gone
+
+
+def lexical_index_in_sync():
+    from src.infra import vector_store
+
+    vector_store.add_contexts([f"Telemetry note {i} about brake wear" for i in range(5)],
+                              [{"user_id": "alice"}] * 5)
+    partition = vector_store.partition_for("alice")
+    # The first lookup only starts the build; queries skip keyword search meanwhile
+    assert vector_store.get_lexical_index(partition) is None
+    index = vector_store.get_lexical_index(partition, wait=True)
+    assert len(index) == 5, len(index)
+
+    print("Keeping the index current on add and delete...")
+    vector_store.add_context("Gearbox sensor calibration", {"user_id": "alice"})
+    assert len(index) == 6
+    assert vector_store.lexical_query("gearbox calibration", user_id="alice")["ids"][0]
+    assert vector_store.delete_where({"user_id": "alice"}, user_id="alice") == 6
+    assert len(index) == 0
+    assert vector_store.get_lexical_index(partition) is index
+
+    print("Skipping the index for partitions over LEXICAL_INDEX_MAX_DOCS...")
+    vector_store.add_contexts([f"Lap {i} split time" for i in range(12)],
+                              [{"user_id": "bob"}] * 12)
+    assert vector_store.get_lexical_index(vector_store.partition_for("bob"), wait=True) is None
+    assert vector_store.lexical_query("lap split", user_id="bob")["ids"] == [[]]
+
+
+def embedder_falls_back_without_sentence_transformers():
+    # None in sys.modules makes the import raise ImportError
+    sys.modules["sentence_transformers"] = None
+    from src.infra import vector_store
+    from src.infra.embedders import HashingEmbedder
+
+    assert isinstance(vector_store.get_embedder(), HashingEmbedder)
+    assert vector_store.embedder_model_id() == HashingEmbedder().model_id
+    assert vector_store.add_context("Fallback embeddings still store memories")
+
+
+def batch_size_checked():
+    from src.infra import vector_store
+
+    limit = vector_store.max_batch_size()
+    assert limit, "the chroma backend reports a max batch size"
+    vector_store.check_batch_size(None)
+    vector_store.check_batch_size(limit)
+    for bad in (0, limit + 1):
+        try:
+            vector_store.check_batch_size(bad)
+        except ValueError as e:
+            print(f"Rejected batch_size={bad}: {e}")
+        else:
+            raise AssertionError(f"batch_size={bad} was accepted")
+
+def result_cache_invalidated():
+    from src.infra import vector_store
+
+    vector_store.add_contexts(["Alice parks in bay 12", "Alice drinks green tea"],
+                              [{"user_id": "alice"}] * 2)
+    query = "Where is the new garage spot?"
+    first = vector_store.query_context(query, top_k=5, user_id="alice")
+    assert vector_store.query_context(query, top_k=5, user_id="alice") is first
+    assert vector_store._result_cache.stats()["hits"] == 1
+
+    print("Invalidating on a write to the partition...")
+    new_id = vector_store.add_context("The new garage spot is bay 40", {"user_id": "alice"})
+    after_add = vector_store.query_context(query, top_k=5, user_id="alice")
+    assert new_id in after_add["ids"][0] and new_id not in first["ids"][0]
+
+    print("Invalidating on a write to the shared partition...")
+    shared_id = vector_store.add_context("Visitors use garage spot 1")
+    assert shared_id in vector_store.query_context(query, top_k=5, user_id="alice")["ids"][0]
+
+    print("Invalidating on delete...")
+    vector_store.delete_ids([new_id], vector_store.get_store(vector_store.partition_for("alice")))
+    after_delete = vector_store.query_context(query, top_k=5, user_id="alice")
+    assert new_id not in after_delete["ids"][0] and len(after_delete["ids"][0]) == 3
+
+
+def paged_scans_and_deletes():
+    from src.infra import vector_store
+
+    vector_store.add_contexts([f"Pit stop {i} took {20 + i} seconds" for i in range(10)],
+                              [{"user_id": "alice", "test": i % 2 == 0} for i in range(10)])
+    vector_store.add_context("Bob's pit stop note", {"user_id": "bob", "test": True})
+
+    print("Scanning a partition in pages...")
+    pages = list(vector_store.scan_memory(page_size=3, user_id="alice",
+                                          include=["documents"]))
+    assert [len(page["ids"]) for page in pages] == [3, 3, 3, 1], pages
+    ids = [doc_id for page in pages for doc_id in page["ids"]]
+    assert len(set(ids)) == 10
+    assert all(doc.startswith("Pit stop") for page in pages for doc in page["documents"])
+    # Unscoped scans walk every store (one per user in collection mode)
+    pages = list(vector_store.scan_memory(where={"test": True}, page_size=2))
+    assert sum(len(page["ids"]) for page in pages) == 6 and len(pages) >= 3
+
+    print("Deleting across several batches...")
+    assert vector_store.delete_where({"test": True}, batch_size=2, user_id="alice") == 5
+    remaining = vector_store.get_store(vector_store.partition_for("alice")).get(
+        where={"user_id": "alice"}, include=["metadatas"])
+    assert len(remaining["ids"]) == 5
+    assert not any(meta["test"] for meta in remaining["metadatas"])
+    # Other users' matching memories are out of scope
+    assert vector_store.delete_where({"test": True}, batch_size=2) == 1
+
+
+def test_dedup_after_external_delete():
+    print("Re-adding a document deleted by another process...")
+    run_scenario(__file__, "dedup_after_external_delete", HASH_INDEX_MAX_ENTRIES="20")
+    print("✅ Stale hash-index entries are detected and the index is bounded")
+
+
+def test_shared_memories_visible():
+    for mode in ("filter", "collection"):
+        print(f"Retrieving shared memories in {mode} mode...")
+        run_scenario(__file__, "shared_memories_visible", MEMORY_PARTITION_MODE=mode)
+    print("✅ Memories stored without a user_id are retrieved for every user")
+
+
+def test_legacy_records_migrated():
+    for backend in ("numpy", "chroma"):
+        print(f"Migrating legacy records on the {backend} backend...")
+        run_scenario(__file__, "legacy_records_migrated", VECTOR_STORE_BACKEND=backend)
+    run_scenario(__file__, "legacy_records_migrated", MEMORY_PARTITION_MODE="collection")
+    print("✅ Legacy memories become visible and deduplicated after the backfill")
+
+
+def test_lexical_index_in_sync():
+    for mode in ("filter", "collection"):
+        print(f"Building keyword indexes in {mode} mode...")
+        run_scenario(__file__, "lexical_index_in_sync", MEMORY_PARTITION_MODE=mode,
+                     LEXICAL_INDEX_MAX_DOCS="10")
+    print("✅ Keyword indexes build off the request path, stay in sync and are bounded")
+
+
+def test_embedder_falls_back_without_sentence_transformers():
+    print("Loading the default embedder without sentence-transformers...")
+    run_scenario(__file__, "embedder_falls_back_without_sentence_transformers",
+                 EMBEDDER_BACKEND="sentence-transformers")
+    print("✅ A missing sentence-transformers falls back to the hashing embedder")
+
+
+def test_batch_size_checked():
+    print("Checking batch sizes against the chroma store's limit...")
+    run_scenario(__file__, "batch_size_checked", VECTOR_STORE_BACKEND="chroma")
+    print("✅ Batch sizes over the store's max are rejected (400 from /memory/add_batch)")
+
+
+def test_result_cache_invalidated():
+    for mode in ("filter", "collection"):
+        print(f"Caching query results in {mode} mode...")
+        run_scenario(__file__, "result_cache_invalidated", MEMORY_PARTITION_MODE=mode)
+    print("✅ Cached query results are dropped after writes and deletes")
+
+
+def test_paged_scans_and_deletes():
+    for mode in ("filter", "collection"):
+        print(f"Paging through memories in {mode} mode...")
+        run_scenario(__file__, "paged_scans_and_deletes", MEMORY_PARTITION_MODE=mode)
+    print("✅ Scans and filtered deletes cover every page")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        globals()[sys.argv[1]]()
+    else:
+        test_dedup_after_external_delete()
+        test_shared_memories_visible()
+        test_legacy_records_migrated()
+        test_lexical_index_in_sync()
+        test_embedder_falls_back_without_sentence_transformers()
+        test_batch_size_checked()
+        test_result_cache_invalidated()
+        test_paged_scans_and_deletes()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test the write-behind memory queue with a fake writer
+"""
+import sys
+import os
+import contextlib
+import io
+import threading
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+class FakeWriter:
+    """Records each write call; texts in ``poison`` make a write fail"""
+    def __init__(self, poison=()):
+        self.calls = []
+        self.poison = set(poison)
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, texts, metadatas):
+        self.gate.wait()
+        if self.poison.intersection(texts):
+            raise ValueError("bad metadata")
+        self.calls.append(list(texts))
+
+
+def test_write_queue():
+    from src.infra.write_queue import MemoryWriteQueue
+
+    print("Flushing once flush_size items are waiting...")
+    writer = FakeWriter()
+    writes = MemoryWriteQueue(writer, flush_size=4, flush_interval=10)
+    for i in range(8):
+        writes.submit(f"m{i}")
+    writes.flush()
+    assert writer.calls == [["m0", "m1", "m2", "m3"], ["m4", "m5", "m6", "m7"]]
+    writes.stop()
+
+    print("Flushing a partial batch after flush_interval...")
+    writer = FakeWriter()
+    writes = MemoryWriteQueue(writer, flush_size=100, flush_interval=0.1)
+    writes.submit("lonely")
+    time.sleep(0.3)
+    assert writer.calls == [["lonely"]]
+
+    print("Writing what is pending on stop...")
+    writes.flush_interval = 10
+    writes.submit("a")
+    writes.submit("b")
+    writes.stop()
+    assert writer.calls[-1] == ["a", "b"]
+    assert writes.stats()["written"] == 3 and writes.stats()["pending"] == 0
+
+    print("Writing inline when the queue is full...")
+    writer = FakeWriter()
+    writer.gate.clear()  # the worker blocks on its first write
+    writes = MemoryWriteQueue(writer, max_pending=1, flush_size=1,
+                              flush_interval=0, put_timeout=0.05)
+    writes.submit("first")  # taken by the worker, which then blocks
+    time.sleep(0.1)
+    assert writes.submit("queued")
+    inline = threading.Thread(target=lambda: writes.submit("inline"))
+    inline.start()
+    time.sleep(0.2)
+    writer.gate.set()
+    inline.join()
+    writes.stop()
+    assert writes.stats()["inline_writes"] == 1
+    assert sorted(sum(writer.calls, [])) == ["first", "inline", "queued"]
+
+    print("Retrying a failed batch item by item...")
+    writer = FakeWriter(poison={"bad"})
+    writes = MemoryWriteQueue(writer, flush_size=3, flush_interval=10)
+    for text in ("good 1", "bad", "good 2"):
+        writes.submit(text)
+    writes.stop()
+    assert writer.calls == [["good 1"], ["good 2"]]
+    stats = writes.stats()
+    assert stats["written"] == 2 and stats["dropped"] == 1 and stats["errors"] == 2
+
+    print("Reporting a failed batch in one line...")
+    writer = FakeWriter(poison={"bad 1", "bad 2", "bad 3"})
+    writes = MemoryWriteQueue(writer, flush_size=4, flush_interval=10)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for text in ("bad 1", "bad 2", "bad 3", "good"):
+            writes.submit(text)
+        writes.stop()
+    assert out.getvalue().count("write-behind error") == 1, out.getvalue()
+    assert "dropped 3 of 4 items" in out.getvalue()
+    assert writes.stats()["dropped"] == 3 and writer.calls == [["good"]]
+    print("✅ Write-behind queue batches, flushes, falls back inline and isolates bad items")
+
+
+if __name__ == "__main__":
+    test_write_queue()